@@ -3,15 +3,20 @@
 import { ChatSection as ChatSectionUI } from "@llamaindex/chat-ui";
 import "@llamaindex/chat-ui/styles/markdown.css";
 import "@llamaindex/chat-ui/styles/pdf.css";
+import { generateId } from "ai";
 import { useChat } from "ai/react";
+import { useState } from "react";
 import CustomChatInput from "./ui/chat/chat-input";
 import CustomChatMessages from "./ui/chat/chat-messages";
 import { useClientConfig } from "./ui/chat/hooks/use-config";
 
 export default function ChatSection() {
   const { backend } = useClientConfig();
+  // Random id of this chat, so the backend keeps its state (e.g. the code sandbox) between messages
+  const [chatId] = useState(() => generateId());
   const handler = useChat({
     api: `${backend}/api/chat`,
+    body: { id: chatId },
     onError: (error: unknown) => {
       if (!(error instanceof Error)) throw error;
       let errorMessage: string;
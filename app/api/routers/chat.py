@@ -1,13 +1,13 @@
+import asyncio
+import json
 import logging
 import os
-import json
-import requests
+import time
+from collections import ChainMap
+from typing import Dict, List, Optional
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
 from llama_index.core.llms import MessageRole
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient
-import pandas as pd
-from pandas import DataFrame
 
 from app.api.routers.events import EventCallbackHandler
 from app.api.routers.models import (
@@ -18,9 +18,32 @@ from app.api.routers.models import (
     Result,
     SourceNodes,
 )
-from app.api.routers.vercel_response import VercelStreamResponse
+from app.api.routers.vercel_response import (
+    VercelStreamResponse,
+    VercelTextStreamResponse,
+)
 from app.engine.engine import get_chat_engine
 from app.engine.query_filter import generate_filters
+from app.services.budget import get_token_budget
+from app.services.context import (
+    ContextProvider,
+    get_context_pipeline,
+    register_context_provider,
+)
+from app.services.hass.deltas import get_hass_entity_delta_tracker
+from app.services.hass.descriptions import (
+    HassEntityDescriptions,
+    get_hass_entity_descriptions,
+)
+from app.services.hass.intents import HassIntent, get_hass_intent_router
+from app.services.hass.projection import encode_entities
+from app.services.hass.retrieval import get_hass_entity_retriever
+from app.services.hass.state import get_hass_state_mirror
+from app.services.influxdb.cache import get_influxdb_query_cache
+from app.services.influxdb.client import get_influxdb_pool
+from app.services.influxdb.queries import InfluxDBQueryConfig, load_influxdb_queries
+from app.services.influxdb.summary import StreamingSummary, downsample_query
+from app.services.sandbox import SandboxSession, get_conversation_id
 
 chat_router = r = APIRouter()
 
@@ -28,129 +51,190 @@ logger = logging.getLogger("uvicorn")
 
 load_dotenv()
 
-def fetch_ha_entities():
-    url = os.getenv('HASS_API_URL')
-    if not url:
-        raise ValueError("HASS_API_URL is not set in the environment variables")
-    token = os.getenv('HASS_TOKEN')
-    if not token:
-        raise ValueError("HASS_TOKEN  is not set in the environment variables")
-
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(url, headers=headers, verify=False)
-    response.raise_for_status()
-    return response.json()
-
-def load_ha_entity_descriptions(file_path):
-    with open(file_path, 'r') as file:
-        return json.load(file)
-
-def combine_ha_entities_with_descriptions(entities, descriptions):
-    description_dict = {desc["entity_id"]: desc["entity_metadata"] for desc in descriptions}
+HASS_READY_TIMEOUT = 5
+
+async def fetch_ha_entities():
+    mirror = get_hass_state_mirror()
+    if mirror is None:
+        raise ValueError("The Home Assistant state mirror is not running")
+    # Esperar a la primera sincronización del espejo si el servidor acaba de arrancar
+    if not await mirror.wait_until_ready(timeout=HASS_READY_TIMEOUT):
+        logger.warning("Home Assistant states are not synchronized yet")
+    return mirror.get_states()
+
+def combine_ha_entities_with_descriptions(entities, descriptions: HassEntityDescriptions):
     combined = []
     for entity in entities:
-        entity_id = entity["entity_id"]
-        if entity_id in description_dict:
-            combined_entity = entity.copy()
-            combined_entity["entity_metadata"] = description_dict[entity_id]
-            combined.append(combined_entity)
+        entity_metadata = descriptions.get(entity["entity_id"])
+        if entity_metadata is not None:
+            # Vista de la entidad con su descripción, sin copiar el diccionario completo
+            combined.append(ChainMap({"entity_metadata": entity_metadata}, entity))
     return combined
 
-def process_ha_rest_entities(data: ChatData):
+async def process_ha_rest_entities(data: ChatData) -> List[Annotation]:
     # Convertir la variable de entorno USE_API a un booleano
     use_api = os.getenv('USE_HASS_API', 'false').lower() in ('true', '1', 't', 'y', 'yes')
-    if use_api:
-        # Obtener las entidades desde la llamada al API REST a Home Assistant
-        entidades = fetch_ha_entities()        
-
-        # Cargar las descripciones de las entidades desde el archivo JSON
-        entidades_descripcion = load_ha_entity_descriptions('hass-entities.json')      
-
-        # Combinar las entidades con sus descripciones, eliminando las que no tengan descripción
-        entidades_combinadas = combine_ha_entities_with_descriptions(entidades, entidades_descripcion)
-        
-        agent_description = os.getenv('HASS_AGENT_DESCRIPTION', 'agent')
-
-        # Añadir la anotación de tipo agent con el contenido de las entidades combinadas
-        agent_annotation = Annotation(
-            type="agent",
-            data=AgentAnnotation(
-                agent=agent_description,
-                text=str(entidades_combinadas)
-            )
-        )
+    if not use_api:
+        return []
+    # Obtener las entidades desde el espejo en memoria de Home Assistant (sin llamadas de red)
+    entidades = await fetch_ha_entities()
+
+    # Obtener las descripciones de las entidades (el archivo JSON solo se recarga si cambia)
+    entidades_descripcion = get_hass_entity_descriptions()
 
-        # Añadir la anotación al último mensaje del usuario
-        if data.messages and data.messages[-1].role == MessageRole.USER:
-            if data.messages[-1].annotations is None:
-                data.messages[-1].annotations = []
-            data.messages[-1].annotations.append(agent_annotation)
-
-def fetch_influxdb_data(bucket: str, org: str, query: str):
-    url = os.getenv('IDB_API_URL')
-    if not url:
-        raise ValueError("IDB_API_URL is not set in the environment variables")
-    token = os.getenv('IDB_TOKEN')
-    if not token:
-        raise ValueError("IDB_TOKEN is not set in the environment variables")
-    client = InfluxDBClient(url=url, token=token, org=org, verify_ssl=False)
-    query_api = client.query_api()
-    data_frame = query_api.query_data_frame(query)
-
-    if isinstance(data_frame, DataFrame):
-            return data_frame.to_json(orient="records")
-    else:
-        return ''
+    # Combinar las entidades con sus descripciones, eliminando las que no tengan descripción
+    entidades_combinadas = combine_ha_entities_with_descriptions(entidades, entidades_descripcion)
+
+    # Seleccionar solo las entidades relevantes para la pregunta del usuario
+    entidades_combinadas = await get_hass_entity_retriever().aselect(
+        data.messages[-1].content, entidades_combinadas, render=encode_entities
+    )
     
-def process_influxdb_entities(data: ChatData):
-    queries = [
-        {
-            "use_api": os.getenv('USE_IDB_API_1', 'false').lower() in ('true', '1', 't', 'y', 'yes'),
-            "bucket": os.getenv('IDB_BUCKET_1'),
-            "org": os.getenv('IDB_ORG_1'),
-            "query": os.getenv('IDB_QUERY_1'),
-            "agent_description": os.getenv('IDB_AGENT_DESCRIPTION_1', 'agent'),
-            "bucket_name": 'IDB_BUCKET_1',
-            "org_name": 'IDB_ORG_1',
-            "query_name": 'IDB_QUERY_1'
-        },
-        {
-            "use_api": os.getenv('USE_IDB_API_2', 'false').lower() in ('true', '1', 't', 'y', 'yes'),
-            "bucket": os.getenv('IDB_BUCKET_2'),
-            "org": os.getenv('IDB_ORG_2'),
-            "query": os.getenv('IDB_QUERY_2'),
-            "agent_description": os.getenv('IDB_AGENT_DESCRIPTION_2', 'agent'),
-            "bucket_name": 'IDB_BUCKET_2',
-            "org_name": 'IDB_ORG_2',
-            "query_name": 'IDB_QUERY_2'
-        }
+    agent_description = os.getenv('HASS_AGENT_DESCRIPTION', 'agent')
+
+    # Anotaciones de entidades ya enviadas en los mensajes anteriores de la conversación
+    anotaciones_previas = [
+        annotation.data.text
+        for message in data.messages[:-1]
+        if message.role == MessageRole.USER and message.annotations
+        for annotation in message.annotations
+        if isinstance(annotation.data, AgentAnnotation)
+        and annotation.data.agent == agent_description
     ]
+    params = data.data if isinstance(data.data, dict) else {}
 
-    for query_config in queries:
-        if query_config["use_api"]:
-            if not query_config["bucket"]:
-                raise ValueError(f"{query_config['bucket_name']} is not set in the environment variables")
-            if not query_config["org"]:
-                raise ValueError(f"{query_config['org_name']} is not set in the environment variables")
-            if not query_config["query"]:
-                raise ValueError(f"{query_config['query_name']} is not set in the environment variables")
-            
-            entities = fetch_influxdb_data(query_config["bucket"], query_config["org"], query_config["query"])
-            agent_annotation = Annotation(
-                type="agent",
-                data=AgentAnnotation(
-                    agent=query_config["agent_description"],
-                    text=entities
-                )
+    # Crear la anotación de tipo agent con el contenido de las entidades combinadas
+    # en formato tabular compacto (solo los campos útiles de cada dominio).
+    # En los turnos siguientes solo se envían las entidades que han cambiado.
+    agent_annotation = Annotation(
+        type="agent",
+        data=AgentAnnotation(
+            agent=agent_description,
+            text=get_hass_entity_delta_tracker().render(
+                entidades_combinadas,
+                anotaciones_previas,
+                full_refresh=bool(params.get("hass_full_refresh")),
             )
+        )
+    )
+    return [agent_annotation]
+
+async def process_hass_fast_path(data: ChatData) -> Optional[HassIntent]:
+    # Ejecutar directamente las órdenes simples y sin ambigüedad (ej: "apaga la luz del salón")
+    # sin pasar por el agente. Si no se puede, se devuelve None y responde el agente.
+    intent_router = get_hass_intent_router()
+    if intent_router is None or not data.messages or data.messages[-1].role != MessageRole.USER:
+        return None
+    return await intent_router.handle(data.messages[-1].content)
+
+def record_agent_request(start: float):
+    intent_router = get_hass_intent_router()
+    if intent_router is not None:
+        intent_router.record_agent_request(start)
+
+async def query_influxdb_data(query_config: InfluxDBQueryConfig, query: str):
+    # Los registros se procesan a medida que llegan, sin cargar el resultado completo en memoria
+    if query_config.summary:
+        # Resumen estadístico de cada serie en lugar de todas las filas
+        summary = StreamingSummary(query_config.sparkline_points)
+        await get_influxdb_pool().query_stream(query_config.org, query, summary.add)
+        return summary.get_text()
+    rows = []
+    await get_influxdb_pool().query_stream(query_config.org, query, rows.append)
+    return json.dumps(rows, default=str, ensure_ascii=False)
+
+async def fetch_influxdb_data(query_config: InfluxDBQueryConfig):
+    # Reducir en el servidor el número de puntos de cada serie al presupuesto de la consulta
+    # (solo en las consultas que lo activan con max_points)
+    max_points = query_config.max_points
+    query = downsample_query(query_config.query, max_points) if max_points else query_config.query
+    # Los resultados se sirven desde la caché y se refrescan en segundo plano al caducar
+    return await get_influxdb_query_cache().get(
+        query_config.org,
+        query_config.bucket,
+        query,
+        lambda: query_influxdb_data(query_config, query),
+        summary=query_config.summary,
+        sparkline_points=query_config.sparkline_points,
+    )
+    
+async def fetch_influxdb_annotation(query_config: InfluxDBQueryConfig):
+    # Cada consulta tiene su propio plazo: si no responde a tiempo se omite del contexto
+    # (la consulta sigue en segundo plano y su resultado queda en la caché)
+    deadline = query_config.timeout or get_influxdb_pool().query_timeout
+    try:
+        entities = await asyncio.wait_for(
+            fetch_influxdb_data(query_config),
+            timeout=deadline,
+        )
+    except TimeoutError:
+        logger.warning(f"InfluxDB query {query_config.name} took longer than {deadline}s, leaving it out of the context")
+        return None
+    except Exception:
+        # Una consulta con error (bucket inexistente, error HTTP...) no impide el resto del contexto
+        logger.exception(f"InfluxDB query {query_config.name} failed, leaving it out of the context")
+        return None
+    return Annotation(
+        type="agent",
+        data=AgentAnnotation(
+            agent=query_config.agent_description,
+            text=entities
+        )
+    )
+
+async def process_influxdb_entities(data: ChatData) -> List[Annotation]:
+    # Con la herramienta influxdb el agente consulta el histórico solo cuando lo necesita,
+    # y las consultas fijas en cada mensaje se pueden desactivar
+    eager_context = os.getenv('IDB_EAGER_CONTEXT', 'true').lower() in ('true', '1', 't', 'y', 'yes')
+    if not eager_context:
+        return []
+    # Ejecutar todas las consultas configuradas en paralelo
+    annotations = await asyncio.gather(
+        *[fetch_influxdb_annotation(query_config) for query_config in load_influxdb_queries()]
+    )
+    return [annotation for annotation in annotations if annotation is not None]
+
+def add_annotations(data: ChatData, annotations):
+    # Añadir las anotaciones al último mensaje del usuario
+    if annotations and data.messages and data.messages[-1].role == MessageRole.USER:
+        if data.messages[-1].annotations is None:
+            data.messages[-1].annotations = []
+        data.messages[-1].annotations.extend(annotations)
+
+# Fuentes de contexto del agente. Para añadir otra fuente basta con registrar su proveedor:
+# todos se ejecutan a la vez, cada uno con su propio plazo
+register_context_provider(ContextProvider("hass", process_ha_rest_entities))
+register_context_provider(ContextProvider("influxdb", process_influxdb_entities))
 
-            if data.messages and data.messages[-1].role == MessageRole.USER:
-                if data.messages[-1].annotations is None:
-                    data.messages[-1].annotations = []
-                data.messages[-1].annotations.append(agent_annotation)
+async def process_context(data: ChatData) -> Dict[str, List[Annotation]]:
+    context = await get_context_pipeline().run(data)
+    add_annotations(data, [annotation for annotations in context.values() for annotation in annotations])
+    return context
+
+def get_chat_messages(data: ChatData, context: Dict[str, List[Annotation]]):
+    # Ajustar el mensaje con el contexto y el historial a la ventana de contexto del modelo
+    return get_token_budget().build_messages(data, os.getenv("SYSTEM_PROMPT"), context)
+
+def get_sandbox_session(data: ChatData) -> SandboxSession:
+    # El intérprete de código usa el sandbox que se guardó al terminar el mensaje anterior del mismo chat.
+    # Sin el id del chat del cliente no se guarda, para no compartirlo entre conversaciones idénticas
+    if not data.id:
+        return SandboxSession()
+    return SandboxSession(
+        get_conversation_id(data.id, ((message.role.value, message.content) for message in data.messages[:-1]))
+    )
+
+async def release_sandbox_session(session: SandboxSession, data: ChatData, answer: Optional[str]):
+    # Se guarda el sandbox para el siguiente mensaje de la conversación (si hay respuesta),
+    # o se limpia y se devuelve al pool, sin bloquear el bucle de eventos
+    conversation_id = None
+    if data.id and answer is not None:
+        conversation_id = get_conversation_id(
+            data.id,
+            [(message.role.value, message.content) for message in data.messages]
+            + [(MessageRole.ASSISTANT.value, answer)],
+        )
+    await session.aclose(conversation_id)
 
 # streaming endpoint - delete if not needed
 @r.post("")
@@ -160,11 +244,18 @@ async def chat(
     background_tasks: BackgroundTasks,
 ):
     try:
-        process_ha_rest_entities(data)
-        process_influxdb_entities(data)
+        start = time.perf_counter()
+        intent = await process_hass_fast_path(data)
+        if intent is not None:
+            return VercelTextStreamResponse(
+                intent.confirmation,
+                events=[
+                    f"Calling service: {intent.domain}.{intent.service} on {', '.join(intent.entity_ids)}"
+                ],
+            )
 
-        last_message_content = data.get_last_message_content()
-        messages = data.get_history_messages()
+        context = await process_context(data)
+        last_message_content, messages = get_chat_messages(data, context)
 
         doc_ids = data.get_chat_document_ids()
         filters = generate_filters(doc_ids)
@@ -173,13 +264,24 @@ async def chat(
             f"Creating chat engine with filters: {str(filters)}",
         )
         event_handler = EventCallbackHandler()
+        sandbox_session = get_sandbox_session(data)
         chat_engine = get_chat_engine(
-            filters=filters, params=params, event_handlers=[event_handler]
+            filters=filters,
+            params=params,
+            event_handlers=[event_handler],
+            sandbox_session=sandbox_session,
         )
         response = chat_engine.astream_chat(last_message_content, messages)
 
+        # Las tareas en segundo plano se ejecutan al terminar de enviar la respuesta
+        background_tasks.add_task(record_agent_request, start)
         return VercelStreamResponse(
-            request, event_handler, response, data, background_tasks
+            request,
+            event_handler,
+            response,
+            data,
+            background_tasks,
+            on_complete=lambda answer: release_sandbox_session(sandbox_session, data, answer),
         )
     except Exception as e:
         logger.exception("Error in chat engine", exc_info=True)
@@ -193,12 +295,16 @@ async def chat(
 async def chat_request(
     data: ChatData,
 ) -> Result:
-    
-    process_ha_rest_entities(data)
-    process_influxdb_entities(data)
+    start = time.perf_counter()
+    intent = await process_hass_fast_path(data)
+    if intent is not None:
+        return Result(
+            result=Message(role=MessageRole.ASSISTANT, content=intent.confirmation),
+            nodes=[],
+        )
 
-    last_message_content = data.get_last_message_content()
-    messages = data.get_history_messages()
+    context = await process_context(data)
+    last_message_content, messages = get_chat_messages(data, context)
 
     doc_ids = data.get_chat_document_ids()
     filters = generate_filters(doc_ids)
@@ -207,9 +313,16 @@ async def chat_request(
         f"Creating chat engine with filters: {str(filters)}",
     )
 
-    chat_engine = get_chat_engine(filters=filters, params=params)
+    sandbox_session = get_sandbox_session(data)
+    chat_engine = get_chat_engine(filters=filters, params=params, sandbox_session=sandbox_session)
 
-    response = await chat_engine.achat(last_message_content, messages)
+    answer = None
+    try:
+        response = await chat_engine.achat(last_message_content, messages)
+        answer = response.response
+    finally:
+        await release_sandbox_session(sandbox_session, data, answer)
+    record_agent_request(start)
     return Result(
         result=Message(role=MessageRole.ASSISTANT, content=response.response),
         nodes=SourceNodes.from_source_nodes(response.source_nodes),
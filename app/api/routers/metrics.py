@@ -0,0 +1,15 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from app.services.metrics import collect_metrics
+
+metrics_router = r = APIRouter()
+
+
+@r.get("")
+async def metrics() -> Dict[str, Dict[str, Any]]:
+    """
+    Get the performance counters of the background services.
+    """
+    return collect_metrics()
@@ -111,6 +111,10 @@ class Message(BaseModel):
 class ChatData(BaseModel):
     messages: List[Message]
     data: Any = None
+    id: Optional[str] = Field(
+        default=None,
+        description="Random id of the chat generated by the client, to keep its state between messages",
+    )
 
     class Config:
         json_schema_extra = {
@@ -1,6 +1,6 @@
 import json
 import logging
-from typing import Awaitable, List
+from typing import Awaitable, Callable, List, Optional
 
 from aiostream import stream
 from fastapi import BackgroundTasks, Request
@@ -31,9 +31,14 @@ class VercelStreamResponse(StreamingResponse):
         response: Awaitable[StreamingAgentChatResponse],
         chat_data: ChatData,
         background_tasks: BackgroundTasks,
+        on_complete: Optional[Callable[[Optional[str]], Awaitable[None]]] = None,
     ):
+        """
+        Args:
+            on_complete: Called when the stream ends with the final answer (None if it wasn't completed).
+        """
         content = VercelStreamResponse.content_generator(
-            request, event_handler, response, chat_data, background_tasks
+            request, event_handler, response, chat_data, background_tasks, on_complete
         )
         super().__init__(content=content)
 
@@ -45,9 +50,11 @@ class VercelStreamResponse(StreamingResponse):
         response: Awaitable[StreamingAgentChatResponse],
         chat_data: ChatData,
         background_tasks: BackgroundTasks,
+        on_complete: Optional[Callable[[Optional[str]], Awaitable[None]]] = None,
     ):
+        final_responses: List[str] = []
         chat_response_generator = cls._chat_response_generator(
-            response, background_tasks, event_handler, chat_data
+            response, background_tasks, event_handler, chat_data, final_responses
         )
         event_generator = cls._event_generator(event_handler)
 
@@ -74,6 +81,8 @@ class VercelStreamResponse(StreamingResponse):
         finally:
             # Ensure event handler is marked as done even if connection breaks
             event_handler.is_done = True
+            if on_complete is not None:
+                await on_complete(final_responses[0] if final_responses else None)
 
     @classmethod
     async def _event_generator(cls, event_handler: EventCallbackHandler):
@@ -92,6 +101,7 @@ class VercelStreamResponse(StreamingResponse):
         background_tasks: BackgroundTasks,
         event_handler: EventCallbackHandler,
         chat_data: ChatData,
+        final_responses: Optional[List[str]] = None,
     ):
         """
         Yield the text response and source nodes from the chat engine
@@ -119,6 +129,8 @@ class VercelStreamResponse(StreamingResponse):
         async for token in result.async_response_gen():
             final_response += token
             yield cls.convert_text(token)
+        if final_responses is not None:
+            final_responses.append(final_response)
 
         # Generate next questions if next question prompt is configured
         question_data = await cls._generate_next_questions(
@@ -175,3 +187,22 @@ class VercelStreamResponse(StreamingResponse):
                 "data": questions,
             }
         return None
+
+
+class VercelTextStreamResponse(StreamingResponse):
+    """
+    Class to stream an answer that doesn't come from the chat engine in the format expected by Vercel
+    """
+
+    def __init__(self, text: str, events: Optional[List[str]] = None):
+        content = VercelTextStreamResponse.content_generator(text, events or [])
+        super().__init__(content=content)
+
+    @staticmethod
+    async def content_generator(text: str, events: List[str]):
+        yield VercelStreamResponse.convert_text("")
+        for title in events:
+            yield VercelStreamResponse.convert_data(
+                {"type": "events", "data": {"title": title}}
+            )
+        yield VercelStreamResponse.convert_text(text)
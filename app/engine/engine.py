@@ -7,11 +7,11 @@ from llama_index.core.settings import Settings
 from llama_index.core.tools import BaseTool
 
 from app.engine.index import IndexConfig, get_index
-from app.engine.tools import ToolFactory
+from app.engine.tools import get_tool_registry
 from app.engine.tools.query_engine import get_query_engine_tool
 
 
-def get_chat_engine(params=None, event_handlers=None, **kwargs):
+def get_chat_engine(params=None, event_handlers=None, sandbox_session=None, **kwargs):
     system_prompt = os.getenv("SYSTEM_PROMPT")
     tools: List[BaseTool] = []
     callback_manager = CallbackManager(handlers=event_handlers or [])
@@ -23,8 +23,10 @@ def get_chat_engine(params=None, event_handlers=None, **kwargs):
         query_engine_tool = get_query_engine_tool(index, **kwargs)
         tools.append(query_engine_tool)
 
-    # Add additional tools
-    configured_tools: List[BaseTool] = ToolFactory.from_env()
+    # Add additional tools (built once and shared by all the requests, except the ones with
+    # per-request state like the code interpreter, which uses the sandbox of the conversation)
+    request_kwargs = {"sandbox_session": sandbox_session} if sandbox_session is not None else {}
+    configured_tools: List[BaseTool] = get_tool_registry().get_tools(**request_kwargs)
     tools.extend(configured_tools)
 
     return AgentRunner.from_llm(
@@ -7,6 +7,7 @@ import logging
 import os
 
 from app.engine.loaders import get_documents
+from app.engine.vector_stores import get_storage_context
 from app.settings import init_settings
 from llama_index.core.indices import (
     VectorStoreIndex,
@@ -25,8 +26,10 @@ def generate_datasource():
     # Set private=false to mark the document as public (required for filtering)
     for doc in documents:
         doc.metadata["private"] = "false"
+    # The vector store is selected with VECTOR_STORE (simple, hnsw or numpy)
     index = VectorStoreIndex.from_documents(
         documents,
+        storage_context=get_storage_context(),
         show_progress=True,
     )
     # store it for later
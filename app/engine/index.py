@@ -1,14 +1,22 @@
+import asyncio
+import copy
 import logging
 import os
-from datetime import timedelta
-from typing import Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
 
-from cachetools import TTLCache, cached  # type: ignore
+from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.callbacks import CallbackManager
-from llama_index.core.indices import load_index_from_storage
-from llama_index.core.storage import StorageContext
+from llama_index.core.indices import VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings
 from pydantic import BaseModel, Field
 
+from app.engine.vector_stores import get_storage_context
+from app.services.metrics import register_metrics
+
 logger = logging.getLogger("uvicorn")
 
 
@@ -18,26 +26,224 @@ class IndexConfig(BaseModel):
     )
 
 
+class ReadWriteLock:
+    """
+    Lock shared by any number of readers or held by a single writer.
+    Waiting writers go first, so that a steady flow of queries doesn't block the uploads.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class _ReadLockedRetriever(BaseRetriever):
+    """
+    Retriever of the shared index that reads the stores under the read lock. The query embedding
+    is computed before taking the lock, so the lock is only held for the in-memory search.
+    The lock is a threading one (the inserts run in worker threads), so the async retrieval waits
+    for it in a worker thread instead of blocking the event loop while an insert holds it.
+    """
+
+    def __init__(self, retriever: BaseRetriever, lock: ReadWriteLock):
+        super().__init__(callback_manager=retriever.callback_manager, object_map=retriever.object_map)
+        self._retriever = retriever
+        self._lock = lock
+
+    def _embed_query(self, query_bundle: QueryBundle) -> bool:
+        vector_store = getattr(self._retriever, "_vector_store", None)
+        return (
+            vector_store is not None
+            and vector_store.is_embedding_query
+            and query_bundle.embedding is None
+            and len(query_bundle.embedding_strs) > 0
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._embed_query(query_bundle):
+            query_bundle.embedding = self._retriever._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return self._locked_retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._embed_query(query_bundle):
+            query_bundle.embedding = await self._retriever._embed_model.aget_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        return await asyncio.to_thread(self._locked_retrieve, query_bundle)
+
+    def _locked_retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        with self._lock.read():
+            return self._retriever._retrieve(query_bundle)
+
+
+class _SharedVectorStoreIndex(VectorStoreIndex):
+    """
+    Per-request view of the shared index: same stores, but its own callback manager
+    and the retrieval runs under the read lock of the index
+    """
+
+    _lock: ReadWriteLock
+
+    def as_retriever(self, **kwargs: Any) -> BaseRetriever:
+        return _ReadLockedRetriever(super().as_retriever(**kwargs), self._lock)
+
+
+class SharedIndex:
+    """
+    The index of a storage directory, loaded once and shared by all the requests.
+
+    The persisted files are checked on each request, and the index is loaded again only when
+    they change (e.g. after running `generate.py`). Uploaded files are inserted in place under
+    the write lock and persisted, without reloading the index.
+    """
+
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+        self.lock = ReadWriteLock()
+        self._index: Optional[VectorStoreIndex] = None
+        self._signature: Optional[Tuple] = None
+        # Serializes the loads and the inserts (the write lock is only held to modify the stores)
+        self._writer = threading.Lock()
+
+        self._loads = 0
+        self._last_load_seconds = 0.0
+        self._views = 0
+        self._view_seconds = 0.0
+        self._inserts = 0
+
+    def _get_signature(self) -> Optional[Tuple]:
+        if not os.path.isdir(self.storage_dir):
+            return None
+        with os.scandir(self.storage_dir) as entries:
+            return tuple(
+                sorted(
+                    (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                    for entry in entries
+                    # The vector stores write to *.tmp files and rename them when done
+                    if entry.is_file() and not entry.name.endswith(".tmp")
+                )
+            )
+
+    def _load(self, signature: Optional[Tuple]):
+        if signature is None:
+            index = None
+        else:
+            logger.info(f"Loading index from {self.storage_dir}...")
+            start = time.perf_counter()
+            index = load_index_from_storage(get_storage_context(self.storage_dir))
+            self._loads += 1
+            self._last_load_seconds = time.perf_counter() - start
+            logger.info(f"Finished loading index from {self.storage_dir} in {self._last_load_seconds:.2f}s")
+        with self.lock.write():
+            self._index = index
+            self._signature = signature
+
+    def _reload_if_changed(self):
+        signature = self._get_signature()
+        if signature != self._signature:
+            self._load(signature)
+
+    def get(self) -> Optional[VectorStoreIndex]:
+        if self._get_signature() != self._signature:
+            with self._writer:
+                self._reload_if_changed()
+        return self._index
+
+    def get_view(self, callback_manager: Optional[CallbackManager] = None):
+        """
+        Get the index for a request, with the request's callback manager
+        """
+        index = self.get()
+        start = time.perf_counter()
+        if index is None or type(index) is not VectorStoreIndex:
+            return index
+        view = copy.copy(index)
+        view.__class__ = _SharedVectorStoreIndex
+        view._lock = self.lock
+        view._callback_manager = callback_manager or Settings.callback_manager
+        self._views += 1
+        self._view_seconds += time.perf_counter() - start
+        return view
+
+    def insert_nodes(self, nodes: List[BaseNode]):
+        """
+        Add the nodes to the index and persist it. The embeddings are computed before taking the lock.
+        """
+        nodes = Settings.embed_model(nodes)
+        with self._writer:
+            # Pick up the changes made by other processes before modifying the index
+            self._reload_if_changed()
+            with self.lock.write():
+                if self._index is None:
+                    self._index = VectorStoreIndex(nodes=nodes, storage_context=get_storage_context())
+                else:
+                    self._index.insert_nodes(nodes)
+            # Persisting only reads the stores, so the queries can go on meanwhile
+            with self.lock.read():
+                self._index.storage_context.persist(persist_dir=self.storage_dir)
+            self._signature = self._get_signature()
+            self._inserts += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "loads": self._loads,
+            "last_load_ms": round(self._last_load_seconds * 1000, 1),
+            "views": self._views,
+            "avg_view_ms": round(self._view_seconds / self._views * 1000, 3) if self._views else 0,
+            "inserts": self._inserts,
+        }
+
+
+_shared_indexes: Dict[str, SharedIndex] = {}
+_shared_indexes_lock = threading.Lock()
+
+
+def get_shared_index(storage_dir: Optional[str] = None) -> SharedIndex:
+    if storage_dir is None:
+        storage_dir = os.getenv("STORAGE_DIR", "storage")
+    with _shared_indexes_lock:
+        shared_index = _shared_indexes.get(storage_dir)
+        if shared_index is None:
+            shared_index = _shared_indexes[storage_dir] = SharedIndex(storage_dir)
+            register_metrics(f"index:{storage_dir}", shared_index.get_metrics)
+    return shared_index
+
+
 def get_index(config: IndexConfig = None):
     if config is None:
         config = IndexConfig()
-    storage_dir = os.getenv("STORAGE_DIR", "storage")
-    # check if storage already exists
-    if not os.path.exists(storage_dir):
-        return None
-    # load the existing index
-    logger.info(f"Loading index from {storage_dir}...")
-    storage_context = get_storage_context(storage_dir)
-    index = load_index_from_storage(
-        storage_context, callback_manager=config.callback_manager
-    )
-    logger.info(f"Finished loading index from {storage_dir}")
-    return index
-
-
-@cached(
-    TTLCache(maxsize=10, ttl=timedelta(minutes=5).total_seconds()),
-    key=lambda *args, **kwargs: "global_storage_context",
-)
-def get_storage_context(persist_dir: str) -> StorageContext:
-    return StorageContext.from_defaults(persist_dir=persist_dir)
+    # The index is loaded once and reused, only reloaded when the persisted files change
+    return get_shared_index().get_view(config.callback_manager)
@@ -1,11 +1,20 @@
 import importlib
+import logging
 import os
-from typing import Dict, List, Union
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import yaml  # type: ignore
 from llama_index.core.tools.function_tool import FunctionTool
 from llama_index.core.tools.tool_spec.base import BaseToolSpec
 
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+CONFIG_FILE = "config/tools.yaml"
+
 
 class ToolType:
     LLAMAHUB = "llamahub"
@@ -42,6 +51,21 @@ class ToolFactory:
         except AttributeError as e:
             raise ValueError(f"Failed to load tool {tool_name}: {e}")
 
+    @staticmethod
+    def is_per_request(tool_type: str, tool_name: str) -> bool:
+        """
+        Whether the tools keep state that can't be shared between requests
+        (local tool modules with `PER_REQUEST = True`)
+        """
+        if tool_type != ToolType.LOCAL or "ToolSpec" in tool_name:
+            return False
+        source_package = ToolFactory.TOOL_SOURCE_PACKAGE_MAP[tool_type]
+        try:
+            module = importlib.import_module(f"{source_package}.{tool_name}")
+        except ImportError as e:
+            raise ValueError(f"Failed to import tool {tool_name}: {e}")
+        return getattr(module, "PER_REQUEST", False)
+
     @staticmethod
     def from_env(
         map_result: bool = False,
@@ -60,8 +84,8 @@ class ToolFactory:
             {} if map_result else []
         )
 
-        if os.path.exists("config/tools.yaml"):
-            with open("config/tools.yaml", "r") as f:
+        if os.path.exists(CONFIG_FILE):
+            with open(CONFIG_FILE, "r") as f:
                 tool_configs = yaml.safe_load(f)
                 for tool_type, config_entries in tool_configs.items():
                     for tool_name, config in config_entries.items():
@@ -76,3 +100,120 @@ class ToolFactory:
                             tools.extend(loaded_tools)  # type: ignore
 
         return tools
+
+
+class ToolRegistry:
+    """
+    Tools of `config/tools.yaml`, built once and shared by all the requests instead of
+    importing the modules and creating the tools (and their schemas) on every request.
+
+    The tools are built again when the file changes. Tools with per-request state
+    (`PER_REQUEST = True` in their module) are still created for each request, with the
+    arguments of the request added to their config.
+    """
+
+    def __init__(self, config_file: str = CONFIG_FILE):
+        self.config_file = config_file
+        self._stat_key: Optional[tuple] = None
+        # Tool type, name and config of each entry, with its tools if they are shared
+        self._entries: List[Tuple[str, str, Dict[str, Any], Optional[List[FunctionTool]]]] = []
+        self._lock = threading.Lock()
+
+        self._builds = 0
+        self._last_build_seconds = 0.0
+        self._requests = 0
+        self._request_build_seconds = 0.0
+
+    def _get_stat_key(self) -> Optional[tuple]:
+        if not os.path.exists(self.config_file):
+            return None
+        stat = os.stat(self.config_file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _build(self, stat_key: Optional[tuple]):
+        start = time.perf_counter()
+        entries = []
+        if stat_key is not None:
+            with open(self.config_file, "r") as f:
+                tool_configs = yaml.safe_load(f) or {}
+            for tool_type, config_entries in tool_configs.items():
+                for tool_name, config in (config_entries or {}).items():
+                    config = config or {}
+                    tools = (
+                        None
+                        if ToolFactory.is_per_request(tool_type, tool_name)
+                        else ToolFactory.load_tools(tool_type, tool_name, config)
+                    )
+                    entries.append((tool_type, tool_name, config, tools))
+        self._entries = entries
+        self._stat_key = stat_key
+        self._builds += 1
+        self._last_build_seconds = time.perf_counter() - start
+        logger.info(
+            f"Built {sum(len(tools or []) for *_, tools in entries)} tools from {self.config_file} "
+            f"in {self._last_build_seconds * 1000:.0f}ms"
+        )
+
+    def reload_if_changed(self):
+        stat_key = self._get_stat_key()
+        if self._builds and stat_key == self._stat_key:
+            return
+        with self._lock:
+            if self._builds and stat_key == self._stat_key:
+                return
+            try:
+                self._build(stat_key)
+            except Exception:
+                if not self._builds:
+                    raise
+                # Keep the previous tools until the file is fixed
+                logger.exception(f"Failed to reload the tools of {self.config_file}")
+                self._stat_key = stat_key
+
+    def get_tools(self, **request_kwargs: Any) -> List[FunctionTool]:
+        """
+        Get the tools for a request: the shared tools plus a new instance of the per-request ones
+
+        Args:
+            request_kwargs: Arguments of the request for the per-request tools (e.g. `sandbox_session`).
+        """
+        self.reload_if_changed()
+        start = time.perf_counter()
+        tools: List[FunctionTool] = []
+        for tool_type, tool_name, config, shared_tools in self._entries:
+            if shared_tools is not None:
+                tools.extend(shared_tools)
+            else:
+                tools.extend(ToolFactory.load_tools(tool_type, tool_name, {**config, **request_kwargs}))
+        self._requests += 1
+        self._request_build_seconds += time.perf_counter() - start
+        return tools
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "builds": self._builds,
+            "last_build_ms": round(self._last_build_seconds * 1000, 1),
+            "requests": self._requests,
+            "avg_request_ms": (
+                round(self._request_build_seconds / self._requests * 1000, 3) if self._requests else 0
+            ),
+        }
+
+
+_tool_registry: Optional[ToolRegistry] = None
+
+
+def get_tool_registry() -> ToolRegistry:
+    global _tool_registry
+    if _tool_registry is None:
+        _tool_registry = ToolRegistry()
+        register_metrics("tools", _tool_registry.get_metrics)
+    return _tool_registry
+
+
+def start_tool_registry():
+    # Build the tools at startup so that the first request doesn't pay for it
+    try:
+        get_tool_registry().reload_if_changed()
+    except Exception:
+        logger.exception("Failed to build the tools, they will be built on the first request")
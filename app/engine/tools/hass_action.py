@@ -1,13 +1,18 @@
 """Home Assistant Action Tool spec."""
-import logging
-import os
-import requests  # type: ignore
+import asyncio
 import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import httpx
 from llama_index.core.tools import FunctionTool
 from dotenv import load_dotenv
 from typing_extensions import TypedDict, Optional
 from typing_extensions import Literal
 
+from app.services.hass.client import get_hass_client
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -53,7 +58,23 @@ class ParamsDict(TypedDict, total=False):
     temperature: Optional[str]
     # Puedes añadir más parámetros según necesites
 
+class OperationDict(TypedDict, total=False):
+    """
+    Una operación de la función 'run_hass_actions': la acción a aplicar a una entidad.
+    """
+    entity_id: str
+    action: HA_ACTION
+    params: Optional[ParamsDict]
+
 class HassAction:
+    @classmethod
+    def _get_action_request(cls, entity_id: str, action: str, params: ParamsDict) -> tuple[str, dict]:
+        data = {
+            "entity_id": entity_id,
+            **(params or {})  # Añadir los parámetros adicionales
+        }
+        return entity_id.split('.')[0], data
+
     @classmethod
     def run_hass_action(cls, entity_id: str, action: HA_ACTION, params: ParamsDict) -> str | None:
         """
@@ -68,40 +89,112 @@ class HassAction:
             str o None: La respuesta de Home Assistant si la solicitud fue exitosa,
                         o None si hubo un error.
         """
+        domain, data = cls._get_action_request(entity_id, action, params)
+        try:
+            get_hass_client().call_service_sync(domain, action, data)
+            return f"Acción {action} ejecutada correctamente en entidad {entity_id}. Action data: {data}"
+        except httpx.HTTPError as e:
+            logger.error(f"Error de solicitud: {e}")
+            return None
 
-        hassio_token = os.getenv('HASS_TOKEN')
-        if not hassio_token:
-            raise ValueError("HASS_TOKEN is not set in the environment variables")
-        hassio_base_url = os.getenv('HASS_BASE_URL')
-        if not hassio_base_url:
-            raise ValueError("HASS_BASE_URL is not set in the environment variables")        
-
-        headers = {
-            "Authorization": f"Bearer {hassio_token}",
-            "Content-Type": "application/json",
-        }
-        data = {
-            "entity_id": entity_id,
-            **params  # Añadir los parámetros adicionales
-        }
-        url = f"{hassio_base_url}/api/services/{entity_id.split('.')[0]}/{action}"
-
+    @classmethod
+    async def arun_hass_action(cls, entity_id: str, action: HA_ACTION, params: ParamsDict) -> str | None:
+        """
+        Versión asíncrona de `run_hass_action` que usa el cliente compartido de Home Assistant
+        sin bloquear el bucle de eventos.
+        """
+        domain, data = cls._get_action_request(entity_id, action, params)
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(data), verify=False)
-            response.raise_for_status()  # Lanza excepción para códigos de error HTTP (4xx, 5xx)
+            await get_hass_client().call_service(domain, action, data)
+            return f"Acción {action} ejecutada correctamente en entidad {entity_id}. Action data: {data}"
+        except httpx.HTTPError as e:
+            logger.error(f"Error de solicitud: {e}")
+            return None
+
+    @classmethod
+    def _group_operations(cls, operations: List[OperationDict]) -> List[tuple[str, str, dict, List[str]]]:
+        """
+        Agrupa las operaciones por dominio, acción y parámetros, de forma que cada grupo
+        se ejecute con una sola llamada al servicio con la lista de entidades.
+        """
+        groups: dict[tuple[str, str, str], tuple[str, str, dict, List[str]]] = {}
+        for operation in operations:
+            entity_id = operation["entity_id"]
+            action = operation["action"]
+            params = operation.get("params") or {}
+            domain = entity_id.split('.')[0]
+            key = (domain, action, json.dumps(params, sort_keys=True))
+            if key not in groups:
+                groups[key] = (domain, action, params, [])
+            groups[key][3].append(entity_id)
+        return list(groups.values())
 
-            if response.status_code == 200:
-                return f"Acción {action} ejecutada correctamente en entidad {entity_id}. Action data: {data}"
-            else:
-                print(f"Error inesperado: Código de estado {response.status_code}")
-                return None
+    @classmethod
+    def _summarize_results(cls, groups, errors) -> str:
+        lines = []
+        for (domain, action, params, entity_ids), error in zip(groups, errors):
+            for entity_id in entity_ids:
+                if error is None:
+                    lines.append(f"{entity_id}: acción {action} ejecutada correctamente. Params: {params}")
+                else:
+                    lines.append(f"{entity_id}: error al ejecutar la acción {action}: {error}")
+        return "\n".join(lines)
 
-        except requests.exceptions.RequestException as e:
-            print(f"Error de solicitud: {e}")
+    @classmethod
+    def _call_group_sync(cls, group) -> str | None:
+        domain, action, params, entity_ids = group
+        try:
+            get_hass_client().call_service_sync(domain, action, {"entity_id": entity_ids, **params})
             return None
-        except json.JSONDecodeError as e:
-            print(f"Error al decodificar JSON: {e}")
+        except httpx.HTTPError as e:
+            logger.error(f"Error de solicitud: {e}")
+            return str(e)
+
+    @classmethod
+    async def _call_group(cls, group) -> str | None:
+        domain, action, params, entity_ids = group
+        try:
+            await get_hass_client().call_service(domain, action, {"entity_id": entity_ids, **params})
             return None
+        except httpx.HTTPError as e:
+            logger.error(f"Error de solicitud: {e}")
+            return str(e)
+
+    @classmethod
+    def run_hass_actions(cls, operations: List[OperationDict]) -> str:
+        """
+        Ejecuta varias acciones (servicios) en Home Assistant en una sola llamada.
+        Úsala cuando haya que actuar sobre varias entidades, por ejemplo "apaga todas las luces del salón".
+
+        Args:
+            operations (list): Lista de operaciones, cada una con:
+                entity_id (str): El ID de la entidad a la que aplicar la acción.
+                action (str): El nombre de la acción (ej: "turn_on", "toggle").
+                params (dict, opcional): Un diccionario con parámetros adicionales para la acción.
+
+        Returns:
+            str: El resultado de la acción para cada entidad.
+        """
+        groups = cls._group_operations(operations)
+        with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as executor:
+            errors = list(executor.map(cls._call_group_sync, groups))
+        return cls._summarize_results(groups, errors)
+
+    @classmethod
+    async def arun_hass_actions(cls, operations: List[OperationDict]) -> str:
+        """
+        Versión asíncrona de `run_hass_actions`: los grupos de operaciones se ejecutan en paralelo.
+        """
+        groups = cls._group_operations(operations)
+        errors = await asyncio.gather(*[cls._call_group(group) for group in groups])
+        return cls._summarize_results(groups, errors)
 
 def get_tools(**kwargs):
-    return [FunctionTool.from_defaults(HassAction.run_hass_action)]
+    return [
+        FunctionTool.from_defaults(
+            fn=HassAction.run_hass_action, async_fn=HassAction.arun_hass_action
+        ),
+        FunctionTool.from_defaults(
+            fn=HassAction.run_hass_actions, async_fn=HassAction.arun_hass_actions
+        ),
+    ]
@@ -0,0 +1,63 @@
+"""Home Assistant entity lookup tool spec."""
+import logging
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.tools import FunctionTool
+
+from app.services.hass.resolver import get_hass_entity_resolver
+from app.services.hass.state import get_hass_state_mirror
+
+logger = logging.getLogger(__name__)
+
+
+class HassEntities:
+    @classmethod
+    def find_entities(
+        cls,
+        text: Optional[str] = None,
+        area: Optional[str] = None,
+        domain: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """
+        Busca entidades de Home Assistant por nombre, área y dominio, sin necesidad de conocer la lista completa.
+        Úsala para obtener el entity_id antes de ejecutar una acción, por ejemplo para "persiana del dormitorio".
+
+        Args:
+            text (str, opcional): Nombre o descripción de la entidad (ej: "lámpara de techo").
+            area (str, opcional): Área de la casa (ej: "salón", "dormitorio").
+            domain (str, opcional): Dominio de la entidad (ej: "light", "cover", "climate", "luz", "persiana").
+            limit (int, opcional): Número máximo de resultados. Por defecto 10.
+
+        Returns:
+            list: Las entidades encontradas con su entity_id, nombre, estado y puntuación, de mejor a peor.
+        """
+        matches = get_hass_entity_resolver().find(
+            text=text, area=area, domain=domain, limit=limit
+        )
+        mirror = get_hass_state_mirror()
+        for match in matches:
+            state = mirror.get_state(match["entity_id"]) if mirror else None
+            if state is not None:
+                match["name"] = (state.get("attributes") or {}).get("friendly_name")
+                match["state"] = state.get("state")
+        return matches
+
+    @classmethod
+    async def afind_entities(
+        cls,
+        text: Optional[str] = None,
+        area: Optional[str] = None,
+        domain: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        # Run in the event loop, where the state mirror is updated, instead of a worker thread
+        return cls.find_entities(text=text, area=area, domain=domain, limit=limit)
+
+
+def get_tools(**kwargs):
+    return [
+        FunctionTool.from_defaults(
+            fn=HassEntities.find_entities, async_fn=HassEntities.afind_entities
+        )
+    ]
@@ -0,0 +1,205 @@
+"""InfluxDB sensor history tool spec."""
+import logging
+import math
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from llama_index.core.tools import FunctionTool
+from typing_extensions import Literal
+
+from app.services.influxdb.cache import get_influxdb_query_cache
+from app.services.influxdb.client import get_influxdb_pool
+from app.services.influxdb.history import get_sensor_history_store
+from app.services.influxdb.summary import (
+    DEFAULT_MAX_POINTS,
+    StreamingSummary,
+    format_duration,
+    parse_duration,
+)
+
+logger = logging.getLogger(__name__)
+
+AGGREGATION = Literal["mean", "min", "max", "sum", "last", "first", "count", "median"]
+DEFAULT_SPARKLINE_POINTS = 12
+# Only these query shapes are ever sent to InfluxDB: the parameters are validated and quoted
+QUERY_TEMPLATE = """from(bucket: {bucket})
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == {measurement} and r._field == {field}{entity_filter})"""
+WINDOW_TEMPLATE = """
+  |> aggregateWindow(every: {every}, fn: {fn}, createEmpty: false)"""
+_RELATIVE_TIME = re.compile(r"^-(?:\d+(?:mo|m|h|d|w|y))+$")
+_ABSOLUTE_TIME = re.compile(r"^\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}(?::\d{2})?(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2}))?$")
+_NAME = re.compile(r"^[\w .°%/³²·\-]{1,100}$")
+
+
+def _quote(value: str) -> str:
+    """
+    Flux string literal of a validated name
+    """
+    if not _NAME.match(value):
+        raise ValueError(f"Valor no permitido: {value!r}")
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _time_literal(value: str) -> str:
+    value = value.strip()
+    if value in ("now", "now()"):
+        return "now()"
+    if _RELATIVE_TIME.match(value):
+        return value
+    if _ABSOLUTE_TIME.match(value):
+        # Fechas sin hora: medianoche UTC
+        return value if "T" in value else f"{value}T00:00:00Z"
+    raise ValueError(
+        f"Tiempo no válido: {value!r}. Usa un tiempo relativo (ej: -24h, -7d) o una fecha RFC3339."
+    )
+
+
+def _to_datetime(value: str, now: datetime) -> datetime:
+    literal = _time_literal(value)
+    if literal == "now()":
+        return now
+    if literal.startswith("-"):
+        return now - timedelta(seconds=parse_duration(literal))
+    return datetime.fromisoformat(literal.replace("Z", "+00:00"))
+
+
+def _get_duration(start: str, stop: str) -> float:
+    """
+    Seconds between the start and stop of the range
+    """
+    now = datetime.now(timezone.utc)
+    seconds = (_to_datetime(stop, now) - _to_datetime(start, now)).total_seconds()
+    if seconds <= 0:
+        raise ValueError("El inicio del periodo debe ser anterior al final")
+    return seconds
+
+
+class InfluxDBHistory:
+    def __init__(
+        self,
+        org: Optional[str] = None,
+        bucket: Optional[str] = None,
+        max_points: int = DEFAULT_MAX_POINTS,
+        sparkline_points: int = DEFAULT_SPARKLINE_POINTS,
+        measurements: Optional[List[str]] = None,
+        local_cache: Optional[bool] = None,
+    ):
+        self.org = org or os.getenv("IDB_TOOL_ORG")
+        self.bucket = bucket or os.getenv("IDB_TOOL_BUCKET")
+        if not self.org or not self.bucket:
+            raise ValueError(
+                "The InfluxDB tool needs an org and a bucket (tool config or IDB_TOOL_ORG / IDB_TOOL_BUCKET)"
+            )
+        self.max_points = max_points
+        self.sparkline_points = sparkline_points
+        self.measurements = measurements
+        if local_cache is None:
+            local_cache = os.getenv("IDB_HISTORY_CACHE", "false").lower() in ('true', '1', 't', 'y', 'yes')
+        self.local_cache = local_cache
+
+    def _get_every(self, start: str, stop: str, every: Optional[str] = None) -> str:
+        # Intervalo mínimo para no superar el presupuesto de puntos por serie
+        min_every = max(_get_duration(start, stop) / self.max_points, 1)
+        if every:
+            if not re.fullmatch(r"(?:\d+(?:mo|s|m|h|d|w|y))+", every):
+                raise ValueError(f"Intervalo no válido: {every!r}")
+            if parse_duration(every) >= min_every:
+                return every
+        if min_every >= 60:
+            min_every = math.ceil(min_every / 60) * 60
+        return format_duration(math.ceil(min_every))
+
+    def build_query(
+        self,
+        measurement: str,
+        field: str = "value",
+        entity_id: Optional[str] = None,
+        start: str = "-24h",
+        stop: str = "now",
+        aggregation: AGGREGATION = "mean",
+        every: Optional[str] = None,
+    ) -> str:
+        if self.measurements is not None and measurement not in self.measurements:
+            raise ValueError(
+                f"Medida no permitida: {measurement!r}. Medidas disponibles: {', '.join(self.measurements)}"
+            )
+        if aggregation not in AGGREGATION.__args__:  # type: ignore
+            raise ValueError(f"Agregación no permitida: {aggregation!r}")
+        if entity_id:
+            # Home Assistant guarda el entity_id sin el dominio
+            entity_id = entity_id.split(".", 1)[-1]
+        query = QUERY_TEMPLATE.format(
+            bucket=_quote(self.bucket),
+            start=_time_literal(start),
+            stop=_time_literal(stop),
+            measurement=_quote(measurement),
+            field=_quote(field),
+            entity_filter=f" and r.entity_id == {_quote(entity_id)}" if entity_id else "",
+        )
+        return query + WINDOW_TEMPLATE.format(every=self._get_every(start, stop, every), fn=aggregation)
+
+    async def aquery_history(
+        self,
+        measurement: str,
+        field: str = "value",
+        entity_id: Optional[str] = None,
+        start: str = "-24h",
+        stop: str = "now",
+        aggregation: AGGREGATION = "mean",
+        every: Optional[str] = None,
+    ) -> str:
+        """
+        Consulta el histórico de un sensor en InfluxDB y devuelve un resumen por serie (mínimo, máximo, media,
+        último valor, tendencia por hora y evolución). Úsala solo para preguntas sobre datos pasados o tendencias,
+        por ejemplo "¿cuánto ha consumido la casa esta semana?" o "¿qué temperatura hizo ayer en el salón?".
+
+        Args:
+            measurement (str): La medida, que en Home Assistant es la unidad del sensor (ej: "°C", "kWh", "W", "%").
+            field (str, opcional): El campo a consultar. Por defecto "value".
+            entity_id (str, opcional): La entidad del sensor (ej: "sensor.temperatura_salon"). Si no se indica, se devuelven todas las entidades de la medida.
+            start (str, opcional): Inicio del periodo, relativo (ej: "-24h", "-7d") o fecha RFC3339 (ej: "2024-12-01T00:00:00Z"). Por defecto "-24h".
+            stop (str, opcional): Fin del periodo, relativo o fecha RFC3339. Por defecto "now".
+            aggregation (str, opcional): Agregación de cada intervalo: "mean", "min", "max", "sum", "last", "first", "count" o "median". Por defecto "mean".
+            every (str, opcional): Duración de cada intervalo (ej: "1h", "1d"). Por defecto se calcula a partir del periodo.
+
+        Returns:
+            str: El resumen de las series encontradas.
+        """
+        # Se usa el cliente compartido y la caché de consultas
+        query = self.build_query(measurement, field, entity_id, start, stop, aggregation, every)
+        if self.local_cache:
+            # Copia local del histórico: solo se piden a InfluxDB los puntos que faltan
+            now = datetime.now(timezone.utc)
+            logger.info(f"Querying local sensor history: {query}")
+            return await get_sensor_history_store().query(
+                self.org,
+                self.bucket,
+                measurement,
+                field,
+                entity_id.split(".", 1)[-1] if entity_id else None,
+                _to_datetime(start, now),
+                _to_datetime(stop, now),
+                parse_duration(self._get_every(start, stop, every)),
+                aggregation,
+                _quote,
+                self.sparkline_points,
+            )
+
+        async def fetch() -> str:
+            summary = StreamingSummary(self.sparkline_points)
+            await get_influxdb_pool().query_stream(self.org, query, summary.add)
+            return summary.get_text()
+
+        logger.info(f"Querying InfluxDB history: {query}")
+        return await get_influxdb_query_cache().get(
+            self.org, self.bucket, query, fetch, sparkline_points=self.sparkline_points
+        )
+
+
+def get_tools(**kwargs):
+    tool = InfluxDBHistory(**kwargs)
+    # Only async: the queries use the shared async clients of the app
+    return [FunctionTool.from_defaults(async_fn=tool.aquery_history, name="query_history")]
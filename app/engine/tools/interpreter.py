@@ -2,16 +2,25 @@ import base64
 import logging
 import os
 import uuid
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from app.services.file import DocumentFile, FileService
-from e2b_code_interpreter import CodeInterpreter
+from app.services.sandbox import (
+    SandboxError,
+    SandboxPool,
+    SandboxSession,
+    get_sandbox_pool,
+)
 from e2b_code_interpreter.models import Logs
 from llama_index.core.tools import FunctionTool
 from pydantic import BaseModel
 
 logger = logging.getLogger("uvicorn")
 
+# The sandbox of the interpreter keeps the state of the code run in a conversation,
+# so a new tool is created for each request with the sandbox session of the conversation
+PER_REQUEST = True
+
 
 class InterpreterExtraResult(BaseModel):
     type: str
@@ -32,45 +41,44 @@ class E2BCodeInterpreter:
     output_dir = "output/tools"
     uploaded_files_dir = "output/uploaded"
 
-    def __init__(self, api_key: Optional[str] = None):
-        if api_key is None:
-            api_key = os.getenv("E2B_API_KEY")
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pool: Optional[SandboxPool] = None,
+        sandbox_session: Optional[SandboxSession] = None,
+    ):
         filesever_url_prefix = os.getenv("FILESERVER_URL_PREFIX")
-        if not api_key:
-            raise ValueError(
-                "E2B_API_KEY key is required to run code interpreter. Get it here: https://e2b.dev/docs/getting-started/api-key"
-            )
         if not filesever_url_prefix:
             raise ValueError(
                 "FILESERVER_URL_PREFIX is required to display file output from sandbox"
             )
 
         self.filesever_url_prefix = filesever_url_prefix
-        self.interpreter = None
-        self.api_key = api_key
+        # Sandboxes are taken from a shared pool of warm sandboxes instead of created on each request.
+        # The owner of the session gives the sandbox back at the end of the request.
+        self.session = sandbox_session or SandboxSession(
+            pool=pool if pool is not None else get_sandbox_pool(api_key)
+        )
+        self.pool = self.session.pool
 
-    def __del__(self):
-        """
-        Kill the interpreter when the tool is no longer in use
-        """
-        if self.interpreter is not None:
-            self.interpreter.kill()
+    def _get_files(self, sandbox_files: List[str]) -> List[Tuple[str, str]]:
+        return [
+            (file_path, os.path.join(self.uploaded_files_dir, os.path.basename(file_path)))
+            for file_path in sandbox_files
+        ]
 
-    def _init_interpreter(self, sandbox_files: List[str] = []):
+    def _init_interpreter(self):
         """
-        Lazily initialize the interpreter.
+        Lazily get the sandbox of the conversation from the pool.
         """
-        logger.info(f"Initializing interpreter with {len(sandbox_files)} files")
-        self.interpreter = CodeInterpreter(api_key=self.api_key)
-        if len(sandbox_files) > 0:
-            for file_path in sandbox_files:
-                file_name = os.path.basename(file_path)
-                local_file_path = os.path.join(self.uploaded_files_dir, file_name)
-                with open(local_file_path, "rb") as f:
-                    content = f.read()
-                    if self.interpreter and self.interpreter.files:
-                        self.interpreter.files.write(file_path, content)
-            logger.info(f"Uploaded {len(sandbox_files)} files to sandbox")
+        sandbox = self.session.acquire()
+        logger.info(f"Using sandbox {sandbox.id}")
+
+    def _upload_files(self, sandbox_files: List[str]):
+        # Only the files that are new or changed since the last upload to this sandbox are sent
+        uploaded = self.pool.sync_files(self.session.sandbox, self._get_files(sandbox_files))
+        if uploaded:
+            logger.info(f"Uploaded {uploaded} files to sandbox")
 
     def _save_to_disk(self, base64_data: str, ext: str) -> DocumentFile:
         buffer = base64.b64decode(base64_data)
@@ -156,46 +164,51 @@ class E2BCodeInterpreter:
                 retry_count=retry_count,
             )
 
-        if self.interpreter is None:
-            self._init_interpreter(sandbox_files)
-
-        if self.interpreter and self.interpreter.notebook:
-            logger.info(
-                f"\n{'='*50}\n> Running following AI-generated code:\n{code}\n{'='*50}"
+        logger.info(
+            f"\n{'='*50}\n> Running following AI-generated code:\n{code}\n{'='*50}"
+        )
+        try:
+            if self.session.sandbox is None:
+                self._init_interpreter()
+            self._upload_files(sandbox_files)
+            exec = self.session.sandbox.run_code(code)
+        except SandboxError as e:
+            # The sandbox is no longer usable (e.g. it expired): retry once with another one.
+            # Other errors (e.g. a missing local file) are raised without discarding the sandbox.
+            sandbox_id = self.session.sandbox.id if self.session.sandbox else ""
+            logger.warning(f"Sandbox {sandbox_id} failed, using a new one: {e}")
+            self.session.discard()
+            self._init_interpreter()
+            self._upload_files(sandbox_files)
+            exec = self.session.sandbox.run_code(code)
+        logs = Logs(stdout=exec.logs.stdout, stderr=exec.logs.stderr)
+
+        if exec.error:
+            error_message = f"The code failed to execute successfully. Error: {exec.error}. Try to fix the code and run again."
+            logger.error(error_message)
+            # Calling the generated code caused an error. Restart the kernel (keeping the sandbox and its files)
+            # and return the error to the LLM so it can try to fix the error
+            if not self.pool.reset(self.session.sandbox):
+                self.session.sandbox = None
+            output = E2BToolOutput(
+                is_error=True,
+                logs=logs,
+                results=[],
+                error_message=error_message,
+                retry_count=retry_count + 1,
             )
-            exec = self.interpreter.notebook.exec_cell(code)
-
-            if exec.error:
-                error_message = f"The code failed to execute successfully. Error: {exec.error}. Try to fix the code and run again."
-                logger.error(error_message)
-                # Calling the generated code caused an error. Kill the interpreter and return the error to the LLM so it can try to fix the error
-                try:
-                    self.interpreter.kill()  # type: ignore
-                except Exception:
-                    pass
-                finally:
-                    self.interpreter = None
+        else:
+            if len(exec.results) == 0:
+                output = E2BToolOutput(is_error=False, logs=logs, results=[])
+            else:
+                results = self._parse_result(exec.results[0])
                 output = E2BToolOutput(
-                    is_error=True,
-                    logs=exec.logs,
-                    results=[],
-                    error_message=error_message,
+                    is_error=False,
+                    logs=logs,
+                    results=results,
                     retry_count=retry_count + 1,
                 )
-            else:
-                if len(exec.results) == 0:
-                    output = E2BToolOutput(is_error=False, logs=exec.logs, results=[])
-                else:
-                    results = self._parse_result(exec.results[0])
-                    output = E2BToolOutput(
-                        is_error=False,
-                        logs=exec.logs,
-                        results=results,
-                        retry_count=retry_count + 1,
-                    )
-            return output
-        else:
-            raise ValueError("Interpreter is not initialized.")
+        return output
 
 
 def get_tools(**kwargs):
@@ -0,0 +1,60 @@
+import os
+from typing import Optional
+
+from llama_index.core.storage import StorageContext
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+
+def get_vector_store_provider() -> str:
+    return os.getenv("VECTOR_STORE", "simple")
+
+
+def create_vector_store() -> Optional[BasePydanticVectorStore]:
+    """
+    New empty vector store of the configured provider (None for the default SimpleVectorStore)
+    """
+    provider = get_vector_store_provider()
+    match provider:
+        case "simple":
+            return None
+        case "hnsw":
+            from .hnsw import HNSWVectorStore
+
+            return HNSWVectorStore.from_env()
+        case "numpy":
+            from .exact import NumpyVectorStore
+
+            return NumpyVectorStore()
+        case _:
+            raise ValueError(f"Invalid vector store: {provider}")
+
+
+def load_vector_store(persist_dir: str) -> Optional[BasePydanticVectorStore]:
+    """
+    Vector store of the configured provider persisted in the directory (None for the default SimpleVectorStore)
+    """
+    provider = get_vector_store_provider()
+    match provider:
+        case "simple":
+            return None
+        case "hnsw":
+            from .hnsw import HNSWVectorStore
+
+            return HNSWVectorStore.from_persist_dir(persist_dir)
+        case "numpy":
+            from .exact import NumpyVectorStore
+
+            return NumpyVectorStore.from_persist_dir(persist_dir)
+        case _:
+            raise ValueError(f"Invalid vector store: {provider}")
+
+
+def get_storage_context(persist_dir: Optional[str] = None) -> StorageContext:
+    """
+    Storage context with the configured vector store, loaded from `persist_dir` if given
+    """
+    if persist_dir is None:
+        return StorageContext.from_defaults(vector_store=create_vector_store())
+    return StorageContext.from_defaults(
+        persist_dir=persist_dir, vector_store=load_vector_store(persist_dir)
+    )
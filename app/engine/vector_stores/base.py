@@ -0,0 +1,155 @@
+import os
+from abc import abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import (
+    DEFAULT_VECTOR_STORE,
+    NAMESPACE_SEP,
+    _build_metadata_filter_fn,
+)
+from llama_index.core.vector_stores.types import (
+    DEFAULT_PERSIST_FNAME,
+    BasePydanticVectorStore,
+    MetadataFilters,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+# Masks of the recent filters, computed once until the store changes
+MAX_CACHED_MASKS = 32
+
+
+class LabeledVectorStore(BasePydanticVectorStore):
+    """
+    Base of the local vector stores that keep the vectors by position (label): the node id,
+    ref doc id and metadata of each label, and the masks of the labels that match the metadata
+    filters, with the same semantics as the filters of the default SimpleVectorStore.
+    """
+
+    stores_text: bool = False
+
+    # Node of each label (None for the deleted ones)
+    _node_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr(default_factory=list)
+    _metadata: List[Optional[Dict[str, Any]]] = PrivateAttr(default_factory=list)
+    _labels: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _masks: Dict[str, Tuple[np.ndarray, int]] = PrivateAttr(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return len(self._labels)
+
+    def _add_node_data(self, nodes: Sequence[BaseNode]) -> np.ndarray:
+        """
+        Record the nodes under new labels (replacing the previous version of the nodes added again)
+        and return the labels
+        """
+        for node in nodes:
+            if node.node_id in self._labels:
+                self._delete_label(self._labels[node.node_id])
+        labels = np.arange(len(self._node_ids), len(self._node_ids) + len(nodes))
+        for label, node in zip(labels, nodes):
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            metadata.pop("_node_content", None)
+            self._node_ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "None")
+            self._metadata.append(metadata)
+            self._labels[node.node_id] = int(label)
+        self._masks.clear()
+        return labels
+
+    def _delete_label(self, label: int):
+        del self._labels[self._node_ids[label]]
+        self._node_ids[label] = None
+        self._ref_doc_ids[label] = None
+        self._metadata[label] = None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        for label, ref_doc_id_ in enumerate(self._ref_doc_ids):
+            if ref_doc_id_ == ref_doc_id:
+                self._delete_label(label)
+        self._masks.clear()
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        mask, _ = self._get_mask(filters, node_ids)
+        for label in np.flatnonzero(mask):
+            self._delete_label(int(label))
+        self._masks.clear()
+
+    def clear(self) -> None:
+        self._node_ids = []
+        self._ref_doc_ids = []
+        self._metadata = []
+        self._labels = {}
+        self._masks = {}
+
+    def _get_mask(
+        self, filters: Optional[MetadataFilters], node_ids: Optional[List[str]]
+    ) -> Tuple[np.ndarray, int]:
+        """
+        Labels that match the filters and the node ids, and how many they are
+        """
+        key = filters.model_dump_json() if filters is not None else ""
+        cached = self._masks.get(key)
+        if cached is None:
+            filter_fn = _build_metadata_filter_fn(lambda label: self._metadata[label], filters)
+            mask = np.fromiter(
+                (
+                    self._metadata[label] is not None and filter_fn(label)
+                    for label in range(len(self._metadata))
+                ),
+                dtype=bool,
+                count=len(self._metadata),
+            )
+            cached = (mask, int(mask.sum()))
+            if len(self._masks) >= MAX_CACHED_MASKS:
+                self._masks.pop(next(iter(self._masks)))
+            self._masks[key] = cached
+        if node_ids is None:
+            return cached
+        mask = np.zeros(len(self._metadata), dtype=bool)
+        mask[[self._labels[node_id] for node_id in node_ids if node_id in self._labels]] = True
+        mask &= cached[0]
+        return mask, int(mask.sum())
+
+    def _get_node_data(self) -> Dict[str, Any]:
+        return {
+            "node_ids": self._node_ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+        }
+
+    def _set_node_data(self, data: Dict[str, Any]):
+        self._node_ids = data["node_ids"]
+        self._ref_doc_ids = data["ref_doc_ids"]
+        self._metadata = data["metadata"]
+        self._labels = {
+            node_id: label for label, node_id in enumerate(self._node_ids) if node_id is not None
+        }
+        self._masks = {}
+
+    @staticmethod
+    def _get_path_prefix(persist_path: str) -> str:
+        # The files are written next to the file of the default store, with the same namespace
+        # (e.g. default__hnsw.bin for default__vector_store.json)
+        return persist_path.removesuffix(DEFAULT_PERSIST_FNAME)
+
+    @classmethod
+    @abstractmethod
+    def from_persist_path(cls, persist_path: str) -> "LabeledVectorStore":
+        pass
+
+    @classmethod
+    def from_persist_dir(
+        cls, persist_dir: str, namespace: str = DEFAULT_VECTOR_STORE
+    ) -> "LabeledVectorStore":
+        return cls.from_persist_path(
+            os.path.join(persist_dir, f"{namespace}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}")
+        )
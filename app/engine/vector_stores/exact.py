@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from app.engine.vector_stores.base import LabeledVectorStore
+
+logger = logging.getLogger("uvicorn")
+
+EMBEDDINGS_FNAME = "embeddings.npy"
+NODES_FNAME = "embeddings.json"
+# Similarities computed at once by the batched search (64 MB of float32)
+MAX_SCORES = 1 << 24
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+class NumpyVectorStore(LabeledVectorStore):
+    """
+    Exact vector store with all the embeddings in one contiguous float32 matrix of normalized rows,
+    so the cosine similarities of a query are a single matrix-vector product and the top k is taken
+    with `argpartition`. Several queries can be searched at once with `batch_query`.
+
+    The matrix is persisted as a .npy file and memory-mapped when loaded, so the startup doesn't
+    parse the embeddings and the uvicorn workers share the pages of the file through the page cache.
+    The nodes added after loading are kept in memory until the store is persisted.
+    """
+
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._matrix
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = _normalize(np.array([node.get_embedding() for node in nodes], dtype=np.float32))
+        if self._matrix is not None and embeddings.shape[1] != self._matrix.shape[1]:
+            raise ValueError(
+                f"Embeddings of dimension {embeddings.shape[1]} don't match the store ({self._matrix.shape[1]})"
+            )
+        self._add_node_data(nodes)
+        self._matrix = embeddings if self._matrix is None else np.concatenate([self._matrix, embeddings])
+        return [node.node_id for node in nodes]
+
+    def clear(self) -> None:
+        super().clear()
+        self._matrix = None
+
+    def _get_query_mask(
+        self, filters: Optional[MetadataFilters], node_ids: Optional[List[str]]
+    ) -> Tuple[Optional[np.ndarray], int]:
+        if filters is None and node_ids is None and self.count == len(self._node_ids):
+            return None, self.count
+        # The deleted rows stay in the matrix until the store is persisted
+        return self._get_mask(filters, node_ids)
+
+    def _search(
+        self, queries: np.ndarray, k: int, mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Labels and similarities of the top k rows of each query, by decreasing similarity
+        """
+        batch_size = max(1, MAX_SCORES // len(self._matrix))
+        labels = np.empty((len(queries), k), dtype=np.int64)
+        similarities = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), batch_size):
+            scores = queries[start : start + batch_size] @ self._matrix.T
+            if mask is not None:
+                scores[:, ~mask] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            labels[start : start + batch_size] = np.take_along_axis(top, order, axis=1)
+            similarities[start : start + batch_size] = np.take_along_axis(top_scores, order, axis=1)
+        return labels, similarities
+
+    def batch_query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        similarity_top_k: int,
+        filters: Optional[MetadataFilters] = None,
+        node_ids: Optional[List[str]] = None,
+    ) -> List[VectorStoreQueryResult]:
+        """
+        Search several queries at once, with a matrix-matrix product per batch of queries
+        """
+        if self._matrix is None or not len(query_embeddings):
+            return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in query_embeddings]
+        mask, matches = self._get_query_mask(filters, node_ids)
+        k = min(similarity_top_k, matches)
+        if k == 0:
+            return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in query_embeddings]
+        queries = _normalize(np.array(query_embeddings, dtype=np.float32))
+        labels, similarities = self._search(queries, k, mask)
+        return [
+            VectorStoreQueryResult(
+                similarities=query_similarities.tolist(),
+                ids=[self._node_ids[label] for label in query_labels],
+            )
+            for query_labels, query_similarities in zip(labels, similarities)
+        ]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        return self.batch_query(
+            [query.query_embedding], query.similarity_top_k, query.filters, query.node_ids
+        )[0]
+
+    @classmethod
+    def _get_paths(cls, persist_path: str) -> Tuple[str, str]:
+        prefix = cls._get_path_prefix(persist_path)
+        return prefix + EMBEDDINGS_FNAME, prefix + NODES_FNAME
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        embeddings_path, nodes_path = self._get_paths(persist_path)
+        os.makedirs(os.path.dirname(embeddings_path) or ".", exist_ok=True)
+        # The deleted rows are left out of the files
+        alive = np.array([node_id is not None for node_id in self._node_ids], dtype=bool)
+        compacted = not alive.all()
+        node_data = self._get_node_data()
+        if compacted:
+            node_data = {
+                name: [value for value, keep in zip(values, alive) if keep]
+                for name, values in node_data.items()
+            }
+        matrix = self._matrix if self._matrix is not None else np.empty((0, 0), dtype=np.float32)
+        # Write to temporary files first so that a reader never sees half-written files
+        with open(embeddings_path + ".tmp", "wb") as f:
+            np.save(f, matrix[alive] if compacted else matrix)
+        with open(nodes_path + ".tmp", "w") as f:
+            json.dump(node_data, f)
+        os.replace(embeddings_path + ".tmp", embeddings_path)
+        os.replace(nodes_path + ".tmp", nodes_path)
+        if not compacted and self._matrix is not None and not isinstance(self._matrix, np.memmap):
+            # Same rows as the file: map it instead of keeping a private copy of the matrix
+            self._matrix = np.load(embeddings_path, mmap_mode="r")
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "NumpyVectorStore":
+        embeddings_path, nodes_path = cls._get_paths(persist_path)
+        if not os.path.exists(nodes_path):
+            raise ValueError(
+                f"No NumPy vector store found at {nodes_path}. Please run `poetry run generate` "
+                "with VECTOR_STORE=numpy to create it."
+            )
+        with open(nodes_path, "r") as f:
+            data = json.load(f)
+        store = cls()
+        store._set_node_data(data)
+        if store._node_ids:
+            store._matrix = np.load(embeddings_path, mmap_mode="r")
+        logger.info(f"Mapped NumPy vector store with {store.count} nodes from {embeddings_path}")
+        return store
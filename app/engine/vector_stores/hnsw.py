@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+from app.engine.vector_stores.base import LabeledVectorStore
+
+logger = logging.getLogger("uvicorn")
+
+INDEX_FNAME = "hnsw.bin"
+NODES_FNAME = "hnsw.json"
+# Filters that leave fewer nodes than this are searched exactly over the matching nodes, the graph
+# search would visit most of the graph to find them (reading the vectors from hnswlib is slow, ~40µs each)
+EXACT_SEARCH_MAX_NODES = 1_000
+
+
+def _get_hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError(
+            "HNSW vector store support is not installed. Please install it with `poetry add hnswlib`"
+        )
+    return hnswlib
+
+
+class HNSWVectorStore(LabeledVectorStore):
+    """
+    Vector store with an HNSW graph (hnswlib) for approximate nearest neighbour search by cosine
+    similarity, persisted next to the docstore of the index.
+
+    The metadata of the nodes is kept in the store, so the queries support the same metadata
+    filters as the default SimpleVectorStore (e.g. the private/doc_id filters of the documents).
+
+    `ef_search` trades latency for recall: with 100k nodes (benchmarks/vector_store.py), recall@5 is
+    0.86 with 64 candidates, 0.97 with 128 and 0.99 with 200, at ~0.3, ~0.5 and ~0.8 ms per query.
+    """
+
+    m: int = 16
+    ef_construction: int = 200
+    ef_search: int = 200
+
+    _index: Any = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        _get_hnswlib()
+
+    @classmethod
+    def from_env(cls) -> "HNSWVectorStore":
+        return cls(
+            m=int(os.getenv("HNSW_M", "16")),
+            ef_construction=int(os.getenv("HNSW_EF_CONSTRUCTION", "200")),
+            ef_search=int(os.getenv("HNSW_EF_SEARCH", "200")),
+        )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HNSWVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._index
+
+    def _init_index(self, dimension: int, capacity: int):
+        self._index = _get_hnswlib().Index(space="cosine", dim=dimension)
+        self._index.init_index(
+            max_elements=capacity, M=self.m, ef_construction=self.ef_construction
+        )
+        self._index.set_ef(self.ef_search)
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = np.array([node.get_embedding() for node in nodes], dtype=np.float32)
+        if self._index is None:
+            self._init_index(embeddings.shape[1], max(len(nodes), 1024))
+        labels = self._add_node_data(nodes)
+        if labels[-1] >= self._index.get_max_elements():
+            self._index.resize_index(max(labels[-1] + 1, self._index.get_max_elements() * 2))
+        self._index.add_items(embeddings, labels)
+        return [node.node_id for node in nodes]
+
+    def _delete_label(self, label: int):
+        self._index.mark_deleted(label)
+        super()._delete_label(label)
+
+    def clear(self) -> None:
+        super().clear()
+        self._index = None
+
+    def _exact_search(
+        self, query_embedding: np.ndarray, labels: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        embeddings = self._index.get_items(labels, return_type="numpy")
+        similarities = embeddings @ (query_embedding / np.linalg.norm(query_embedding))
+        top = np.argsort(-similarities)[:k]
+        return labels[top], similarities[top]
+
+    def _graph_search(
+        self, query_embedding: np.ndarray, k: int, filter_fn: Optional[Callable[[int], bool]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # hnswlib searches with max(ef, k) candidates, so ef doesn't need to be raised for large k
+        labels, distances = self._index.knn_query(
+            query_embedding, k=k, num_threads=1, filter=filter_fn
+        )
+        # Cosine distance of hnswlib is 1 - similarity
+        return labels[0].astype(np.int64), 1.0 - distances[0]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Invalid query mode: {query.mode}")
+        if self._index is None or not self._labels:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        query_embedding = np.array(query.query_embedding, dtype=np.float32)
+
+        filtered = query.filters is not None or query.node_ids is not None
+        mask, matches = (
+            self._get_mask(query.filters, query.node_ids) if filtered else (None, self.count)
+        )
+        k = min(query.similarity_top_k, matches)
+        if k == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        if filtered and matches <= EXACT_SEARCH_MAX_NODES:
+            labels, similarities = self._exact_search(query_embedding, np.flatnonzero(mask), k)
+        else:
+            try:
+                labels, similarities = self._graph_search(
+                    query_embedding, k, (lambda label: mask[label]) if filtered else None
+                )
+            except RuntimeError:
+                # The graph search didn't reach k (matching) nodes
+                if mask is None:
+                    mask, _ = self._get_mask(None, None)
+                labels, similarities = self._exact_search(query_embedding, np.flatnonzero(mask), k)
+
+        return VectorStoreQueryResult(
+            similarities=similarities.tolist(),
+            ids=[self._node_ids[label] for label in labels],
+        )
+
+    @classmethod
+    def _get_paths(cls, persist_path: str) -> Tuple[str, str]:
+        prefix = cls._get_path_prefix(persist_path)
+        return prefix + INDEX_FNAME, prefix + NODES_FNAME
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        index_path, nodes_path = self._get_paths(persist_path)
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        # Write to temporary files first so that a reader never sees half-written files
+        if self._index is not None:
+            self._index.save_index(index_path + ".tmp")
+        with open(nodes_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "dimension": self._index.dim if self._index is not None else None,
+                    "m": self.m,
+                    "ef_construction": self.ef_construction,
+                    **self._get_node_data(),
+                },
+                f,
+            )
+        if self._index is not None:
+            os.replace(index_path + ".tmp", index_path)
+        os.replace(nodes_path + ".tmp", nodes_path)
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "HNSWVectorStore":
+        index_path, nodes_path = cls._get_paths(persist_path)
+        if not os.path.exists(nodes_path):
+            raise ValueError(
+                f"No HNSW vector store found at {nodes_path}. Please run `poetry run generate` "
+                "with VECTOR_STORE=hnsw to create it."
+            )
+        with open(nodes_path, "r") as f:
+            data = json.load(f)
+        store = cls.from_env()
+        store.m = data["m"]
+        store.ef_construction = data["ef_construction"]
+        store._set_node_data(data)
+        if data["dimension"] is not None:
+            store._index = _get_hnswlib().Index(space="cosine", dim=data["dimension"])
+            store._index.load_index(index_path, max_elements=len(store._node_ids))
+            store._index.set_ef(store.ef_search)
+        logger.info(f"Loaded HNSW vector store with {store.count} nodes from {index_path}")
+        return store
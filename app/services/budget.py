@@ -0,0 +1,254 @@
+import logging
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.settings import Settings
+from llama_index.core.utils import get_tokenizer
+
+from app.services.hass.deltas import get_snapshot_chain
+
+if TYPE_CHECKING:
+    from app.api.routers.models import Annotation, ChatData
+
+logger = logging.getLogger("uvicorn")
+
+# Tokens kept free for the answer, the tool descriptions and the agent prompt
+DEFAULT_RESERVED_TOKENS = 1024
+# Share of the context window of each part of the prompt (the context providers by their name).
+# Parts that need less than their share leave the rest to the others.
+DEFAULT_WEIGHTS = {
+    "hass": 4.0,
+    "influxdb": 3.0,
+    "documents": 3.0,
+    "code": 2.0,
+    "history": 2.0,
+    "previous_context": 1.0,
+}
+# Tokens added by the chat template to each message
+MESSAGE_OVERHEAD = 4
+TRIMMED_NOTICE = "[... {lines} líneas omitidas por longitud]"
+
+
+@lru_cache(maxsize=16)
+def get_token_counter(model: Optional[str] = None) -> Callable[[str], int]:
+    """
+    Token counter of the model, created once per model. Models unknown to tiktoken
+    (e.g. local models) use the default tokenizer of LlamaIndex as an approximation.
+    """
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(model or "")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except (ImportError, KeyError):
+        tokenizer = get_tokenizer()
+        return lambda text: len(tokenizer(text))
+
+
+def allocate(demands: Dict[str, int], weights: Dict[str, float], available: int) -> Dict[str, int]:
+    """
+    Share `available` tokens between the parts in proportion to their weights. The parts that need
+    less than their share get what they need and the surplus is shared again between the rest.
+    """
+    allocation = {name: 0 for name in demands}
+    pending = {name for name, demand in demands.items() if demand > 0}
+    remaining = available
+    while pending and remaining > 0:
+        total_weight = sum(weights[name] for name in pending)
+        shares = {name: remaining * weights[name] / total_weight for name in pending}
+        satisfied = {name for name in pending if demands[name] <= shares[name]}
+        if not satisfied:
+            for name in pending:
+                allocation[name] = int(shares[name])
+            break
+        for name in satisfied:
+            allocation[name] = demands[name]
+            remaining -= demands[name]
+        pending -= satisfied
+    return allocation
+
+
+class TokenBudget:
+    """
+    Fit the prompt of a chat request in the context window of the model.
+
+    The system prompt and the question are always kept, and the rest of the window (minus the
+    reserved tokens) is shared between the context of each provider, the uploaded documents, the
+    context of the previous messages, the latest code artifact and the history, by weight.
+    The parts over their budget are trimmed: the oldest messages and contexts are dropped first,
+    and the texts are cut at a line boundary. The latest snapshot of the Home Assistant entities and
+    the changes sent after it are always kept, the entity context of the question is relative to them.
+    """
+
+    def __init__(
+        self,
+        context_window: int,
+        reserved_tokens: int = DEFAULT_RESERVED_TOKENS,
+        weights: Optional[Dict[str, float]] = None,
+        model: Optional[str] = None,
+    ):
+        self.context_window = context_window
+        self.reserved_tokens = reserved_tokens
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.model = model
+        self.count_tokens = get_token_counter(model)
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        metadata = Settings.llm.metadata
+        weights = {}
+        # Format: CONTEXT_WEIGHTS=hass=4,influxdb=3,history=2
+        for item in filter(None, os.getenv("CONTEXT_WEIGHTS", "").split(",")):
+            name, _, weight = item.partition("=")
+            weights[name.strip()] = float(weight)
+        return cls(
+            context_window=metadata.context_window,
+            reserved_tokens=int(os.getenv("CONTEXT_RESERVED_TOKENS", DEFAULT_RESERVED_TOKENS)),
+            weights=weights,
+            model=metadata.model_name,
+        )
+
+    def _count_message(self, content: str) -> int:
+        return self.count_tokens(content) + MESSAGE_OVERHEAD
+
+    def _trim_text(self, text: str, max_tokens: int) -> str:
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        lines = text.split("\n")
+        used = self.count_tokens(TRIMMED_NOTICE.format(lines=len(lines)))
+        kept = []
+        for line in lines:
+            tokens = self.count_tokens(line) + 1
+            if used + tokens > max_tokens:
+                break
+            kept.append(line)
+            used += tokens
+        if not kept:
+            return ""
+        return "\n".join(kept + [TRIMMED_NOTICE.format(lines=len(lines) - len(kept))])
+
+    def _keep_latest(self, texts: List[str], sizes: List[int], max_tokens: int) -> List[str]:
+        # Keep the most recent items that fit in the budget, in their original order
+        kept = 0
+        used = 0
+        for size in reversed(sizes):
+            if used + size > max_tokens:
+                break
+            used += size
+            kept += 1
+        return texts[len(texts) - kept :]
+
+    def build_messages(
+        self,
+        data: "ChatData",
+        system_prompt: Optional[str] = None,
+        context: Optional[Dict[str, List["Annotation"]]] = None,
+    ) -> Tuple[str, List[ChatMessage]]:
+        """
+        Build the last message (question plus context) and the history of the request within the budget.
+
+        Args:
+            context: Annotations added to the last message by each context provider.
+
+        Returns:
+            The content of the last message and the history messages.
+        """
+        context = context or {}
+        last_message = data.messages[-1]
+        provider_annotations = {
+            id(annotation): name for name, annotations in context.items() for annotation in annotations
+        }
+
+        # Parts of the prompt: texts of the context of the last message by provider,
+        # and the context of the previous messages
+        sections: Dict[str, List[str]] = {"documents": []}
+        sections.update({name: [] for name in context})
+        previous_context: List[str] = []
+        for message in data.messages:
+            if message.role != MessageRole.USER or not message.annotations:
+                continue
+            for annotation in message.annotations:
+                content = annotation.to_content()
+                if not content:
+                    continue
+                if message is not last_message:
+                    previous_context.append(content)
+                else:
+                    sections[provider_annotations.get(id(annotation), "documents")].append(content)
+        history = [ChatMessage(role=message.role, content=message.content) for message in data.messages[:-1]]
+        code_artifact = data._get_latest_code_artifact()
+        code = f"The existing code is:\n```\n{code_artifact}\n```" if code_artifact else ""
+
+        # The entity snapshot the changes are relative to is pinned, the rest of the previous
+        # context competes for its share
+        pinned = set(get_snapshot_chain(previous_context))
+        previous_order = [i for i in range(len(previous_context)) if i not in pinned]
+        pinned_size = sum(self.count_tokens(previous_context[i]) + 1 for i in pinned)
+
+        texts = {name: "\n".join(section_texts) for name, section_texts in sections.items()}
+        previous_sizes = [self.count_tokens(previous_context[i]) + 1 for i in previous_order]
+        history_sizes = [self._count_message(message.content or "") for message in history]
+        demands = {name: self.count_tokens(text) for name, text in texts.items() if text}
+        demands["previous_context"] = sum(previous_sizes)
+        demands["code"] = self._count_message(code) if code else 0
+        demands["history"] = sum(history_sizes)
+
+        fixed = {
+            "system": self._count_message(system_prompt) if system_prompt else 0,
+            "question": self._count_message(last_message.content),
+            "previous_snapshot": pinned_size,
+            "reserved": self.reserved_tokens,
+        }
+        available = self.context_window - sum(fixed.values())
+        if available < 0:
+            logger.warning(
+                f"The system prompt and the question don't fit in the context window of {self.context_window} tokens"
+            )
+        weights = {name: self.weights.get(name, 1.0) for name in demands}
+        allocation = allocate(demands, weights, max(available, 0))
+
+        # Trim the parts over their budget
+        kept_order = self._keep_latest(previous_order, previous_sizes, allocation["previous_context"])
+        kept_previous = [previous_context[i] for i in sorted(pinned.union(kept_order))]
+        kept_history = self._keep_latest(history, history_sizes, allocation["history"])
+        contents = [last_message.content, *kept_previous]
+        for name, text in texts.items():
+            if text and allocation[name]:
+                trimmed = self._trim_text(text, allocation[name])
+                if trimmed:
+                    contents.append(trimmed)
+        messages = list(kept_history)
+        if code and allocation["code"] >= demands["code"]:
+            messages.append(ChatMessage(role=MessageRole.ASSISTANT, content=code))
+        elif code and allocation["code"] > MESSAGE_OVERHEAD:
+            trimmed = self._trim_text(code, allocation["code"] - MESSAGE_OVERHEAD)
+            if trimmed:
+                messages.append(ChatMessage(role=MessageRole.ASSISTANT, content=trimmed))
+
+        logger.info(
+            f"Token budget of {self.context_window} tokens ({self.model}): "
+            + ", ".join(f"{name} {tokens}" for name, tokens in fixed.items() if tokens)
+            + "".join(
+                f", {name} {allocation[name]}/{demand}"
+                for name, demand in demands.items()
+                if demand
+            )
+            + (
+                f" (dropped {len(history) - len(kept_history)} messages)"
+                if len(kept_history) < len(history)
+                else ""
+            )
+        )
+        return "\n".join(contents), messages
+
+
+_token_budget: Optional[TokenBudget] = None
+
+
+def get_token_budget() -> TokenBudget:
+    global _token_budget
+    if _token_budget is None:
+        _token_budget = TokenBudget.from_env()
+    return _token_budget
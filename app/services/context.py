@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.metrics import register_metrics
+
+if TYPE_CHECKING:
+    from app.api.routers.models import Annotation, ChatData
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TIMEOUT = 30.0
+
+
+class ContextProvider:
+    """
+    A source of context for the agent (Home Assistant states, InfluxDB queries...).
+
+    `fetch` receives the chat request and returns the annotations to add to the last user message.
+    The provider is cancelled and left out of the context if it takes longer than `timeout` seconds
+    (CONTEXT_TIMEOUT if not set).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fetch: Callable[["ChatData"], Awaitable[List["Annotation"]]],
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self._fetch = fetch
+        self.timeout = timeout
+
+    async def fetch(self, data: "ChatData") -> List["Annotation"]:
+        return await self._fetch(data)
+
+
+class _ProviderStats:
+    __slots__ = ("calls", "timeouts", "errors", "total_seconds", "max_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class ContextPipeline:
+    """
+    Run all the registered context providers concurrently, so that the latency of the context is
+    the one of the slowest provider instead of the sum of all of them. A provider that fails or
+    times out is logged and skipped, the rest of the context is still added.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._providers: Dict[str, ContextProvider] = {}
+        self._stats: Dict[str, _ProviderStats] = {}
+
+    @classmethod
+    def from_env(cls) -> "ContextPipeline":
+        return cls(timeout=float(os.getenv("CONTEXT_TIMEOUT", DEFAULT_TIMEOUT)))
+
+    def register(self, provider: ContextProvider):
+        """
+        Register a provider, replacing the one with the same name
+        """
+        self._providers[provider.name] = provider
+        self._stats.setdefault(provider.name, _ProviderStats())
+
+    def unregister(self, name: str):
+        self._providers.pop(name, None)
+
+    def get_providers(self) -> List[ContextProvider]:
+        return list(self._providers.values())
+
+    async def _run_provider(self, provider: ContextProvider, data: "ChatData") -> tuple:
+        timeout = provider.timeout or self.timeout
+        start = time.perf_counter()
+        status = "ok"
+        annotations: List["Annotation"] = []
+        try:
+            annotations = await asyncio.wait_for(provider.fetch(data), timeout=timeout) or []
+        except TimeoutError:
+            status = "timeout"
+            logger.warning(f"Context provider {provider.name} took longer than {timeout}s, leaving it out of the context")
+        except Exception:
+            status = "error"
+            logger.exception(f"Error in context provider {provider.name}")
+        seconds = time.perf_counter() - start
+
+        stats = self._stats[provider.name]
+        stats.calls += 1
+        stats.timeouts += status == "timeout"
+        stats.errors += status == "error"
+        stats.total_seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        return annotations, seconds, status
+
+    async def run(self, data: "ChatData") -> Dict[str, List["Annotation"]]:
+        """
+        Get the annotations of each provider, in the order they were registered
+        """
+        providers = self.get_providers()
+        if not providers:
+            return {}
+        results = await asyncio.gather(*[self._run_provider(provider, data) for provider in providers])
+        logger.info(
+            "Context providers: "
+            + ", ".join(
+                f"{provider.name} {seconds * 1000:.0f}ms" + (f" ({status})" if status != "ok" else "")
+                for provider, (_, seconds, status) in zip(providers, results)
+            )
+        )
+        return {provider.name: annotations for provider, (annotations, _, _) in zip(providers, results)}
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "calls": stats.calls,
+                "timeouts": stats.timeouts,
+                "errors": stats.errors,
+                "avg_ms": round(stats.total_seconds / stats.calls * 1000, 1) if stats.calls else 0,
+                "max_ms": round(stats.max_seconds * 1000, 1),
+            }
+            for name, stats in self._stats.items()
+        }
+
+
+_context_pipeline: Optional[ContextPipeline] = None
+
+
+def get_context_pipeline() -> ContextPipeline:
+    global _context_pipeline
+    if _context_pipeline is None:
+        _context_pipeline = ContextPipeline.from_env()
+        register_metrics("context", _context_pipeline.get_metrics)
+    return _context_pipeline
+
+
+def register_context_provider(provider: ContextProvider):
+    get_context_pipeline().register(provider)
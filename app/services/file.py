@@ -8,7 +8,6 @@ from io import BytesIO
 from pathlib import Path
 from typing import List, Optional, Tuple
 
-from llama_index.core import VectorStoreIndex
 from llama_index.core.ingestion import IngestionPipeline
 from llama_index.core.readers.file.base import (
     _try_loading_included_file_formats as get_file_loaders_map,
@@ -90,7 +89,7 @@ class FileService:
                 document_file.refs = [doc_id]
             else:
                 documents = cls._load_file_to_documents(document_file)
-                cls._add_documents_to_vector_store_index(documents, index)
+                cls._add_documents_to_vector_store_index(documents)
                 # Add document ids to the file metadata
                 document_file.refs = [doc.doc_id for doc in documents]
 
@@ -209,23 +208,17 @@ class FileService:
         return documents
 
     @staticmethod
-    def _add_documents_to_vector_store_index(
-        documents: List[Document], index: VectorStoreIndex
-    ) -> None:
+    def _add_documents_to_vector_store_index(documents: List[Document]) -> None:
         """
         Add the documents to the vector store index
         """
+        from app.engine.index import get_shared_index
+
         pipeline = IngestionPipeline()
         nodes = pipeline.run(documents=documents)
 
-        # Add the nodes to the index and persist it
-        if index is None:
-            index = VectorStoreIndex(nodes=nodes)
-        else:
-            index.insert_nodes(nodes=nodes)
-        index.storage_context.persist(
-            persist_dir=os.environ.get("STORAGE_DIR", "storage")
-        )
+        # Add the nodes to the shared index (the queries see them without reloading it) and persist it
+        get_shared_index(os.environ.get("STORAGE_DIR", "storage")).insert_nodes(nodes)
 
     @staticmethod
     def _add_file_to_llama_cloud_index(
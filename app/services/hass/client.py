@@ -0,0 +1,157 @@
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_CONNECTIONS = 20
+
+
+class HassClient:
+    """
+    Shared Home Assistant REST client.
+
+    Keeps a pool of keep-alive connections (HTTP/2 if the `h2` package is installed) for both
+    the state reads and the service calls. The async methods are used from the FastAPI handlers
+    and the `*_sync` methods are a facade for the synchronous tool functions.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        states_url: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.states_url = states_url or f"{self.base_url}/api/states"
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self._client_kwargs: Dict[str, Any] = {
+            "base_url": self.base_url,
+            "headers": {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+            },
+            "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            "verify": False,
+        }
+        self._async_client = httpx.AsyncClient(http2=self.http2, **self._client_kwargs)
+        # Created on the first synchronous call
+        self._sync_client: Optional[httpx.Client] = None
+
+    @classmethod
+    def from_env(cls) -> "HassClient":
+        token = os.getenv("HASS_TOKEN")
+        if not token:
+            raise ValueError("HASS_TOKEN is not set in the environment variables")
+        states_url = os.getenv("HASS_API_URL")
+        base_url = os.getenv("HASS_BASE_URL")
+        if not base_url and states_url:
+            parsed = urlparse(states_url)
+            base_url = f"{parsed.scheme}://{parsed.netloc}"
+        if not base_url:
+            raise ValueError("HASS_BASE_URL is not set in the environment variables")
+        return cls(
+            base_url=base_url,
+            token=token,
+            states_url=states_url,
+            timeout=float(os.getenv("HASS_TIMEOUT", DEFAULT_TIMEOUT)),
+            connect_timeout=float(
+                os.getenv("HASS_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+            ),
+            max_connections=int(
+                os.getenv("HASS_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+            ),
+        )
+
+    @staticmethod
+    def _get_service_path(domain: str, service: str) -> str:
+        return f"/api/services/{domain}/{service}"
+
+    async def get_states(self) -> List[Dict[str, Any]]:
+        """
+        Fetch all the entity states
+        """
+        response = await self._async_client.get(self.states_url)
+        response.raise_for_status()
+        return response.json()
+
+    async def call_service(
+        self, domain: str, service: str, data: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        Call a service (action) and return the states changed by it
+        """
+        response = await self._async_client.post(
+            self._get_service_path(domain, service), json=data
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _get_sync_client(self) -> httpx.Client:
+        if self._sync_client is None:
+            # The synchronous client doesn't support HTTP/2 multiplexing across threads
+            self._sync_client = httpx.Client(**self._client_kwargs)
+        return self._sync_client
+
+    def get_states_sync(self) -> List[Dict[str, Any]]:
+        response = self._get_sync_client().get(self.states_url)
+        response.raise_for_status()
+        return response.json()
+
+    def call_service_sync(
+        self, domain: str, service: str, data: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        response = self._get_sync_client().post(
+            self._get_service_path(domain, service), json=data
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        await self._async_client.aclose()
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+_hass_client: Optional[HassClient] = None
+
+
+def get_hass_client() -> HassClient:
+    """
+    Get the shared client, creating it if the app has not started it yet
+    """
+    global _hass_client
+    if _hass_client is None:
+        _hass_client = HassClient.from_env()
+    return _hass_client
+
+
+async def start_hass_client():
+    global _hass_client
+    if os.getenv("HASS_TOKEN"):
+        _hass_client = HassClient.from_env()
+        logger.info(
+            f"Created Home Assistant client for {_hass_client.base_url} (HTTP/2: {_hass_client.http2})"
+        )
+
+
+async def stop_hass_client():
+    global _hass_client
+    if _hass_client is not None:
+        await _hass_client.aclose()
+        _hass_client = None
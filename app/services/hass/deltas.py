@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List, Mapping, Optional
+
+from cachetools import TTLCache  # type: ignore
+from llama_index.core.utils import get_tokenizer
+
+from app.services.hass.projection import encode_entities, project_entity
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+SNAPSHOT_HEADER = "Estados de las entidades:"
+DELTA_HEADER = "Cambios en los estados de las entidades desde el mensaje anterior:"
+NO_CHANGES = "Sin cambios en los estados de las entidades desde el mensaje anterior."
+
+
+def get_snapshot_chain(texts: List[str]) -> List[int]:
+    """
+    Positions of the latest full snapshot in the context texts of the previous messages and of
+    the changes rendered after it, which the changes of the next turns are relative to
+    """
+    snapshots = [i for i, text in enumerate(texts) if text.startswith(SNAPSHOT_HEADER)]
+    if not snapshots:
+        return []
+    return [snapshots[-1]] + [
+        i
+        for i in range(snapshots[-1] + 1, len(texts))
+        if texts[i].startswith(DELTA_HEADER) or texts[i] == NO_CHANGES
+    ]
+
+
+class HassEntityDeltaTracker:
+    """
+    Track the entity states already shown in each conversation, so that later turns
+    only add the entities that changed instead of a full copy of the house state.
+
+    A conversation is identified by the chain of entity annotations of its previous user
+    messages. If the chain is unknown (e.g. the client doesn't send back the annotations
+    or the entry expired), a full snapshot is emitted. The token budget always keeps the
+    latest snapshot and the changes after it (see `get_snapshot_chain`).
+    """
+
+    def __init__(self, maxsize: int = 1000, ttl: int = 3600):
+        # Hash of the annotation chain -> fingerprint of each entity row shown so far
+        self._shown: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        self._turns = 0
+        self._full_snapshots = 0
+        self._tokens_full = 0
+        self._tokens_emitted = 0
+        self._max_turn_tokens = 0
+
+    @staticmethod
+    def _get_chain_key(texts: List[str]) -> str:
+        return hashlib.sha1("\x00".join(texts).encode()).hexdigest()
+
+    def render(
+        self,
+        entities: List[Mapping[str, Any]],
+        previous_texts: List[str],
+        full_refresh: bool = False,
+    ) -> str:
+        """
+        Render the entity annotation for the current turn.
+
+        Args:
+            entities: The entities selected for the current turn.
+            previous_texts: The entity annotations of the previous user messages, in order.
+            full_refresh: Emit all the entities even if they were already shown.
+        """
+        fingerprints = {
+            entity["entity_id"]: repr(project_entity(entity)) for entity in entities
+        }
+        shown: Optional[Dict[str, str]] = None
+        if previous_texts and not full_refresh:
+            shown = self._shown.get(self._get_chain_key(previous_texts))
+
+        full_text = f"{SNAPSHOT_HEADER}\n{encode_entities(entities)}"
+        if shown is None:
+            text = full_text
+            self._full_snapshots += 1
+            shown = fingerprints
+        else:
+            changed = [
+                entity
+                for entity in entities
+                if shown.get(entity["entity_id"]) != fingerprints[entity["entity_id"]]
+            ]
+            text = (
+                f"{DELTA_HEADER}\n{encode_entities(changed)}" if changed else NO_CHANGES
+            )
+            shown = {**shown, **fingerprints}
+        self._shown[self._get_chain_key(previous_texts + [text])] = shown
+        self._record(full_text, text)
+        return text
+
+    def _record(self, full_text: str, text: str):
+        tokenizer = get_tokenizer()
+        tokens_full = len(tokenizer(full_text))
+        tokens_emitted = len(tokenizer(text))
+        self._turns += 1
+        self._tokens_full += tokens_full
+        self._tokens_emitted += tokens_emitted
+        self._max_turn_tokens = max(self._max_turn_tokens, tokens_emitted)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "turns": self._turns,
+            "full_snapshots": self._full_snapshots,
+            "prompt_tokens_full": self._tokens_full,
+            "prompt_tokens_emitted": self._tokens_emitted,
+            "avg_tokens_per_turn": (
+                self._tokens_emitted / self._turns if self._turns else 0
+            ),
+            "max_tokens_per_turn": self._max_turn_tokens,
+            "tracked_conversations": len(self._shown),
+        }
+
+
+_delta_tracker: Optional[HassEntityDeltaTracker] = None
+
+
+def get_hass_entity_delta_tracker() -> HassEntityDeltaTracker:
+    global _delta_tracker
+    if _delta_tracker is None:
+        _delta_tracker = HassEntityDeltaTracker(
+            ttl=int(os.getenv("HASS_CONVERSATION_TTL", 3600))
+        )
+        register_metrics("hass_entity_deltas", _delta_tracker.get_metrics)
+    return _delta_tracker
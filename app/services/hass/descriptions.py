@@ -0,0 +1,119 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from app.services.hass.retrieval import normalize_text
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_ENTITIES_FILE = "hass-entities.json"
+
+
+class HassEntityDescriptions:
+    """
+    Registry of the entity descriptions from the hass-entities.json file.
+
+    The file is parsed once into an `entity_id -> entity_metadata` index and secondary indexes
+    by area and domain. It is only parsed again when its modification time and content hash change.
+    If a new version of the file can't be loaded (e.g. it's being written), the last loaded one is kept.
+    """
+
+    def __init__(self, file_path: str = DEFAULT_ENTITIES_FILE):
+        self.file_path = file_path
+        self._stat_key: Optional[tuple] = None
+        self._failed_stat_key: Optional[tuple] = None
+        self._content_hash: Optional[str] = None
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        self._by_area: Dict[str, List[str]] = {}
+        self._by_domain: Dict[str, List[str]] = {}
+
+    def refresh(self):
+        """
+        Reload the file if it has changed since the last load
+        """
+        stat = os.stat(self.file_path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key == self._stat_key or (
+            stat_key == self._failed_stat_key and self._content_hash is not None
+        ):
+            return
+        with open(self.file_path, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha1(content).hexdigest()
+        if content_hash != self._content_hash:
+            try:
+                self._build_indexes(json.loads(content))
+            except Exception:
+                if self._content_hash is None:
+                    raise
+                # Keep serving the last loaded file until this version is fixed
+                self._failed_stat_key = stat_key
+                logger.exception(
+                    f"Failed to load the entity descriptions from {self.file_path}, keeping the previous ones"
+                )
+                return
+            self._content_hash = content_hash
+            logger.info(
+                f"Loaded {len(self._metadata)} entity descriptions from {self.file_path}"
+            )
+        # Only remember the file version once it's loaded (or the content is the same)
+        self._stat_key = stat_key
+
+    def _build_indexes(self, descriptions: List[Dict[str, Any]]):
+        metadata: Dict[str, Dict[str, Any]] = {}
+        by_area: Dict[str, List[str]] = {}
+        by_domain: Dict[str, List[str]] = {}
+        for description in descriptions:
+            entity_id = description["entity_id"]
+            entity_metadata = description.get("entity_metadata") or {}
+            metadata[entity_id] = entity_metadata
+            area = entity_metadata.get("area")
+            if area:
+                by_area.setdefault(normalize_text(str(area)), []).append(entity_id)
+            domain = entity_metadata.get("domain") or entity_id.split(".", 1)[0]
+            by_domain.setdefault(normalize_text(str(domain)), []).append(entity_id)
+        # Swap the indexes at once so readers never see a partially built registry
+        self._metadata, self._by_area, self._by_domain = metadata, by_area, by_domain
+
+    @property
+    def content_hash(self) -> Optional[str]:
+        """
+        Hash of the loaded file content, changes every time the indexes are rebuilt
+        """
+        return self._content_hash
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        return self._metadata.get(entity_id)
+
+    def get_entity_ids(self) -> List[str]:
+        return list(self._metadata)
+
+    def get_entity_ids_by_area(self, area: str) -> List[str]:
+        return self._by_area.get(normalize_text(area), [])
+
+    def get_entity_ids_by_domain(self, domain: str) -> List[str]:
+        return self._by_domain.get(normalize_text(domain), [])
+
+    def get_areas(self) -> List[str]:
+        return list(self._by_area)
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+
+_entity_descriptions: Optional[HassEntityDescriptions] = None
+
+
+def get_hass_entity_descriptions() -> HassEntityDescriptions:
+    """
+    Get the entity descriptions registry, reloading the file if it has changed
+    """
+    global _entity_descriptions
+    if _entity_descriptions is None:
+        _entity_descriptions = HassEntityDescriptions(
+            os.getenv("HASS_ENTITIES_FILE", DEFAULT_ENTITIES_FILE)
+        )
+    _entity_descriptions.refresh()
+    return _entity_descriptions
@@ -0,0 +1,311 @@
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.services.hass.client import get_hass_client
+from app.services.hass.resolver import (
+    DOMAIN_ALIASES,
+    get_hass_entity_resolver,
+    get_words,
+    resolve_domain,
+)
+from app.services.hass.retrieval import normalize_text
+from app.services.hass.state import get_hass_state_mirror
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+MIN_CONFIDENCE = 0.85
+MIN_MARGIN = 0.2
+# Group commands acting on more entities are left to the agent
+MAX_GROUP_ENTITIES = 10
+
+_NUMBER = r"(?P<value>\d+(?:[.,]\d+)?)"
+# Compiled grammar of the supported commands, the most specific first.
+# The target is the text naming the entity (or the entities) to act on.
+COMMAND_PATTERNS = [
+    (
+        "set_temperature",
+        "climate",
+        re.compile(
+            rf"^(?:pon|ajusta|fija|sube|baja|set)\s+(?:la\s+|el\s+)?(?P<target>(?:temperatura|calefaccion|termostato|climatizacion)\b.*?)\s+(?:a|en|to)\s+{_NUMBER}\s*(?:grados|ºc|°c|º|°)?$"
+        ),
+    ),
+    (
+        "set_cover_position",
+        "cover",
+        re.compile(
+            rf"^(?:pon|sube|baja|abre|cierra|set)\s+(?P<target>.+?)\s+(?:al|a|hasta\s+el|to)\s+{_NUMBER}\s*(?:%|por\s*ciento)?$"
+        ),
+    ),
+    (
+        "turn_on",
+        None,
+        re.compile(r"^(?:enciende|encender|prende|activa|turn\s+on|switch\s+on)\s+(?P<target>.+)$"),
+    ),
+    (
+        "turn_off",
+        None,
+        re.compile(r"^(?:apaga|apagar|desactiva|turn\s+off|switch\s+off)\s+(?P<target>.+)$"),
+    ),
+    (
+        "toggle",
+        None,
+        re.compile(r"^(?:conmuta|alterna|toggle)\s+(?P<target>.+)$"),
+    ),
+    (
+        "open_cover",
+        "cover",
+        re.compile(r"^(?:abre|abrir|sube|subir|open|raise)\s+(?P<target>.+)$"),
+    ),
+    (
+        "close_cover",
+        "cover",
+        re.compile(r"^(?:cierra|cerrar|baja|bajar|close|lower)\s+(?P<target>.+)$"),
+    ),
+]  # fmt: skip
+# Services that can be called on each domain from the fast path
+DOMAIN_SERVICES = {
+    "light": {"turn_on", "turn_off", "toggle"},
+    "switch": {"turn_on", "turn_off", "toggle"},
+    "fan": {"turn_on", "turn_off", "toggle"},
+    "input_boolean": {"turn_on", "turn_off", "toggle"},
+    "media_player": {"turn_on", "turn_off", "toggle"},
+    "cover": {"open_cover", "close_cover", "set_cover_position", "toggle"},
+    "climate": {"set_temperature", "turn_on", "turn_off"},
+}
+PLURAL_WORDS = {"todas", "todos", "all"} | {
+    alias for alias in DOMAIN_ALIASES if alias.endswith("s")
+}
+# Words naming the domain of the target besides the aliases, e.g. "sube la temperatura" is about a
+# thermostat and not a cover, although the verb alone would imply one
+DOMAIN_WORDS = {"temperatura": "climate", "climatizacion": "climate"}
+# Words that don't name any entity, e.g. "sube la posicion"
+GENERIC_WORDS = PLURAL_WORDS | {"posicion"}
+CONFIRMATIONS = {
+    "turn_on": "He encendido {names}.",
+    "turn_off": "He apagado {names}.",
+    "toggle": "He cambiado el estado de {names}.",
+    "open_cover": "He abierto {names}.",
+    "close_cover": "He cerrado {names}.",
+    "set_cover_position": "He puesto {names} al {value}%.",
+    "set_temperature": "He ajustado {names} a {value} ºC.",
+}
+
+
+@dataclass
+class HassIntent:
+    domain: str
+    service: str
+    entity_ids: List[str]
+    data: Dict[str, Any]
+    value: Optional[float] = None
+    confirmation: Optional[str] = None
+
+
+class HassIntentRouter:
+    """
+    Fast path for the common device commands (turn on/off, open/close a cover, set a temperature...).
+
+    The last user message is matched against a compiled grammar and the target is resolved with the
+    entity resolver. High-confidence commands call the Home Assistant service directly, without the
+    agent loop and its LLM round trips. Anything ambiguous returns None and goes to the agent.
+    """
+
+    def __init__(self):
+        self._checked = 0
+        self._served = 0
+        self._fast_latency = 0.0
+        self._agent_requests = 0
+        self._agent_latency = 0.0
+
+    def parse(self, message: str) -> Optional[HassIntent]:
+        """
+        Get the intent of the message if it's an unambiguous device command
+        """
+        text = normalize_text(message).strip().rstrip(".!")
+        text = re.sub(r"\bpor favor\b|^(?:oye|hey)\b", "", text).strip(" ,")
+        # Questions and multiple commands are left to the agent
+        if "?" in text or re.search(r",(?!\d)|\s(?:y|and|luego|despues)\s", text):
+            return None
+
+        for service, implied_domain, pattern in COMMAND_PATTERNS:
+            match = pattern.match(text)
+            if match is None:
+                continue
+            value = match.groupdict().get("value")
+            intent = self._resolve(
+                match.group("target"),
+                service,
+                implied_domain,
+                float(value.replace(",", ".")) if value else None,
+            )
+            if intent is not None:
+                return intent
+        return None
+
+    def _resolve(
+        self,
+        target: str,
+        service: str,
+        implied_domain: Optional[str],
+        value: Optional[float],
+    ) -> Optional[HassIntent]:
+        words = get_words(target)
+        named_domains = {
+            resolve_domain(word) if word in DOMAIN_ALIASES else DOMAIN_WORDS[word]
+            for word in words
+            if word in DOMAIN_ALIASES or word in DOMAIN_WORDS
+        }
+        domains = set(named_domains)
+        if implied_domain is not None:
+            domains.add(implied_domain)
+        if len(domains) > 1:
+            return None
+        domain = domains.pop() if domains else None
+
+        # Words naming the entity or its area
+        name_words = [
+            word
+            for word in words
+            if word not in DOMAIN_ALIASES and word not in DOMAIN_WORDS and word not in GENERIC_WORDS
+        ]
+        # The verb alone (e.g. "sube la posicion") doesn't say which device to act on
+        if not named_domains and not name_words:
+            return None
+        resolver = get_hass_entity_resolver()
+        if domain is not None and PLURAL_WORDS.intersection(words):
+            # Whole-area command, e.g. "apaga las luces del salon"
+            if not name_words:
+                return None
+            # Only an area with exactly that name: a similar one (e.g. "dormitorio invitados"
+            # for "dormitorio") is left to the agent
+            area_entity_ids = resolver.get_area_entities(" ".join(name_words), domain)
+            if not area_entity_ids or len(area_entity_ids) > MAX_GROUP_ENTITIES:
+                return None
+            entity_ids = sorted(area_entity_ids)
+        else:
+            # Without a name, the command is only unambiguous if there is a single entity
+            matches = resolver.find(
+                text=" ".join(name_words) or None, domain=domain, limit=2
+            )
+            if not matches or matches[0]["score"] < MIN_CONFIDENCE:
+                return None
+            if len(matches) > 1 and matches[0]["score"] - matches[1]["score"] < MIN_MARGIN:
+                return None
+            entity_ids = [matches[0]["entity_id"]]
+
+        if not entity_ids:
+            return None
+        entity_domain = entity_ids[0].split(".", 1)[0]
+        if service not in DOMAIN_SERVICES.get(entity_domain, set()):
+            return None
+
+        data: Dict[str, Any] = {"entity_id": entity_ids}
+        if service == "set_temperature":
+            data["temperature"] = value
+        elif service == "set_cover_position":
+            if value is None or not 0 <= value <= 100:
+                return None
+            data["position"] = int(value)
+        return HassIntent(
+            domain=entity_domain,
+            service=service,
+            entity_ids=entity_ids,
+            data=data,
+            value=value,
+        )
+
+    @staticmethod
+    def get_confirmation(intent: HassIntent) -> str:
+        mirror = get_hass_state_mirror()
+        names = []
+        for entity_id in intent.entity_ids:
+            state = mirror.get_state(entity_id) if mirror else None
+            names.append(
+                ((state or {}).get("attributes") or {}).get("friendly_name") or entity_id
+            )
+        value = intent.value
+        if value is not None and value.is_integer():
+            value = int(value)
+        return CONFIRMATIONS[intent.service].format(
+            names=", ".join(names), value=value
+        )
+
+    async def handle(self, message: str) -> Optional[HassIntent]:
+        """
+        Execute the message if it's an unambiguous device command.
+
+        Returns:
+            The executed intent with the confirmation for the user, or None if the message
+            must go to the agent.
+        """
+        start = time.perf_counter()
+        self._checked += 1
+        intent = self.parse(message)
+        if intent is None:
+            return None
+        try:
+            await get_hass_client().call_service(intent.domain, intent.service, intent.data)
+        except httpx.HTTPError as e:
+            logger.warning(f"Fast path action failed, falling back to the agent: {e}")
+            return None
+        intent.confirmation = self.get_confirmation(intent)
+        self._served += 1
+        self._fast_latency += time.perf_counter() - start
+        logger.info(
+            f"Fast path executed {intent.domain}.{intent.service} on {intent.entity_ids}"
+        )
+        return intent
+
+    def record_agent_request(self, start: float):
+        """
+        Record the latency of a request answered by the agent, from its `time.perf_counter()` start
+        """
+        self._agent_requests += 1
+        self._agent_latency += time.perf_counter() - start
+
+    def get_metrics(self) -> Dict[str, Any]:
+        avg_fast = self._fast_latency / self._served if self._served else 0
+        avg_agent = (
+            self._agent_latency / self._agent_requests if self._agent_requests else 0
+        )
+        return {
+            "requests_checked": self._checked,
+            "requests_served": self._served,
+            "agent_requests": self._agent_requests,
+            "avg_fast_path_latency_ms": avg_fast * 1000,
+            "avg_agent_latency_ms": avg_agent * 1000,
+            # Estimated with the average latency of the requests answered by the agent
+            "estimated_latency_saved_s": (
+                self._served * max(avg_agent - avg_fast, 0) if avg_agent else None
+            ),
+        }
+
+
+_intent_router: Optional[HassIntentRouter] = None
+
+
+def get_hass_intent_router() -> Optional[HassIntentRouter]:
+    """
+    Get the fast path router, or None if it's disabled or the state mirror isn't running
+    """
+    global _intent_router
+    enabled = os.getenv("HASS_FAST_PATH", "true").lower() in (
+        "true",
+        "1",
+        "t",
+        "y",
+        "yes",
+    )
+    if not enabled or get_hass_state_mirror() is None:
+        return None
+    if _intent_router is None:
+        _intent_router = HassIntentRouter()
+        register_metrics("hass_fast_path", _intent_router.get_metrics)
+    return _intent_router
@@ -0,0 +1,95 @@
+from typing import Any, Dict, List, Mapping
+
+# Attributes kept for each domain when building the prompt context.
+# The rest (context ids, timestamps, icons, supported features...) only cost tokens.
+DOMAIN_ATTRIBUTES: Dict[str, List[str]] = {
+    "light": ["brightness", "color_temp_kelvin", "rgb_color"],
+    "cover": ["current_position", "current_tilt_position"],
+    "climate": [
+        "current_temperature",
+        "temperature",
+        "hvac_action",
+        "preset_mode",
+    ],
+    "water_heater": ["current_temperature", "temperature", "operation_mode"],
+    "media_player": ["volume_level", "is_volume_muted", "media_title", "source"],
+    "fan": ["percentage", "preset_mode"],
+    "sensor": ["unit_of_measurement", "device_class"],
+    "binary_sensor": ["device_class"],
+    "weather": ["temperature", "humidity", "wind_speed"],
+    "input_number": ["unit_of_measurement", "min", "max"],
+    "input_select": ["options"],
+}
+DEFAULT_ATTRIBUTES = ["unit_of_measurement"]
+FIELD_SEPARATOR = "|"
+
+
+def get_domain(entity_id: str) -> str:
+    return entity_id.split(".", 1)[0]
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ",".join(_format_value(item) for item in value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return (
+        str(value).replace(FIELD_SEPARATOR, "/").replace("\n", " ").strip()
+    )
+
+
+def project_entity(entity: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Keep only the fields of an entity (state combined with its description) that are useful to the LLM
+    """
+    entity_id = entity["entity_id"]
+    domain = get_domain(entity_id)
+    attributes = entity.get("attributes") or {}
+    metadata = entity.get("entity_metadata") or {}
+
+    projected: Dict[str, Any] = {
+        "entity_id": entity_id,
+        "name": attributes.get("friendly_name"),
+        "state": entity.get("state"),
+    }
+    # The domain is already part of the entity id
+    projected.update(
+        (key, value) for key, value in metadata.items() if key != "domain"
+    )
+    for attribute in DOMAIN_ATTRIBUTES.get(domain, DEFAULT_ATTRIBUTES):
+        projected[attribute] = attributes.get(attribute)
+    return projected
+
+
+def encode_entities(entities: List[Mapping[str, Any]]) -> str:
+    """
+    Encode the entities in a compact table: one block per domain with a shared header
+    and one line per entity, e.g.
+
+        [light] entity_id|name|state|area|description_behaviour|brightness|color_temp_kelvin|rgb_color
+        light.techo|Lámpara de techo|on|salon|luz principal|200|3000|
+    """
+    blocks: Dict[str, List[Dict[str, Any]]] = {}
+    for entity in entities:
+        blocks.setdefault(get_domain(entity["entity_id"]), []).append(
+            project_entity(entity)
+        )
+
+    lines: List[str] = []
+    for domain, rows in blocks.items():
+        # Union of the fields of the block, keeping their order of appearance
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        # Drop the columns without any value in this block
+        columns = [
+            column
+            for column in columns
+            if any(row.get(column) not in (None, "") for row in rows)
+        ]
+        lines.append(f"[{domain}] {FIELD_SEPARATOR.join(columns)}")
+        lines.extend(
+            FIELD_SEPARATOR.join(_format_value(row.get(column)) for column in columns)
+            for row in rows
+        )
+    return "\n".join(lines)
@@ -0,0 +1,269 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from app.services.hass.descriptions import (
+    HassEntityDescriptions,
+    get_hass_entity_descriptions,
+)
+from app.services.hass.retrieval import normalize_text
+from app.services.hass.state import HassStateMirror, get_hass_state_mirror
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_MIN_SCORE = 0.5
+STOPWORDS = {
+    "el", "la", "los", "las", "de", "del", "en", "al", "a", "y", "un", "una",
+    "the", "of", "in", "on", "and",
+}  # fmt: skip
+# Common names of the domains in the questions
+DOMAIN_ALIASES = {
+    "luz": "light",
+    "luces": "light",
+    "lampara": "light",
+    "lamparas": "light",
+    "bombilla": "light",
+    "persiana": "cover",
+    "persianas": "cover",
+    "toldo": "cover",
+    "enchufe": "switch",
+    "enchufes": "switch",
+    "interruptor": "switch",
+    "termostato": "climate",
+    "calefaccion": "climate",
+    "clima": "climate",
+    "ventilador": "fan",
+    "altavoz": "media_player",
+    "television": "media_player",
+    "tele": "media_player",
+    "sensor": "sensor",
+    "sensores": "sensor",
+    "persona": "person",
+}
+
+
+def get_words(text: str) -> List[str]:
+    return [
+        word
+        for word in re.split(r"[^a-z0-9]+", normalize_text(text))
+        if word and word not in STOPWORDS
+    ]
+
+
+def get_trigrams(words: List[str]) -> Set[str]:
+    trigrams = set()
+    for word in words:
+        padded = f" {word} "
+        trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def resolve_domain(domain: str) -> str:
+    normalized = normalize_text(domain).strip()
+    return DOMAIN_ALIASES.get(normalized, normalized)
+
+
+class HassEntityResolver:
+    """
+    Accent-insensitive trigram index over the names, areas and descriptions of the entities,
+    to map phrases like "persiana del dormitorio" to entity ids without asking the LLM.
+    Only the entities described in the descriptions file are indexed.
+
+    The index is updated incrementally with the entities changed in the state mirror since the
+    last update, and rebuilt only when the descriptions file changes.
+    """
+
+    def __init__(self):
+        self._descriptions_hash: Optional[str] = None
+        self._clear()
+
+    def _clear(self):
+        self._texts: Dict[str, str] = {}
+        self._areas: Dict[str, str] = {}
+        self._entity_trigrams: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._by_area: Dict[str, Set[str]] = {}
+        self._area_trigrams: Dict[str, Set[str]] = {}
+        self._by_domain: Dict[str, Set[str]] = {}
+        self._states_version = -1
+
+    @staticmethod
+    def get_entity_text(
+        entity_id: str,
+        state: Optional[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]],
+    ) -> str:
+        parts = [entity_id.split(".", 1)[-1]]
+        if state:
+            friendly_name = (state.get("attributes") or {}).get("friendly_name")
+            if friendly_name:
+                parts.append(str(friendly_name))
+        if metadata:
+            parts.extend(
+                str(value) for key, value in metadata.items() if key != "domain"
+            )
+        return " ".join(parts)
+
+    def _remove(self, entity_id: str):
+        for trigram in self._entity_trigrams.pop(entity_id, set()):
+            posting = self._postings.get(trigram)
+            if posting is not None:
+                posting.discard(entity_id)
+                if not posting:
+                    del self._postings[trigram]
+        area = self._areas.pop(entity_id, None)
+        if area is not None:
+            self._by_area.get(area, set()).discard(entity_id)
+        self._by_domain.get(entity_id.split(".", 1)[0], set()).discard(entity_id)
+        self._texts.pop(entity_id, None)
+
+    def _index(
+        self,
+        entity_id: str,
+        state: Optional[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]],
+    ):
+        text = self.get_entity_text(entity_id, state, metadata)
+        if self._texts.get(entity_id) == text:
+            return
+        self._remove(entity_id)
+        self._texts[entity_id] = text
+        trigrams = get_trigrams(get_words(text))
+        self._entity_trigrams[entity_id] = trigrams
+        for trigram in trigrams:
+            self._postings.setdefault(trigram, set()).add(entity_id)
+        area = (metadata or {}).get("area")
+        if area:
+            area = normalize_text(str(area))
+            self._areas[entity_id] = area
+            self._by_area.setdefault(area, set()).add(entity_id)
+            if area not in self._area_trigrams:
+                self._area_trigrams[area] = get_trigrams(get_words(area))
+        self._by_domain.setdefault(entity_id.split(".", 1)[0], set()).add(entity_id)
+
+    def update(
+        self,
+        mirror: Optional[HassStateMirror],
+        descriptions: Optional[HassEntityDescriptions],
+    ):
+        """
+        Update the index with the changes of the states and descriptions since the last update
+        """
+        descriptions_hash = descriptions.content_hash if descriptions else None
+        if descriptions_hash != self._descriptions_hash:
+            # The descriptions file changed: rebuild the index from scratch
+            self._clear()
+            self._descriptions_hash = descriptions_hash
+            entity_ids = set(descriptions.get_entity_ids() if descriptions else [])
+            removed: List[str] = []
+        elif mirror is not None:
+            changed, removed = mirror.get_changes_since(self._states_version)
+            # Only the entities of the descriptions file are exposed, not every entity of Home Assistant
+            entity_ids = {
+                entity_id
+                for entity_id in changed
+                if descriptions is not None and descriptions.get(entity_id) is not None
+            }
+        else:
+            return
+
+        for entity_id in removed:
+            if descriptions is None or descriptions.get(entity_id) is None:
+                self._remove(entity_id)
+        for entity_id in entity_ids:
+            self._index(
+                entity_id,
+                mirror.get_state(entity_id) if mirror else None,
+                descriptions.get(entity_id) if descriptions else None,
+            )
+        if mirror is not None:
+            self._states_version = mirror.version
+
+    def _match_areas(self, area: str) -> Set[str]:
+        query_trigrams = get_trigrams(get_words(area))
+        entity_ids: Set[str] = set()
+        for indexed_area, area_entity_ids in self._by_area.items():
+            area_trigrams = self._area_trigrams[indexed_area]
+            union = query_trigrams | area_trigrams
+            if union and len(query_trigrams & area_trigrams) / len(union) >= DEFAULT_MIN_SCORE:
+                entity_ids.update(area_entity_ids)
+        return entity_ids
+
+    def get_area_entities(self, area: str, domain: Optional[str] = None) -> Optional[Set[str]]:
+        """
+        Entities of the area named exactly by the text (ignoring case, accents and stopwords),
+        unlike `find`, which also matches similar areas
+
+        Returns:
+            The entity ids of the area (and domain), or None if no area has that name.
+        """
+        words = get_words(area)
+        for indexed_area, area_entity_ids in self._by_area.items():
+            if words and get_words(indexed_area) == words:
+                if domain:
+                    return area_entity_ids & self._by_domain.get(resolve_domain(domain), set())
+                return set(area_entity_ids)
+        return None
+
+    def find(
+        self,
+        text: Optional[str] = None,
+        area: Optional[str] = None,
+        domain: Optional[str] = None,
+        limit: int = 10,
+        min_score: float = DEFAULT_MIN_SCORE,
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the entities matching the text (fuzzy), area (fuzzy) and domain
+
+        Returns:
+            The matching entity ids with their score, best first.
+        """
+        candidates: Optional[Set[str]] = None
+        if domain:
+            candidates = set(self._by_domain.get(resolve_domain(domain), set()))
+        if area:
+            area_ids = self._match_areas(area)
+            candidates = area_ids if candidates is None else candidates & area_ids
+
+        scores: Dict[str, float] = {}
+        query_trigrams = get_trigrams(get_words(text)) if text else set()
+        if query_trigrams:
+            hits: Dict[str, int] = {}
+            for trigram in query_trigrams:
+                for entity_id in self._postings.get(trigram, ()):
+                    if candidates is None or entity_id in candidates:
+                        hits[entity_id] = hits.get(entity_id, 0) + 1
+            for entity_id, count in hits.items():
+                score = count / len(query_trigrams)
+                if score >= min_score:
+                    scores[entity_id] = score
+        elif candidates is not None:
+            scores = {entity_id: 1.0 for entity_id in candidates}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            {"entity_id": entity_id, "score": round(score, 2)}
+            for entity_id, score in ranked[:limit]
+        ]
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+
+_entity_resolver: Optional[HassEntityResolver] = None
+
+
+def get_hass_entity_resolver() -> HassEntityResolver:
+    """
+    Get the resolver, updated with the latest changes of the entities
+    """
+    global _entity_resolver
+    if _entity_resolver is None:
+        _entity_resolver = HassEntityResolver()
+    try:
+        descriptions: Optional[HassEntityDescriptions] = get_hass_entity_descriptions()
+    except FileNotFoundError:
+        descriptions = None
+    _entity_resolver.update(get_hass_state_mirror(), descriptions)
+    return _entity_resolver
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from llama_index.core.settings import Settings
+from llama_index.core.utils import get_tokenizer
+
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_ENTITY_TOP_K = 20
+EMBEDDINGS_CACHE_FILE = "hass-entity-embeddings.json"
+# Requests between two token counts of the whole house for the metrics (rendering it is expensive)
+TOKENS_SAMPLE_INTERVAL = 20
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase the text and remove the accents, e.g. "Salón" -> "salon"
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _get_tokens(text: str) -> Tuple[str, ...]:
+    # Words and punctuation, so that a name only matches whole words of the question
+    return tuple(re.findall(r"\w+|[^\w\s]", text))
+
+
+class HassEntityRetriever:
+    """
+    Select the Home Assistant entities that are relevant to the user question.
+
+    The `entity_metadata` of each entity is embedded once and the vectors are cached in memory
+    (and in STORAGE_CACHE_DIR if configured), so each request only needs to embed the question.
+    Only the vectors of the current entities and descriptions are kept.
+    Entities named explicitly in the question are always selected. The names, texts and cache keys
+    of the entities are computed again only when the entities or their descriptions change.
+    """
+
+    def __init__(self, top_k: int = DEFAULT_ENTITY_TOP_K, cache_dir: Optional[str] = None):
+        self.top_k = top_k
+        self._cache_path = (
+            os.path.join(cache_dir, EMBEDDINGS_CACHE_FILE) if cache_dir else None
+        )
+        self._embeddings: Dict[str, List[float]] = self._load_cache()
+        self._embed_lock = asyncio.Lock()
+        # Normalized embedding matrix of the last entity set, keyed by the cache keys of its rows
+        self._matrix_keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        # Index of the last entity set: cache keys of the entity texts, and the entities by name
+        self._entity_keys: List[Tuple[Any, ...]] = []
+        self._cache_keys: List[str] = []
+        self._texts: List[str] = []
+        self._by_name: Dict[Tuple[str, ...], List[int]] = {}
+        self._max_name_tokens = 0
+
+        self._requests = 0
+        self._entities_total = 0
+        self._entities_injected = 0
+        self._tokens_total = 0
+        self._tokens_injected = 0
+        self._last_tokens_total = 0
+        self._last_entities_total = -1
+
+    @classmethod
+    def from_env(cls) -> "HassEntityRetriever":
+        return cls(
+            top_k=int(os.getenv("HASS_ENTITY_TOP_K", DEFAULT_ENTITY_TOP_K)),
+            cache_dir=os.getenv("STORAGE_CACHE_DIR"),
+        )
+
+    @staticmethod
+    def get_entity_text(entity: Mapping[str, Any]) -> str:
+        """
+        Text used to embed an entity: its id, friendly name and metadata (description, area, domain)
+        """
+        parts = [entity["entity_id"]]
+        friendly_name = (entity.get("attributes") or {}).get("friendly_name")
+        if friendly_name:
+            parts.append(str(friendly_name))
+        metadata = entity.get("entity_metadata") or {}
+        parts.extend(f"{key}: {value}" for key, value in metadata.items())
+        return "\n".join(parts)
+
+    @staticmethod
+    def get_entity_names(entity: Mapping[str, Any]) -> List[Tuple[str, ...]]:
+        """
+        Tokens of the names the entity can be mentioned by in the question: its id, its object id
+        with spaces instead of underscores and its friendly name
+        """
+        entity_id = entity["entity_id"].lower()
+        names = [entity_id, entity_id.split(".", 1)[-1].replace("_", " ")]
+        friendly_name = (entity.get("attributes") or {}).get("friendly_name")
+        if friendly_name:
+            names.append(normalize_text(str(friendly_name)))
+        return [tokens for tokens in map(_get_tokens, names) if tokens]
+
+    def _update_index(self, entities: List[Mapping[str, Any]]):
+        entity_keys = [
+            (
+                entity["entity_id"],
+                (entity.get("attributes") or {}).get("friendly_name"),
+                entity.get("entity_metadata"),
+            )
+            for entity in entities
+        ]
+        if entity_keys == self._entity_keys:
+            return
+        self._texts = [self.get_entity_text(entity) for entity in entities]
+        self._cache_keys = [self._get_cache_key(text) for text in self._texts]
+        self._by_name = {}
+        for i, entity in enumerate(entities):
+            for tokens in self.get_entity_names(entity):
+                indexes = self._by_name.setdefault(tokens, [])
+                if not indexes or indexes[-1] != i:
+                    indexes.append(i)
+        self._max_name_tokens = max(map(len, self._by_name), default=0)
+        self._entity_keys = entity_keys
+
+    def get_mentioned(self, query: str) -> List[int]:
+        """
+        Positions of the entities of the index named explicitly (by id or friendly name) in the question
+        """
+        tokens = _get_tokens(normalize_text(query))
+        mentioned = set()
+        for start in range(len(tokens)):
+            for end in range(start + 1, min(start + self._max_name_tokens, len(tokens)) + 1):
+                mentioned.update(self._by_name.get(tokens[start:end], ()))
+        return sorted(mentioned)
+
+    async def aselect(
+        self,
+        query: str,
+        entities: List[Mapping[str, Any]],
+        render: Callable[[List[Mapping[str, Any]]], str] = str,
+    ) -> List[Mapping[str, Any]]:
+        """
+        Get the top-k entities for the question plus the entities named explicitly in it.
+
+        Args:
+            query: The user question.
+            entities: The entities combined with their descriptions.
+            render: The function that renders the entities for the prompt (used for the token metrics).
+        """
+        selected = entities
+        if 0 < self.top_k < len(entities):
+            try:
+                selected = await self._aselect_top_k(query, entities)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to rank Home Assistant entities, using all of them: {e}"
+                )
+        self._record(entities, selected, render)
+        return selected
+
+    async def _aselect_top_k(
+        self, query: str, entities: List[Mapping[str, Any]]
+    ) -> List[Mapping[str, Any]]:
+        self._update_index(entities)
+        mentioned = self.get_mentioned(query)
+
+        matrix = await self._get_embedding_matrix()
+        query_vector = np.asarray(
+            await Settings.embed_model.aget_query_embedding(query), dtype=np.float32
+        )
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        scores = matrix @ query_vector
+
+        selected_indexes = list(mentioned)
+        seen = set(mentioned)
+        for i in np.argsort(-scores):
+            if len(selected_indexes) >= max(self.top_k, len(mentioned)):
+                break
+            if int(i) not in seen:
+                selected_indexes.append(int(i))
+                seen.add(int(i))
+        return [entities[i] for i in selected_indexes]
+
+    def _get_cache_key(self, text: str) -> str:
+        model_name = getattr(Settings.embed_model, "model_name", "")
+        return hashlib.sha1(f"{model_name}\n{text}".encode()).hexdigest()
+
+    async def _get_embedding_matrix(self) -> np.ndarray:
+        texts, keys = self._texts, self._cache_keys
+        if self._matrix is not None and keys == self._matrix_keys:
+            return self._matrix
+
+        async with self._embed_lock:
+            missing = {
+                key: text
+                for key, text in zip(keys, texts)
+                if key not in self._embeddings
+            }
+            if missing:
+                logger.info(f"Embedding {len(missing)} Home Assistant entity descriptions")
+                vectors = await Settings.embed_model.aget_text_embedding_batch(
+                    list(missing.values())
+                )
+                self._embeddings.update(zip(missing.keys(), vectors))
+            # Drop the embeddings of the entities removed or described differently
+            current = set(keys)
+            stale = [key for key in self._embeddings if key not in current]
+            for key in stale:
+                del self._embeddings[key]
+            if missing or stale:
+                await asyncio.to_thread(self._save_cache, dict(self._embeddings))
+
+        matrix = np.asarray([self._embeddings[key] for key in keys], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        self._matrix_keys, self._matrix = keys, matrix
+        return matrix
+
+    def _load_cache(self) -> Dict[str, List[float]]:
+        if self._cache_path and os.path.exists(self._cache_path):
+            try:
+                with open(self._cache_path, "r") as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load entity embeddings cache: {e}")
+        return {}
+
+    def _save_cache(self, embeddings: Dict[str, List[float]]):
+        if not self._cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            with open(self._cache_path, "w") as f:
+                json.dump(embeddings, f)
+        except Exception as e:
+            logger.warning(f"Failed to save entity embeddings cache: {e}")
+
+    def _record(
+        self,
+        entities: List[Mapping[str, Any]],
+        selected: List[Mapping[str, Any]],
+        render: Callable[[List[Mapping[str, Any]]], str],
+    ):
+        tokenizer = get_tokenizer()
+        total, injected = len(entities), len(selected)
+        # The whole house is only rendered when the number of entities changes or every few requests
+        if total != self._last_entities_total or self._requests % TOKENS_SAMPLE_INTERVAL == 0:
+            self._last_tokens_total = len(tokenizer(render(entities)))
+            self._last_entities_total = total
+        tokens_total = self._last_tokens_total
+        tokens_injected = (
+            tokens_total if selected is entities else len(tokenizer(render(selected)))
+        )
+        self._requests += 1
+        self._entities_total += total
+        self._entities_injected += injected
+        self._tokens_total += tokens_total
+        self._tokens_injected += tokens_injected
+        logger.info(
+            f"Injecting {injected}/{total} Home Assistant entities "
+            f"({tokens_injected} tokens, {tokens_total - tokens_injected} tokens saved)"
+        )
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "top_k": self.top_k,
+            "requests": self._requests,
+            "entities_total": self._entities_total,
+            "entities_injected": self._entities_injected,
+            "prompt_tokens_total": self._tokens_total,
+            "prompt_tokens_injected": self._tokens_injected,
+            "prompt_tokens_saved": self._tokens_total - self._tokens_injected,
+            "cached_embeddings": len(self._embeddings),
+        }
+
+
+_entity_retriever: Optional[HassEntityRetriever] = None
+
+
+def get_hass_entity_retriever() -> HassEntityRetriever:
+    global _entity_retriever
+    if _entity_retriever is None:
+        _entity_retriever = HassEntityRetriever.from_env()
+        register_metrics("hass_entity_retrieval", _entity_retriever.get_metrics)
+    return _entity_retriever
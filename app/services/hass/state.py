@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import os
+import ssl
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.services.hass.client import HassClient, get_hass_client
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_POLL_INTERVAL = 30.0
+DEFAULT_RECONNECT_DELAY = 1.0
+DEFAULT_MAX_RECONNECT_DELAY = 60.0
+
+
+class HassStateMirror:
+    """
+    In-memory mirror of the Home Assistant entity states.
+
+    Subscribes once to `state_changed` events over the Home Assistant WebSocket API and keeps
+    a versioned registry of the states, so the chat routers can read them without any network I/O.
+    When the WebSocket is not available, the registry is kept up to date by polling the REST API.
+    """
+
+    _SUBSCRIBE_ID = 1
+    _GET_STATES_ID = 2
+
+    def __init__(
+        self,
+        client: HassClient,
+        websocket_url: str,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        reconnect_delay: float = DEFAULT_RECONNECT_DELAY,
+        max_reconnect_delay: float = DEFAULT_MAX_RECONNECT_DELAY,
+    ):
+        self.client = client
+        self.websocket_url = websocket_url
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self._states: Dict[str, Dict[str, Any]] = {}
+        # Version of the registry when each entity was last changed
+        self._entity_versions: Dict[str, int] = {}
+        # Version of the registry when each entity was removed
+        self._removed_versions: Dict[str, int] = {}
+        self._version = 0
+        self._connected = False
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["HassStateMirror"]:
+        """
+        Create the mirror from the environment variables.
+        Return None if the Home Assistant API is disabled.
+        """
+        use_api = os.getenv("USE_HASS_API", "false").lower() in (
+            "true",
+            "1",
+            "t",
+            "y",
+            "yes",
+        )
+        if not use_api:
+            return None
+        client = get_hass_client()
+        return cls(
+            client=client,
+            websocket_url=os.getenv("HASS_WS_URL")
+            or cls._get_websocket_url(client.base_url),
+            poll_interval=float(
+                os.getenv("HASS_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+            ),
+        )
+
+    @staticmethod
+    def _get_websocket_url(url: str) -> str:
+        """
+        Build the WebSocket API URL from the Home Assistant base URL
+        """
+        parsed = urlparse(url)
+        scheme = "wss" if parsed.scheme == "https" else "ws"
+        return f"{scheme}://{parsed.netloc}/api/websocket"
+
+    @property
+    def version(self) -> int:
+        """
+        Monotonic version of the registry, incremented on every state change
+        """
+        return self._version
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def get_states(self) -> List[Dict[str, Any]]:
+        """
+        Get the current state objects of all the entities
+        """
+        return list(self._states.values())
+
+    def get_state(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        return self._states.get(entity_id)
+
+    def get_entity_version(self, entity_id: str) -> int:
+        return self._entity_versions.get(entity_id, 0)
+
+    def get_changes_since(self, version: int) -> Tuple[List[str], List[str]]:
+        """
+        Get the ids of the entities changed and removed after the given registry version
+        """
+        changed = [
+            entity_id
+            for entity_id, entity_version in self._entity_versions.items()
+            if entity_version > version
+        ]
+        removed = [
+            entity_id
+            for entity_id, removed_version in self._removed_versions.items()
+            if removed_version > version
+        ]
+        return changed, removed
+
+    async def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the registry has been synchronized at least once.
+        Return False if the timeout expires before that.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _replace_states(self, states: List[Dict[str, Any]]):
+        """
+        Resynchronize the registry with a full list of states
+        """
+        new_states = {state["entity_id"]: state for state in states}
+        changed = [
+            entity_id
+            for entity_id, state in new_states.items()
+            if self._states.get(entity_id) != state
+        ]
+        removed = [entity_id for entity_id in self._states if entity_id not in new_states]
+        if changed or removed or not self._ready.is_set():
+            self._version += 1
+            for entity_id in changed:
+                self._entity_versions[entity_id] = self._version
+                self._removed_versions.pop(entity_id, None)
+            for entity_id in removed:
+                self._entity_versions.pop(entity_id, None)
+                self._removed_versions[entity_id] = self._version
+            self._states = new_states
+        self._ready.set()
+
+    def _apply_state_changed(self, event_data: Dict[str, Any]):
+        entity_id = event_data.get("entity_id")
+        if not entity_id:
+            return
+        new_state = event_data.get("new_state")
+        self._version += 1
+        if new_state is None:
+            # The entity has been removed from Home Assistant
+            self._states.pop(entity_id, None)
+            self._entity_versions.pop(entity_id, None)
+            self._removed_versions[entity_id] = self._version
+        else:
+            self._states[entity_id] = new_state
+            self._entity_versions[entity_id] = self._version
+            self._removed_versions.pop(entity_id, None)
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self._run_websocket()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Home Assistant WebSocket unavailable: {e}")
+            if self._connected:
+                # The connection was established before dropping, retry right away
+                delay = self.reconnect_delay
+            self._connected = False
+
+            # Keep the registry fresh with REST polling until the next reconnection attempt
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + delay
+            while True:
+                await self._poll_rest()
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(self.poll_interval, remaining))
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _run_websocket(self):
+        from websockets.asyncio.client import connect
+
+        ssl_context = None
+        if self.websocket_url.startswith("wss"):
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+        async with connect(self.websocket_url, ssl=ssl_context, max_size=None) as ws:
+            message = json.loads(await ws.recv())
+            if message.get("type") != "auth_required":
+                raise ValueError(f"Unexpected message from Home Assistant: {message}")
+            await ws.send(json.dumps({"type": "auth", "access_token": self.client.token}))
+            message = json.loads(await ws.recv())
+            if message.get("type") != "auth_ok":
+                raise ValueError(
+                    f"Home Assistant WebSocket authentication failed: {message.get('message')}"
+                )
+
+            # Subscribe before fetching the states so that no change is lost in between
+            await ws.send(
+                json.dumps(
+                    {
+                        "id": self._SUBSCRIBE_ID,
+                        "type": "subscribe_events",
+                        "event_type": "state_changed",
+                    }
+                )
+            )
+            await ws.send(json.dumps({"id": self._GET_STATES_ID, "type": "get_states"}))
+            self._connected = True
+            logger.info(f"Connected to Home Assistant WebSocket at {self.websocket_url}")
+
+            async for raw_message in ws:
+                message = json.loads(raw_message)
+                match message.get("type"):
+                    case "event":
+                        event = message.get("event", {})
+                        if event.get("event_type") == "state_changed":
+                            self._apply_state_changed(event.get("data", {}))
+                    case "result":
+                        if not message.get("success"):
+                            raise ValueError(
+                                f"Home Assistant request {message.get('id')} failed: {message.get('error')}"
+                            )
+                        if message.get("id") == self._GET_STATES_ID:
+                            self._replace_states(message.get("result") or [])
+
+    async def _poll_rest(self):
+        try:
+            self._replace_states(await self.client.get_states())
+        except Exception as e:
+            logger.warning(f"Failed to poll Home Assistant states: {e}")
+
+
+_state_mirror: Optional[HassStateMirror] = None
+
+
+def get_hass_state_mirror() -> Optional[HassStateMirror]:
+    return _state_mirror
+
+
+async def start_hass_state_mirror():
+    global _state_mirror
+    _state_mirror = HassStateMirror.from_env()
+    if _state_mirror is not None:
+        _state_mirror.start()
+
+
+async def stop_hass_state_mirror():
+    global _state_mirror
+    if _state_mirror is not None:
+        await _state_mirror.stop()
+        _state_mirror = None
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TTL = 60.0
+DEFAULT_MAX_STALE = 3600.0
+
+# Org, bucket, query, and whether it's rendered as a summary and with how many sparkline points
+CacheKey = Tuple[str, str, str, bool, int]
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # The requests waiting for a fetch may time out before it fails (the fetch is shielded)
+    if not task.cancelled():
+        task.exception()
+
+
+class InfluxDBQueryCache:
+    """
+    In-memory cache of the InfluxDB query results, keyed on (org, bucket, query) and how the
+    result is rendered.
+
+    Fresh entries (younger than `ttl`) are served directly. Stale entries (younger than `max_stale`)
+    are also served directly while a background task refreshes them (stale-while-revalidate),
+    so only the first request of a query, or one after a long idle time, waits for InfluxDB.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_stale: float = DEFAULT_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+        self._entries: Dict[CacheKey, Tuple[Any, float]] = {}
+        # Fetches in progress, shared by the concurrent requests of the same query
+        self._inflight: Dict[CacheKey, asyncio.Task] = {}
+        self._refresh_tasks: Set[asyncio.Task] = set()
+
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+        self._served_age = 0.0
+        self._max_served_age = 0.0
+
+    @classmethod
+    def from_env(cls) -> "InfluxDBQueryCache":
+        return cls(
+            ttl=float(os.getenv("IDB_CACHE_TTL", DEFAULT_TTL)),
+            max_stale=float(os.getenv("IDB_CACHE_MAX_STALE", DEFAULT_MAX_STALE)),
+        )
+
+    def _fetch(self, key: CacheKey, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+
+            async def run():
+                try:
+                    value = await fetch()
+                    self._entries[key] = (value, time.monotonic())
+                    return value
+                finally:
+                    self._inflight.pop(key, None)
+
+            task = self._inflight[key] = asyncio.create_task(run())
+            task.add_done_callback(_retrieve_exception)
+        return task
+
+    def _refresh(self, key: CacheKey, fetch: Callable[[], Awaitable[Any]]):
+        if key in self._inflight:
+            return
+        self._refreshes += 1
+        task = self._fetch(key, fetch)
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._on_refresh_done)
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._refresh_errors += 1
+            logger.warning(f"Failed to refresh a cached InfluxDB query: {task.exception()}")
+
+    async def get(
+        self,
+        org: str,
+        bucket: str,
+        query: str,
+        fetch: Callable[[], Awaitable[Any]],
+        summary: bool = True,
+        sparkline_points: int = 0,
+    ) -> Any:
+        """
+        Get the result of the query from the cache, calling `fetch` if it's missing or expired
+
+        Args:
+            summary: Whether `fetch` renders the result as a summary or as the raw records.
+            sparkline_points: Points of the sparkline of the summary rendered by `fetch`.
+        """
+        if self.ttl <= 0:
+            return await fetch()
+
+        key = (org, bucket, query, summary, sparkline_points)
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.max_stale:
+                if age < self.ttl:
+                    self._hits += 1
+                else:
+                    self._stale_hits += 1
+                    self._refresh(key, fetch)
+                self._served_age += age
+                self._max_served_age = max(self._max_served_age, age)
+                return value
+
+        self._misses += 1
+        # Shield the fetch so that a cancelled request doesn't cancel it for the others
+        return await asyncio.shield(self._fetch(key, fetch))
+
+    async def aclose(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        self._inflight.clear()
+        self._entries.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        served = self._hits + self._stale_hits
+        now = time.monotonic()
+        return {
+            "ttl": self.ttl,
+            "max_stale": self.max_stale,
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "stale_hits": self._stale_hits,
+            "misses": self._misses,
+            "hit_ratio": served / (served + self._misses) if served + self._misses else 0,
+            "refreshes": self._refreshes,
+            "refresh_errors": self._refresh_errors,
+            "avg_served_age_s": self._served_age / served if served else 0,
+            "max_served_age_s": self._max_served_age,
+            "entry_ages_s": [
+                round(now - fetched_at, 1) for _, fetched_at in self._entries.values()
+            ],
+        }
+
+
+_query_cache: Optional[InfluxDBQueryCache] = None
+
+
+def get_influxdb_query_cache() -> InfluxDBQueryCache:
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = InfluxDBQueryCache.from_env()
+        register_metrics("influxdb_cache", _query_cache.get_metrics)
+    return _query_cache
+
+
+async def stop_influxdb_query_cache():
+    global _query_cache
+    if _query_cache is not None:
+        await _query_cache.aclose()
+        _query_cache = None
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import aiohttp
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+
+from app.services.influxdb.queries import load_influxdb_queries
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_QUERY_TIMEOUT = 10.0
+
+
+def _get_session_factory(trace_config: aiohttp.TraceConfig) -> Callable[..., aiohttp.ClientSession]:
+    """
+    Build the aiohttp session of a client with our trace config, to count the new and reused connections
+    """
+
+    def create_session(trace_configs=None, **kwargs) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            trace_configs=[*(trace_configs or []), trace_config], **kwargs
+        )
+
+    return create_session
+
+
+class InfluxDBClientPool:
+    """
+    Long-lived async InfluxDB clients, one per organization.
+
+    Each client keeps its own aiohttp connection pool, so the Flux queries of the chat requests
+    reuse the connections and don't block the event loop.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        query_timeout: float = DEFAULT_QUERY_TIMEOUT,
+        verify_ssl: bool = False,
+    ):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self.query_timeout = query_timeout
+        self.verify_ssl = verify_ssl
+        self._clients: Dict[str, InfluxDBClientAsync] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_env(cls) -> "InfluxDBClientPool":
+        url = os.getenv("IDB_API_URL")
+        if not url:
+            raise ValueError("IDB_API_URL is not set in the environment variables")
+        token = os.getenv("IDB_TOKEN")
+        if not token:
+            raise ValueError("IDB_TOKEN is not set in the environment variables")
+        return cls(
+            url=url,
+            token=token,
+            timeout=float(os.getenv("IDB_TIMEOUT", DEFAULT_TIMEOUT)),
+            query_timeout=float(os.getenv("IDB_QUERY_TIMEOUT", DEFAULT_QUERY_TIMEOUT)),
+        )
+
+    def _create_client(self, org: str) -> InfluxDBClientAsync:
+        stats = self._stats.setdefault(
+            org,
+            {
+                "queries": 0,
+                "timeouts": 0,
+                "errors": 0,
+                "new_connections": 0,
+                "reused_connections": 0,
+                "query_seconds": 0.0,
+            },
+        )
+
+        async def on_connection_create_end(session, context, params):
+            stats["new_connections"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            stats["reused_connections"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return InfluxDBClientAsync(
+            url=self.url,
+            token=self.token,
+            org=org,
+            timeout=int(self.timeout * 1000),
+            verify_ssl=self.verify_ssl,
+            client_session_type=_get_session_factory(trace_config),
+        )
+
+    def get_client(self, org: str) -> InfluxDBClientAsync:
+        """
+        Get the client of the organization, creating it on first use
+        """
+        client = self._clients.get(org)
+        if client is None:
+            client = self._clients[org] = self._create_client(org)
+            logger.info(f"Created InfluxDB client for {self.url} (org: {org})")
+        return client
+
+    async def query_stream(
+        self,
+        org: str,
+        query: str,
+        consume: Callable[[Dict[str, Any]], None],
+        timeout: Optional[float] = None,
+    ) -> int:
+        """
+        Run a Flux query and pass the values of each record to `consume` as they are parsed,
+        without loading the whole result in memory.
+
+        Returns:
+            The number of records.
+
+        Raises:
+            TimeoutError: If the query takes longer than `timeout` (or `query_timeout`) seconds.
+        """
+        client = self.get_client(org)
+        stats = self._stats[org]
+
+        async def run() -> int:
+            count = 0
+            records = await client.query_api().query_stream(query, org=org)
+            async for record in records:
+                consume(record.values)
+                count += 1
+            return count
+
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(run(), timeout=timeout or self.query_timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise TimeoutError(
+                f"InfluxDB query timed out after {timeout or self.query_timeout}s (org: {org})"
+            )
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["queries"] += 1
+            stats["query_seconds"] += time.perf_counter() - start
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            org: {
+                **stats,
+                "avg_query_ms": (
+                    stats["query_seconds"] * 1000 / stats["queries"]
+                    if stats["queries"]
+                    else 0
+                ),
+            }
+            for org, stats in self._stats.items()
+        }
+
+
+_influxdb_pool: Optional[InfluxDBClientPool] = None
+
+
+def get_influxdb_pool() -> InfluxDBClientPool:
+    """
+    Get the shared clients, creating them if the app has not started them yet
+    """
+    global _influxdb_pool
+    if _influxdb_pool is None:
+        _influxdb_pool = InfluxDBClientPool.from_env()
+        register_metrics("influxdb", _influxdb_pool.get_metrics)
+    return _influxdb_pool
+
+
+async def start_influxdb_pool():
+    """
+    Create the clients of the configured organizations if InfluxDB is configured
+    """
+    if os.getenv("IDB_API_URL") and os.getenv("IDB_TOKEN"):
+        pool = get_influxdb_pool()
+        try:
+            queries = load_influxdb_queries()
+        except ValueError as e:
+            logger.error(f"Invalid InfluxDB query configuration: {e}")
+            return
+        for query in queries:
+            pool.get_client(query.org)
+
+
+async def stop_influxdb_pool():
+    global _influxdb_pool
+    if _influxdb_pool is not None:
+        await _influxdb_pool.aclose()
+        _influxdb_pool = None
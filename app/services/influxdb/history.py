@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.influxdb.client import get_influxdb_pool
+from app.services.influxdb.summary import StreamingSummary
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_LAG = 300.0
+DEFAULT_CHUNK = 86400.0
+DB_FILE = "sensor-history.sqlite3"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS selectors (
+    id INTEGER PRIMARY KEY,
+    org TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    measurement TEXT NOT NULL,
+    field TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    low_water INTEGER,
+    high_water INTEGER,
+    UNIQUE (org, bucket, measurement, field, entity_id)
+);
+CREATE TABLE IF NOT EXISTS points (
+    selector_id INTEGER NOT NULL,
+    entity_id TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (selector_id, entity_id, time)
+) WITHOUT ROWID;
+"""
+# Raw points of a selector in an absolute range; the names are quoted by the caller
+RAW_QUERY_TEMPLATE = """from(bucket: {bucket})
+  |> range(start: {start}, stop: {stop})
+  |> filter(fn: (r) => r._measurement == {measurement} and r._field == {field}{entity_filter})
+  |> keep(columns: ["_time", "_value", "entity_id"])"""
+
+
+def _to_ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+
+def _to_rfc3339(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _to_datetime(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def aggregate_windows(
+    entity_codes: np.ndarray,
+    times: np.ndarray,
+    values: np.ndarray,
+    start: int,
+    every: int,
+    aggregation: str,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Aggregate the points of each entity in windows of `every` ms from `start`, for all the entities at once.
+
+    Returns:
+        The entity code, window index and aggregated value of each non-empty window.
+    """
+    if len(values) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=float)
+    windows = (times - start) // every
+    order = np.lexsort((times, windows, entity_codes))
+    codes, windows, values = entity_codes[order], windows[order], values[order]
+    changes = np.flatnonzero((np.diff(codes) != 0) | (np.diff(windows) != 0)) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes, [len(values)]))
+    counts = ends - starts
+    match aggregation:
+        case "mean":
+            result = np.add.reduceat(values, starts) / counts
+        case "sum":
+            result = np.add.reduceat(values, starts)
+        case "min":
+            result = np.minimum.reduceat(values, starts)
+        case "max":
+            result = np.maximum.reduceat(values, starts)
+        case "count":
+            result = counts.astype(float)
+        case "first":
+            result = values[starts]
+        case "last":
+            result = values[ends - 1]
+        case "median":
+            result = np.array([np.median(group) for group in np.split(values, changes)])
+        case _:
+            raise ValueError(f"Unsupported aggregation: {aggregation}")
+    return codes[starts], windows[starts], result
+
+
+class SensorHistoryStore:
+    """
+    Local SQLite copy of the sensor history in InfluxDB.
+
+    Each selector (measurement, field and entity) keeps the time range already copied (low and high
+    water marks). A query only fetches from InfluxDB the parts of its range outside of that interval,
+    usually just the tail since the last sync, and the aggregation runs locally over NumPy arrays.
+    The high water mark stays `lag` seconds behind now, so late points are fetched again.
+
+    The missing parts are fetched in queries of `chunk` seconds, each saved with its water mark as soon
+    as it completes, so the first sync of a long range doesn't hold all its points in memory and, if it
+    times out, the next query goes on from the last saved chunk.
+    """
+
+    def __init__(self, path: str, lag: float = DEFAULT_LAG, chunk: float = DEFAULT_CHUNK):
+        self.path = path
+        self.lag = lag
+        self.chunk = chunk
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+        self._queries = 0
+        self._local_queries = 0
+        self._fetches = 0
+        self._points_fetched = 0
+        self._points_read = 0
+
+    @classmethod
+    def from_env(cls) -> "SensorHistoryStore":
+        cache_dir = os.getenv("STORAGE_CACHE_DIR", ".cache")
+        return cls(
+            path=os.path.join(cache_dir, DB_FILE),
+            lag=float(os.getenv("IDB_HISTORY_LAG", DEFAULT_LAG)),
+            chunk=float(os.getenv("IDB_HISTORY_CHUNK", DEFAULT_CHUNK)),
+        )
+
+    def _get_selector(self, key: Tuple[str, str, str, str, str]) -> Tuple[int, Optional[int], Optional[int]]:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO selectors (org, bucket, measurement, field, entity_id) VALUES (?, ?, ?, ?, ?)",
+                key,
+            )
+            row = self._connection.execute(
+                "SELECT id, low_water, high_water FROM selectors WHERE org = ? AND bucket = ? AND measurement = ? "
+                "AND field = ? AND entity_id = ?",
+                key,
+            ).fetchone()
+            self._connection.commit()
+        return row
+
+    def _save(self, selector_id: int, rows: List[Tuple], low_water: int, high_water: int):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO points (selector_id, entity_id, time, value) VALUES (?, ?, ?, ?)",
+                ((selector_id, *row) for row in rows),
+            )
+            self._connection.execute(
+                "UPDATE selectors SET low_water = ?, high_water = ? WHERE id = ?",
+                (low_water, high_water, selector_id),
+            )
+            self._connection.commit()
+
+    def _read(self, selector_id: int, start: int, stop: int) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT entity_id, time, value FROM points WHERE selector_id = ? AND time >= ? AND time < ?",
+                (selector_id, start, stop),
+            ).fetchall()
+        if not rows:
+            empty = np.array([], dtype=np.int64)
+            return [], empty, empty, np.array([], dtype=float)
+        entity_ids, times, values = zip(*rows)
+        names, codes = np.unique(np.array(entity_ids), return_inverse=True)
+        return (
+            names.tolist(),
+            codes.astype(np.int64),
+            np.fromiter(times, dtype=np.int64, count=len(times)),
+            np.fromiter(values, dtype=float, count=len(values)),
+        )
+
+    @staticmethod
+    def _get_missing_ranges(
+        start: int, stop: int, low_water: Optional[int], high_water: Optional[int]
+    ) -> List[Tuple[int, int]]:
+        if low_water is None or high_water is None:
+            return [(start, stop)]
+        missing = []
+        if start < low_water:
+            missing.append((start, low_water))
+        if stop > high_water:
+            missing.append((high_water, stop))
+        return missing
+
+    def _get_chunks(
+        self, start: int, stop: int, low_water: Optional[int]
+    ) -> List[Tuple[int, int]]:
+        """
+        Split a missing range in chunks, in the order that keeps the synced interval contiguous:
+        backwards from the low water mark for the range before it, forwards otherwise
+        """
+        chunk_ms = max(int(self.chunk * 1000), 1)
+        chunks = [
+            (chunk_start, min(chunk_start + chunk_ms, stop))
+            for chunk_start in range(start, stop, chunk_ms)
+        ]
+        if low_water is not None and stop <= low_water:
+            chunks.reverse()
+        return chunks
+
+    async def _fetch(
+        self,
+        org: str,
+        bucket: str,
+        measurement: str,
+        field: str,
+        entity_id: Optional[str],
+        start: int,
+        stop: int,
+        quote,
+    ) -> List[Tuple]:
+        query = RAW_QUERY_TEMPLATE.format(
+            bucket=quote(bucket),
+            start=_to_rfc3339(start),
+            stop=_to_rfc3339(stop),
+            measurement=quote(measurement),
+            field=quote(field),
+            entity_filter=f" and r.entity_id == {quote(entity_id)}" if entity_id else "",
+        )
+        rows: List[Tuple] = []
+
+        def add(values: Dict[str, Any]):
+            value, record_time = values.get("_value"), values.get("_time")
+            if isinstance(value, (int, float)) and isinstance(record_time, datetime):
+                rows.append((values.get("entity_id") or "", _to_ms(record_time), float(value)))
+
+        await get_influxdb_pool().query_stream(org, query, add)
+        self._fetches += 1
+        self._points_fetched += len(rows)
+        logger.info(
+            f"Synced {len(rows)} points of {measurement} {field} {entity_id or ''} "
+            f"between {_to_rfc3339(start)} and {_to_rfc3339(stop)}"
+        )
+        return rows
+
+    async def query(
+        self,
+        org: str,
+        bucket: str,
+        measurement: str,
+        field: str,
+        entity_id: Optional[str],
+        start: datetime,
+        stop: datetime,
+        every: float,
+        aggregation: str,
+        quote,
+        sparkline_points: int = 0,
+    ) -> str:
+        """
+        Summarize the aggregated history of the selector in the range, syncing the missing parts first.
+
+        Args:
+            every: Seconds of each aggregation window.
+            quote: Function returning the Flux string literal of a name.
+        """
+        self._queries += 1
+        start_ms, stop_ms = _to_ms(start), _to_ms(stop)
+        selector_id, low_water, high_water = await asyncio.to_thread(
+            self._get_selector, (org, bucket, measurement, field, entity_id or "")
+        )
+        missing = self._get_missing_ranges(start_ms, stop_ms, low_water, high_water)
+        if not missing:
+            self._local_queries += 1
+        for missing_start, missing_stop in missing:
+            for fetch_start, fetch_stop in self._get_chunks(missing_start, missing_stop, low_water):
+                rows = await self._fetch(
+                    org, bucket, measurement, field, entity_id, fetch_start, fetch_stop, quote
+                )
+                # Only the range that can't receive new points is marked as synced
+                synced_until = min(fetch_stop, int((time.time() - self.lag) * 1000))
+                low_water = fetch_start if low_water is None else min(low_water, fetch_start)
+                high_water = synced_until if high_water is None else max(high_water, synced_until)
+                await asyncio.to_thread(
+                    self._save, selector_id, rows, low_water, max(high_water, low_water)
+                )
+
+        names, codes, times, values = await asyncio.to_thread(self._read, selector_id, start_ms, stop_ms)
+        self._points_read += len(values)
+        every_ms = max(int(every * 1000), 1)
+        window_codes, windows, aggregated = aggregate_windows(
+            codes, times, values, start_ms, every_ms, aggregation
+        )
+
+        summary = StreamingSummary(sparkline_points)
+        for code, window, value in zip(window_codes.tolist(), windows.tolist(), aggregated.tolist()):
+            # As aggregateWindow, each window is timestamped with its end
+            summary.add(
+                {
+                    "_start": start,
+                    "_stop": stop,
+                    "_time": _to_datetime(min(start_ms + (window + 1) * every_ms, stop_ms)),
+                    "_value": value,
+                    "_field": field,
+                    "_measurement": measurement,
+                    "entity_id": names[code],
+                }
+            )
+        return summary.get_text()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "queries": self._queries,
+            "local_queries": self._local_queries,
+            "fetches": self._fetches,
+            "points_fetched": self._points_fetched,
+            "points_read": self._points_read,
+        }
+
+
+_history_store: Optional[SensorHistoryStore] = None
+
+
+def get_sensor_history_store() -> SensorHistoryStore:
+    global _history_store
+    if _history_store is None:
+        _history_store = SensorHistoryStore.from_env()
+        register_metrics("sensor_history", _history_store.get_metrics)
+    return _history_store
+
+
+async def stop_sensor_history_store():
+    global _history_store
+    if _history_store is not None:
+        _history_store.close()
+        _history_store = None
@@ -0,0 +1,96 @@
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+import yaml  # type: ignore
+from pydantic import BaseModel
+
+logger = logging.getLogger("uvicorn")
+
+CONFIG_FILE = "config/influxdb.yaml"
+
+
+class InfluxDBQueryConfig(BaseModel):
+    """
+    A Flux query whose result is added as context to the last user message
+    """
+
+    name: str
+    org: str
+    bucket: str
+    query: str
+    agent_description: str = "agent"
+    # Seconds to wait for the result before leaving it out of the context (IDB_QUERY_TIMEOUT if not set)
+    timeout: Optional[float] = None
+    # Add an aggregateWindow (mean) to the query so that each series returns at most this number of points.
+    # Only for queries of numeric values without selectors or aggregates (None or 0 to keep the query as is)
+    max_points: Optional[int] = None
+    # Inject per-series statistics instead of the raw rows
+    summary: bool = True
+    # Number of time buckets of the evolution column of the summary (0 to omit it)
+    sparkline_points: int = 0
+    enabled: bool = True
+
+
+def _load_env_queries() -> List[InfluxDBQueryConfig]:
+    """
+    Load the queries configured with the `USE_IDB_API_<n>` / `IDB_*_<n>` environment variables
+    """
+    queries = []
+    slots = sorted(
+        int(match.group(1))
+        for match in (re.fullmatch(r"USE_IDB_API_(\d+)", name) for name in os.environ)
+        if match
+    )
+    for slot in slots:
+        use_api = os.getenv(f"USE_IDB_API_{slot}", "false").lower() in ('true', '1', 't', 'y', 'yes')
+        if not use_api:
+            continue
+        values = {}
+        for field in ("bucket", "org", "query"):
+            name = f"IDB_{field.upper()}_{slot}"
+            values[field] = os.getenv(name)
+            if not values[field]:
+                raise ValueError(f"{name} is not set in the environment variables")
+        max_points = os.getenv(f"IDB_MAX_POINTS_{slot}")
+        queries.append(
+            InfluxDBQueryConfig(
+                name=f"IDB_QUERY_{slot}",
+                agent_description=os.getenv(f"IDB_AGENT_DESCRIPTION_{slot}", "agent"),
+                max_points=int(max_points) if max_points else None,
+                **values,
+            )
+        )
+    return queries
+
+
+# Queries of the config file, parsed again only when the file changes
+_file_queries: Tuple[Optional[tuple], List[InfluxDBQueryConfig]] = (None, [])
+
+
+def _load_file_queries() -> List[InfluxDBQueryConfig]:
+    global _file_queries
+    if not os.path.exists(CONFIG_FILE):
+        return []
+    stat = os.stat(CONFIG_FILE)
+    stat_key = (stat.st_mtime_ns, stat.st_size)
+    if stat_key != _file_queries[0]:
+        with open(CONFIG_FILE, "r") as f:
+            config = yaml.safe_load(f) or {}
+        _file_queries = (
+            stat_key,
+            [
+                InfluxDBQueryConfig(**query_config)
+                for query_config in config.get("queries") or []
+            ],
+        )
+    return _file_queries[1]
+
+
+def load_influxdb_queries() -> List[InfluxDBQueryConfig]:
+    """
+    Load the enabled queries from `config/influxdb.yaml` and the environment variables
+    """
+    queries = _load_file_queries() + _load_env_queries()
+    return [query for query in queries if query.enabled]
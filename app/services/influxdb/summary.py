@@ -0,0 +1,253 @@
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_MAX_POINTS = 500
+DEFAULT_MAX_SERIES = 50
+# Columns of the Flux tables that don't identify a series
+NON_KEY_COLUMNS = {"result", "table", "_start", "_stop", "_time", "_value"}
+DURATION_UNITS = {
+    "ns": 1e-9,
+    "us": 1e-6,
+    "ms": 1e-3,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 7 * 86400,
+    "mo": 30 * 86400,
+    "y": 365 * 86400,
+}
+_DURATION = r"(?:\d+(?:ns|us|ms|mo|s|m|h|d|w|y))+"
+# Stages that keep the `_time` column and the type of the values, so an aggregateWindow can be added after them
+DOWNSAMPLE_STAGES = {"range", "filter", "toFloat", "toInt", "toUInt"}
+_RANGE = re.compile(
+    rf"range\(\s*start\s*:\s*-(?P<start>{_DURATION})\s*(?:,\s*stop\s*:\s*(?:-(?P<stop>{_DURATION})|now\(\))\s*)?\)"
+)
+
+
+def parse_duration(duration: str) -> float:
+    """
+    Convert a Flux duration literal (e.g. "1h30m") to seconds
+    """
+    return sum(
+        int(value) * DURATION_UNITS[unit]
+        for value, unit in re.findall(r"(\d+)(ns|us|ms|mo|s|m|h|d|w|y)", duration)
+    )
+
+
+def format_duration(seconds: float) -> str:
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{int(seconds // size)}{unit}"
+    return f"{max(int(math.ceil(seconds)), 1)}s"
+
+
+def downsample_query(query: str, max_points: int, fn: str = "mean") -> str:
+    """
+    Add an `aggregateWindow` to the query so that each series returns at most `max_points` points.
+
+    Only queries of the form `from() |> range()` with a relative range followed by filters or numeric
+    conversions are rewritten, the rest (selectors, aggregates, pivots...) are returned as is. The values
+    must be numeric for `fn`, which is why the downsampling is enabled per query.
+    """
+    stages = [re.match(r"\s*(\w+)\s*\(", stage) for stage in query.split("|>")]
+    if (
+        any(stage is None for stage in stages)
+        or stages[0].group(1) != "from"
+        or any(stage.group(1) not in DOWNSAMPLE_STAGES for stage in stages[1:])
+    ):
+        return query
+    match = _RANGE.search(query)
+    if match is None:
+        return query
+    duration = parse_duration(match.group("start")) - parse_duration(
+        match.group("stop") or "0s"
+    )
+    if duration <= 0 or max_points <= 0:
+        return query
+    every = duration / max_points
+    # Round the window up to a whole number of minutes or seconds
+    every = math.ceil(every / 60) * 60 if every >= 60 else math.ceil(every)
+    return f"{query.rstrip()}\n  |> aggregateWindow(every: {format_duration(every)}, fn: {fn}, createEmpty: false)"
+
+
+def _format_number(value: Optional[float]) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return f"{value:.4g}"
+
+
+def _is_key_column(column: Any) -> bool:
+    return column not in NON_KEY_COLUMNS and not str(column).startswith("Unnamed")
+
+
+@dataclass
+class SeriesStats:
+    name: str
+    count: int
+    min: Optional[float]
+    max: Optional[float]
+    mean: Optional[float]
+    last: Optional[float]
+    trend: Optional[float]
+    buckets: Optional[List[Optional[float]]] = None
+
+
+def format_summary(
+    series: List[SeriesStats],
+    points: int,
+    time_range: Optional[Tuple[datetime, datetime]],
+    sparkline_points: int = 0,
+    max_series: int = DEFAULT_MAX_SERIES,
+) -> str:
+    """
+    Render the statistics of the series as a compact pipe-separated table
+    """
+    if not series:
+        return "Sin datos."
+    if time_range is not None:
+        lines = [
+            f"Resumen de {len(series)} series ({points} puntos) entre "
+            f"{time_range[0]:%Y-%m-%d %H:%M} y {time_range[1]:%Y-%m-%d %H:%M} UTC:"
+        ]
+    else:
+        lines = [f"Resumen de {len(series)} series ({points} puntos):"]
+    columns = ["serie", "n", "min", "max", "media", "último", "tendencia/h"]
+    with_buckets = sparkline_points > 0 and any(stats.buckets for stats in series)
+    if with_buckets:
+        columns.append(f"evolución ({sparkline_points} tramos)")
+    lines.append("|".join(columns))
+    for i, stats in enumerate(sorted(series, key=lambda stats: stats.name)):
+        if i >= max_series:
+            lines.append(f"... y {len(series) - max_series} series más")
+            break
+        values = [
+            stats.name,
+            str(stats.count),
+            _format_number(stats.min),
+            _format_number(stats.max),
+            _format_number(stats.mean),
+            _format_number(stats.last),
+            _format_number(stats.trend),
+        ]
+        if with_buckets:
+            values.append(" ".join(_format_number(value) for value in stats.buckets or []))
+        lines.append("|".join(values))
+    return "\n".join(lines)
+
+
+class _SeriesAccumulator:
+    __slots__ = ("count", "min", "max", "sum", "last", "last_time", "origin", "t", "tt", "tv", "bucket_sums", "bucket_counts")
+
+    def __init__(self, sparkline_points: int):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.last: Optional[float] = None
+        self.last_time: Optional[datetime] = None
+        self.origin: Optional[datetime] = None
+        self.t = self.tt = self.tv = 0.0
+        self.bucket_sums = [0.0] * sparkline_points
+        self.bucket_counts = [0] * sparkline_points
+
+
+class StreamingSummary:
+    """
+    Summary of each series of a stream of Flux records: its min/max/mean/last values and trend,
+    and optionally its evolution in `sparkline_points` time buckets.
+
+    Only a fixed-size accumulator is kept per series, so the memory doesn't grow with the number
+    of points. The buckets of the evolution column are placed with the `_start`/`_stop` columns of the
+    records, as the time range is not known in advance.
+    """
+
+    def __init__(self, sparkline_points: int = 0, max_series: int = DEFAULT_MAX_SERIES):
+        self.sparkline_points = sparkline_points
+        self.max_series = max_series
+        self.points = 0
+        self._series: Dict[Tuple, _SeriesAccumulator] = {}
+        self._names: Dict[Tuple, str] = {}
+        self._first_time: Optional[datetime] = None
+        self._last_time: Optional[datetime] = None
+
+    def add(self, values: Dict[str, Any]):
+        """
+        Add a record, given as the `values` dict of a FluxRecord
+        """
+        key = tuple((column, value) for column, value in values.items() if _is_key_column(column))
+        accumulator = self._series.get(key)
+        if accumulator is None:
+            accumulator = self._series[key] = _SeriesAccumulator(self.sparkline_points)
+            self._names[key] = (
+                " ".join(str(value) for _, value in key if value not in (None, "")) or "serie"
+            )
+        self.points += 1
+        value = values.get("_value")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        accumulator.count += 1
+        accumulator.sum += value
+        accumulator.min = min(accumulator.min, value)
+        accumulator.max = max(accumulator.max, value)
+
+        time = values.get("_time")
+        if not isinstance(time, datetime):
+            accumulator.last = value
+            return
+        if accumulator.last_time is None or time >= accumulator.last_time:
+            accumulator.last = value
+            accumulator.last_time = time
+        if accumulator.origin is None:
+            accumulator.origin = time
+        t = (time - accumulator.origin).total_seconds() / 3600
+        accumulator.t += t
+        accumulator.tt += t * t
+        accumulator.tv += t * value
+        if self._first_time is None or time < self._first_time:
+            self._first_time = time
+        if self._last_time is None or time > self._last_time:
+            self._last_time = time
+
+        start, stop = values.get("_start"), values.get("_stop")
+        if self.sparkline_points and isinstance(start, datetime) and isinstance(stop, datetime) and stop > start:
+            position = (time - start).total_seconds() / (stop - start).total_seconds()
+            bucket = min(max(int(position * self.sparkline_points), 0), self.sparkline_points - 1)
+            accumulator.bucket_sums[bucket] += value
+            accumulator.bucket_counts[bucket] += 1
+
+    def get_text(self) -> str:
+        series = []
+        for key, accumulator in self._series.items():
+            n = accumulator.count
+            denominator = n * accumulator.tt - accumulator.t**2
+            series.append(
+                SeriesStats(
+                    name=self._names[key],
+                    count=n,
+                    min=accumulator.min if n else None,
+                    max=accumulator.max if n else None,
+                    mean=accumulator.sum / n if n else None,
+                    last=accumulator.last,
+                    trend=(
+                        (n * accumulator.tv - accumulator.t * accumulator.sum) / denominator
+                        if denominator > 1e-12
+                        else None
+                    ),
+                    buckets=(
+                        [
+                            total / count if count else None
+                            for total, count in zip(accumulator.bucket_sums, accumulator.bucket_counts)
+                        ]
+                        if any(accumulator.bucket_counts)
+                        else None
+                    ),
+                )
+            )
+        time_range = (
+            (self._first_time, self._last_time) if self._first_time is not None else None
+        )
+        return format_summary(series, self.points, time_range, self.sparkline_points, self.max_series)
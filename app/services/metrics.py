@@ -0,0 +1,16 @@
+from typing import Any, Callable, Dict
+
+# Functions returning the current counters of each registered component
+_metrics_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]):
+    """
+    Register a function that returns the metrics of a component.
+    The metrics are exposed by the `/api/metrics` endpoint.
+    """
+    _metrics_providers[name] = provider
+
+
+def collect_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: provider() for name, provider in _metrics_providers.items()}
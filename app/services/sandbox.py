@@ -0,0 +1,472 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.services.metrics import register_metrics
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_POOL_SIZE = 0
+DEFAULT_TTL = 300.0
+CHUNK_SIZE = 1024 * 1024
+
+
+class SandboxError(Exception):
+    """
+    The sandbox, or the connection to it, failed (e.g. it expired), so it can't be used anymore
+    """
+
+
+class Sandbox(ABC):
+    """
+    A code execution sandbox with a stateful Python kernel and its own file system
+    """
+
+    def __init__(self, sandbox_id: str):
+        self.id = sandbox_id
+        self.created_at = time.monotonic()
+        # Content hash of each file written to the sandbox, kept while it's reused from the pool
+        self.manifest: Dict[str, str] = {}
+
+    @abstractmethod
+    def run_code(self, code: str) -> Any:
+        """
+        Run the code in the kernel. The execution has the `results`, `logs` (`stdout` and `stderr`)
+        and `error` attributes of the E2B executions.
+        """
+
+    @abstractmethod
+    def write_file(self, path: str, file: BinaryIO):
+        """
+        Write the content of a local file, read in chunks, to the path of the sandbox
+        """
+
+    @abstractmethod
+    def remove_file(self, path: str):
+        pass
+
+    @abstractmethod
+    def reset(self):
+        """
+        Restart the kernel, dropping the state of the code run so far (the files are kept)
+        """
+
+    @abstractmethod
+    def kill(self):
+        pass
+
+
+class SandboxClient(ABC):
+    @abstractmethod
+    def create(self) -> Sandbox:
+        pass
+
+
+def _get_e2b_errors() -> Tuple[type, ...]:
+    from e2b import SandboxException, TimeoutException
+
+    # Errors of the E2B API and of the connection to the sandbox, not of the local files
+    return (SandboxException, TimeoutException, ConnectionError, TimeoutError)
+
+
+@contextmanager
+def _raise_sandbox_errors(sandbox_id: str):
+    try:
+        yield
+    except _get_e2b_errors() as e:
+        raise SandboxError(f"Sandbox {sandbox_id} failed: {e}") from e
+
+
+class E2BSandbox(Sandbox):
+    def __init__(self, interpreter: Any):
+        super().__init__(getattr(interpreter, "sandbox_id", None) or getattr(interpreter, "id", str(uuid.uuid4())))
+        self._interpreter = interpreter
+
+    def run_code(self, code: str) -> Any:
+        with _raise_sandbox_errors(self.id):
+            return self._interpreter.notebook.exec_cell(code)
+
+    def write_file(self, path: str, file: BinaryIO):
+        # The SDK streams file objects instead of loading them in memory
+        with _raise_sandbox_errors(self.id):
+            self._interpreter.files.write(path, file)
+
+    def remove_file(self, path: str):
+        with _raise_sandbox_errors(self.id):
+            self._interpreter.files.remove(path)
+
+    def reset(self):
+        with _raise_sandbox_errors(self.id):
+            self._interpreter.notebook.restart_kernel()
+
+    def kill(self):
+        self._interpreter.kill()
+
+
+class E2BSandboxClient(SandboxClient):
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def create(self) -> Sandbox:
+        try:
+            from e2b_code_interpreter import CodeInterpreter
+        except ImportError:
+            raise ImportError(
+                "e2b_code_interpreter is not installed. Please install it with `poetry add e2b-code-interpreter`"
+            )
+
+        with _raise_sandbox_errors("creation"):
+            return E2BSandbox(CodeInterpreter(api_key=self.api_key))
+
+
+def get_conversation_id(chat_id: str, messages: Iterable[Tuple[str, str]]) -> str:
+    """
+    Id of a conversation from the random id of the chat in the client and the role and content of its
+    messages. Identical conversations of different clients get different ids.
+    """
+    return hashlib.sha1(
+        "\x00".join([chat_id, *(f"{role}\n{content}" for role, content in messages)]).encode()
+    ).hexdigest()
+
+
+class SandboxPool:
+    """
+    Pool of sandboxes shared by the code interpreter tools.
+
+    `size` sandboxes are kept created in advance so that a conversation doesn't wait for the cold
+    start, and the pool is filled again in the background as they are handed out.
+
+    At the end of a request the sandbox is kept for the next message of the conversation (with the
+    state of its kernel and its files). The sandboxes of the conversations that don't continue within
+    `ttl` seconds, and the idle ones, are killed and replaced by fresh ones. A sandbox released without
+    a conversation has the files uploaded to it removed and its kernel restarted before it goes back
+    to the pool, so nothing is shared between conversations.
+
+    The files are only uploaded to a sandbox if its manifest doesn't have them with the same content hash.
+    """
+
+    def __init__(self, client: SandboxClient, size: int = DEFAULT_POOL_SIZE, ttl: float = DEFAULT_TTL):
+        self.client = client
+        self.size = size
+        self.ttl = ttl
+        # Idle sandboxes with the time they were released, the most recently used last
+        self._idle: Deque[Tuple[Sandbox, float]] = deque()
+        # Sandboxes kept for the next message of each conversation, with the time they were released
+        self._conversations: Dict[str, Tuple[Sandbox, float]] = {}
+        self._creating = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._maintenance: Optional[threading.Thread] = None
+
+        self._created = 0
+        self._reused = 0
+        self._conversation_reuses = 0
+        self._cold_starts = 0
+        self._resets = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._uploads = 0
+        self._skipped_uploads = 0
+        self._uploaded_bytes = 0
+        # Local path -> (mtime and size, content hash), so unchanged files are not hashed again
+        self._digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    @classmethod
+    def from_env(cls, api_key: Optional[str] = None) -> "SandboxPool":
+        api_key = api_key or os.getenv("E2B_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "E2B_API_KEY key is required to run code interpreter. Get it here: https://e2b.dev/docs/getting-started/api-key"
+            )
+        return cls(
+            E2BSandboxClient(api_key),
+            size=int(os.getenv("E2B_POOL_SIZE", DEFAULT_POOL_SIZE)),
+            ttl=float(os.getenv("E2B_SANDBOX_TTL", DEFAULT_TTL)),
+        )
+
+    def _create(self) -> Sandbox:
+        sandbox = self.client.create()
+        self._created += 1
+        logger.info(f"Created sandbox {sandbox.id}")
+        return sandbox
+
+    def _kill(self, sandbox: Sandbox):
+        try:
+            sandbox.kill()
+        except Exception as e:
+            logger.warning(f"Failed to kill sandbox {sandbox.id}: {e}")
+
+    def _fill(self):
+        while not self._closed.is_set():
+            with self._lock:
+                if len(self._idle) + self._creating >= self.size:
+                    return
+                self._creating += 1
+            try:
+                sandbox = self._create()
+            except Exception:
+                logger.exception("Failed to create a sandbox for the pool")
+                return
+            finally:
+                with self._lock:
+                    self._creating -= 1
+            with self._lock:
+                if not self._closed.is_set():
+                    self._idle.append((sandbox, time.monotonic()))
+                    continue
+            self._kill(sandbox)
+
+    def _fill_in_background(self):
+        if self.size > 0 and not self._closed.is_set():
+            threading.Thread(target=self._fill, name="sandbox-pool-fill", daemon=True).start()
+
+    def _recycle_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sandbox for sandbox, released_at in self._idle if now - released_at > self.ttl]
+            self._idle = deque(item for item in self._idle if now - item[1] <= self.ttl)
+            for conversation_id, (sandbox, released_at) in list(self._conversations.items()):
+                if now - released_at > self.ttl:
+                    expired.append(sandbox)
+                    del self._conversations[conversation_id]
+        for sandbox in expired:
+            logger.info(f"Recycling sandbox {sandbox.id}, idle for more than {self.ttl}s")
+            self._kill(sandbox)
+        self._recycled += len(expired)
+
+    def _run_maintenance(self):
+        interval = max(min(self.ttl / 4, 30.0), 0.1)
+        while not self._closed.wait(interval):
+            self._recycle_expired()
+            self._fill()
+
+    def start(self):
+        """
+        Create the warm sandboxes and start recycling the idle ones in the background
+        """
+        if self._maintenance is None:
+            self._maintenance = threading.Thread(target=self._run_maintenance, name="sandbox-pool", daemon=True)
+            self._maintenance.start()
+            self._fill_in_background()
+
+    def get_digest(self, local_path: str) -> str:
+        """
+        SHA-256 of the content of a local file, computed in chunks
+        """
+        stat = os.stat(local_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(local_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(local_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._digests[local_path] = (key, digest.hexdigest())
+        return digest.hexdigest()
+
+    def sync_files(self, sandbox: Sandbox, files: List[Tuple[str, str]]) -> int:
+        """
+        Upload the new or changed files to the sandbox.
+
+        Args:
+            files: Path in the sandbox and local path of each file.
+
+        Returns:
+            The number of files uploaded.
+        """
+        uploaded = 0
+        for sandbox_path, local_path in files:
+            digest = self.get_digest(local_path)
+            if sandbox.manifest.get(sandbox_path) == digest:
+                self._skipped_uploads += 1
+                continue
+            # Forget the previous content first, in case the upload fails halfway
+            sandbox.manifest.pop(sandbox_path, None)
+            with open(local_path, "rb") as f:
+                sandbox.write_file(sandbox_path, f)
+            sandbox.manifest[sandbox_path] = digest
+            uploaded += 1
+            self._uploads += 1
+            self._uploaded_bytes += os.path.getsize(local_path)
+        return uploaded
+
+    def acquire(self, conversation_id: Optional[str] = None) -> Sandbox:
+        """
+        Get a sandbox for a request: the one kept for the conversation, a warm one if available,
+        or a new one otherwise.
+
+        Args:
+            conversation_id: Id of the conversation up to the previous message (see `release`).
+        """
+        if self._closed.is_set():
+            raise RuntimeError("The sandbox pool is closed")
+        self._recycle_expired()
+        with self._lock:
+            kept = self._conversations.pop(conversation_id, None) if conversation_id else None
+            if kept is not None:
+                self._conversation_reuses += 1
+                return kept[0]
+            sandbox = self._idle.pop()[0] if self._idle else None
+        if sandbox is None:
+            self._cold_starts += 1
+            sandbox = self._create()
+        else:
+            self._reused += 1
+        self._fill_in_background()
+        return sandbox
+
+    def reset(self, sandbox: Sandbox) -> bool:
+        """
+        Restart the kernel of the sandbox. If that fails the sandbox is killed and False is returned.
+        """
+        try:
+            sandbox.reset()
+            self._resets += 1
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to reset sandbox {sandbox.id}, discarding it: {e}")
+            self.discard(sandbox)
+            return False
+
+    def _clean(self, sandbox: Sandbox) -> bool:
+        try:
+            for path in list(sandbox.manifest):
+                sandbox.remove_file(path)
+                del sandbox.manifest[path]
+        except Exception as e:
+            logger.warning(f"Failed to remove the files of sandbox {sandbox.id}, discarding it: {e}")
+            self.discard(sandbox)
+            return False
+        return self.reset(sandbox)
+
+    def release(self, sandbox: Sandbox, conversation_id: Optional[str] = None):
+        """
+        Give back a sandbox at the end of a request. It blocks while the sandbox is cleaned,
+        use `arelease` from the event loop.
+
+        Args:
+            conversation_id: Id of the conversation including the answer, to keep the sandbox for its
+                next message. Without it the sandbox is cleaned and goes back to the pool.
+        """
+        if self._closed.is_set():
+            self._kill(sandbox)
+            return
+        if conversation_id:
+            with self._lock:
+                previous = self._conversations.pop(conversation_id, None)
+                self._conversations[conversation_id] = (sandbox, time.monotonic())
+            if previous is not None:
+                self.discard(previous[0])
+            return
+        if self._clean(sandbox):
+            with self._lock:
+                self._idle.append((sandbox, time.monotonic()))
+
+    async def arelease(self, sandbox: Sandbox, conversation_id: Optional[str] = None):
+        await asyncio.to_thread(self.release, sandbox, conversation_id)
+
+    def discard(self, sandbox: Sandbox):
+        self._discarded += 1
+        self._kill(sandbox)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            idle = [sandbox for sandbox, _ in self._idle]
+            idle.extend(sandbox for sandbox, _ in self._conversations.values())
+            self._idle.clear()
+            self._conversations.clear()
+        for sandbox in idle:
+            self._kill(sandbox)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "idle": len(self._idle),
+            "created": self._created,
+            "reused": self._reused,
+            "conversations": len(self._conversations),
+            "conversation_reuses": self._conversation_reuses,
+            "cold_starts": self._cold_starts,
+            "resets": self._resets,
+            "recycled": self._recycled,
+            "discarded": self._discarded,
+            "uploads": self._uploads,
+            "skipped_uploads": self._skipped_uploads,
+            "uploaded_mb": round(self._uploaded_bytes / 1024 / 1024, 1),
+        }
+
+
+class SandboxSession:
+    """
+    The sandbox of a conversation during a request: taken from the pool the first time the code
+    interpreter runs, and given back by the owner of the request with `aclose`.
+    """
+
+    def __init__(self, conversation_id: Optional[str] = None, pool: Optional[SandboxPool] = None):
+        self.conversation_id = conversation_id
+        self.sandbox: Optional[Sandbox] = None
+        self._pool = pool
+
+    @property
+    def pool(self) -> SandboxPool:
+        if self._pool is None:
+            self._pool = get_sandbox_pool()
+        return self._pool
+
+    def acquire(self) -> Sandbox:
+        if self.sandbox is None:
+            self.sandbox = self.pool.acquire(self.conversation_id)
+        return self.sandbox
+
+    def discard(self):
+        if self.sandbox is not None:
+            self.pool.discard(self.sandbox)
+            self.sandbox = None
+
+    async def aclose(self, conversation_id: Optional[str] = None):
+        """
+        Give the sandbox back to the pool, without blocking the event loop
+
+        Args:
+            conversation_id: Id of the conversation including the answer, None if the request failed.
+        """
+        if self.sandbox is not None:
+            sandbox, self.sandbox = self.sandbox, None
+            await self.pool.arelease(sandbox, conversation_id)
+
+
+_sandbox_pool: Optional[SandboxPool] = None
+_sandbox_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool(api_key: Optional[str] = None) -> SandboxPool:
+    global _sandbox_pool
+    with _sandbox_pool_lock:
+        if _sandbox_pool is None:
+            _sandbox_pool = SandboxPool.from_env(api_key)
+            register_metrics("sandbox_pool", _sandbox_pool.get_metrics)
+    return _sandbox_pool
+
+
+async def start_sandbox_pool():
+    # Only keep warm sandboxes when they are requested and the interpreter can run
+    if int(os.getenv("E2B_POOL_SIZE", DEFAULT_POOL_SIZE)) > 0 and os.getenv("E2B_API_KEY"):
+        get_sandbox_pool().start()
+
+
+async def stop_sandbox_pool():
+    global _sandbox_pool
+    if _sandbox_pool is not None:
+        _sandbox_pool.close()
+        _sandbox_pool = None
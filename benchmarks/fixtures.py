@@ -0,0 +1,146 @@
+"""Synthetic Home Assistant entities in the format of the REST API and hass-entities.json."""
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+
+AREAS = ["salon", "cocina", "dormitorio", "baño", "despacho", "terraza", "entrada"]
+DOMAINS = [
+    "light",
+    "cover",
+    "climate",
+    "sensor",
+    "binary_sensor",
+    "switch",
+    "media_player",
+]
+
+
+def _get_attributes(domain: str, rng: random.Random) -> Dict[str, Any]:
+    match domain:
+        case "light":
+            return {
+                "min_color_temp_kelvin": 2000,
+                "max_color_temp_kelvin": 6535,
+                "supported_color_modes": ["color_temp", "hs"],
+                "color_mode": "color_temp",
+                "brightness": rng.randint(0, 255),
+                "color_temp_kelvin": rng.choice([2700, 3000, 4000]),
+                "hs_color": [27.0, 56.0],
+                "rgb_color": [255, 167, 112],
+                "xy_color": [0.524, 0.387],
+                "supported_features": 40,
+            }
+        case "cover":
+            return {
+                "current_position": rng.randint(0, 100),
+                "device_class": "shutter",
+                "supported_features": 15,
+            }
+        case "climate":
+            return {
+                "hvac_modes": ["off", "heat"],
+                "min_temp": 7,
+                "max_temp": 35,
+                "current_temperature": round(rng.uniform(15, 24), 1),
+                "temperature": 21,
+                "hvac_action": rng.choice(["idle", "heating"]),
+                "preset_mode": "none",
+                "preset_modes": ["none", "away", "eco"],
+                "supported_features": 401,
+            }
+        case "sensor":
+            return {
+                "state_class": "measurement",
+                "unit_of_measurement": "°C",
+                "device_class": "temperature",
+            }
+        case "binary_sensor":
+            return {"device_class": rng.choice(["door", "motion", "window"])}
+        case "media_player":
+            return {
+                "volume_level": round(rng.random(), 2),
+                "is_volume_muted": False,
+                "media_title": "Radio",
+                "source": "Spotify",
+                "source_list": ["Spotify", "TV", "Bluetooth"],
+                "supported_features": 152463,
+            }
+        case _:
+            return {}
+
+
+def _get_state(domain: str, rng: random.Random) -> str:
+    match domain:
+        case "light" | "switch":
+            return rng.choice(["on", "off"])
+        case "cover":
+            return rng.choice(["open", "closed"])
+        case "climate":
+            return rng.choice(["heat", "off"])
+        case "sensor":
+            return str(round(rng.uniform(10, 30), 1))
+        case "binary_sensor":
+            return rng.choice(["on", "off"])
+        case "media_player":
+            return rng.choice(["playing", "paused", "off"])
+        case _:
+            return "unknown"
+
+
+def generate_state(entity_id: str, rng: random.Random) -> Dict[str, Any]:
+    """
+    Generate a state object like the ones returned by `/api/states`
+    """
+    domain, object_id = entity_id.split(".", 1)
+    timestamp = (
+        datetime(2024, 12, 1, tzinfo=timezone.utc)
+        + timedelta(seconds=rng.randint(0, 86400))
+    ).isoformat()
+    return {
+        "entity_id": entity_id,
+        "state": _get_state(domain, rng),
+        "attributes": {
+            **_get_attributes(domain, rng),
+            "icon": f"mdi:{domain.replace('_', '-')}",
+            "friendly_name": object_id.replace("_", " ").capitalize(),
+        },
+        "last_changed": timestamp,
+        "last_reported": timestamp,
+        "last_updated": timestamp,
+        "context": {
+            "id": uuid.UUID(int=rng.getrandbits(128)).hex.upper(),
+            "parent_id": None,
+            "user_id": None,
+        },
+    }
+
+
+def generate_entities(
+    count: int, seed: int = 0
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Generate the states of `count` entities and their descriptions (hass-entities.json format)
+
+    Returns:
+        The list of states and the list of descriptions.
+    """
+    rng = random.Random(seed)
+    states = []
+    descriptions = []
+    for i in range(count):
+        domain = DOMAINS[i % len(DOMAINS)]
+        area = AREAS[(i // len(DOMAINS)) % len(AREAS)]
+        entity_id = f"{domain}.{domain}_{area}_{i}"
+        states.append(generate_state(entity_id, rng))
+        descriptions.append(
+            {
+                "entity_id": entity_id,
+                "entity_metadata": {
+                    "domain": domain,
+                    "area": area,
+                    "description_behaviour": f"{domain.replace('_', ' ')} {i} del {area}",
+                },
+            }
+        )
+    return states, descriptions
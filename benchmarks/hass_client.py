@@ -0,0 +1,74 @@
+"""
+Requests per second against a local Home Assistant stub: a new `requests` connection per call
+(the previous behaviour) compared with the shared pooled HassClient, sequential and concurrent.
+
+Run with: `poetry run python -m benchmarks.hass_client`
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import requests  # type: ignore
+
+from app.services.hass.client import HassClient
+from benchmarks.fixtures import generate_entities
+from benchmarks.hass_stub import create_hass_stub_app, run_hass_stub
+
+TOKEN = "benchmark"
+DATA = {"entity_id": "light.light_salon_0", "brightness": 200}
+
+
+def bench_requests(base_url: str, count: int) -> float:
+    headers = {"Authorization": f"Bearer {TOKEN}", "Content-Type": "application/json"}
+    start = time.perf_counter()
+    for _ in range(count):
+        response = requests.post(
+            f"{base_url}/api/services/light/turn_on",
+            headers=headers,
+            data=json.dumps(DATA),
+            verify=False,
+        )
+        response.raise_for_status()
+    return count / (time.perf_counter() - start)
+
+
+async def bench_client(base_url: str, count: int, concurrency: int) -> float:
+    client = HassClient(base_url=base_url, token=TOKEN, max_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            await client.call_service("light", "turn_on", DATA)
+
+    try:
+        # Warm up the connection pool
+        await call()
+        start = time.perf_counter()
+        await asyncio.gather(*[call() for _ in range(count)])
+        return count / (time.perf_counter() - start)
+    finally:
+        await client.aclose()
+
+
+def run(count: int, concurrency: int, entities: int):
+    states, _ = generate_entities(entities)
+    with run_hass_stub(create_hass_stub_app(states)) as base_url:
+        results = {
+            "requests (new connection per call)": bench_requests(base_url, count),
+            "HassClient sequential": asyncio.run(bench_client(base_url, count, 1)),
+            f"HassClient concurrency={concurrency}": asyncio.run(
+                bench_client(base_url, count, concurrency)
+            ),
+        }
+    for name, rps in results.items():
+        print(f"{name:<40} {rps:>10.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--entities", type=int, default=100)
+    args = parser.parse_args()
+    run(args.count, args.concurrency, args.entities)
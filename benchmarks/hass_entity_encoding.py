@@ -0,0 +1,63 @@
+"""
+Compare the size and rendering time of the Home Assistant entity context:
+the previous `repr` of the combined entities against the projected tabular encoding.
+The prefill latency is estimated from the token count and the prompt evaluation rate of the model.
+
+Run with: `poetry run python -m benchmarks.hass_entity_encoding`
+"""
+import argparse
+import time
+from typing import Callable, List
+
+from llama_index.core.utils import get_tokenizer
+
+from app.services.hass.projection import encode_entities
+from benchmarks.fixtures import generate_entities
+
+
+def _time(render: Callable[[], str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(counts: List[int], repeat: int, prefill_rate: float):
+    tokenizer = get_tokenizer()
+    print(
+        f"{'entities':>8} {'repr tokens':>12} {'table tokens':>13} {'saved':>7} "
+        f"{'repr ms':>8} {'table ms':>9} {'repr prefill s':>15} {'table prefill s':>16}"
+    )
+    for count in counts:
+        states, descriptions = generate_entities(count)
+        metadata = {d["entity_id"]: d["entity_metadata"] for d in descriptions}
+        entities = [
+            {**state, "entity_metadata": metadata[state["entity_id"]]}
+            for state in states
+        ]
+
+        repr_text = str(entities)
+        table_text = encode_entities(entities)
+        repr_tokens = len(tokenizer(repr_text))
+        table_tokens = len(tokenizer(table_text))
+        print(
+            f"{count:>8} {repr_tokens:>12} {table_tokens:>13} "
+            f"{1 - table_tokens / repr_tokens:>7.1%} "
+            f"{_time(lambda: str(entities), repeat):>8.2f} "
+            f"{_time(lambda: encode_entities(entities), repeat):>9.2f} "
+            f"{repr_tokens / prefill_rate:>15.1f} {table_tokens / prefill_rate:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--prefill-rate",
+        type=float,
+        default=50,
+        help="Prompt tokens per second evaluated by the model (e.g. llama3:8b on CPU)",
+    )
+    args = parser.parse_args()
+    run(args.counts, args.repeat, args.prefill_rate)
@@ -0,0 +1,173 @@
+"""
+End-to-end benchmark of the Home Assistant integration against the local stub, as the number of
+entities grows: state synchronization, context building (`process_ha_rest_entities`), payload
+sizes and action throughput (one call per entity vs. batched calls).
+
+The entity retrieval is disabled by default (`--top-k 0`) so that no embedding model is needed
+and the whole house is injected, which is the worst case for the context size.
+
+Run with: `poetry run python -m benchmarks.hass_integration`
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from llama_index.core.utils import get_tokenizer
+
+from benchmarks.fixtures import generate_entities
+from benchmarks.hass_stub import create_hass_stub_app, run_hass_stub
+
+
+def _configure_env(base_url: str, descriptions_file: str, top_k: int):
+    os.environ.update(
+        {
+            "USE_HASS_API": "true",
+            "HASS_TOKEN": "benchmark",
+            "HASS_API_URL": f"{base_url}/api/states",
+            "HASS_BASE_URL": base_url,
+            "HASS_WS_URL": "",
+            "HASS_ENTITIES_FILE": descriptions_file,
+            "HASS_ENTITY_TOP_K": str(top_k),
+            "HASS_FAST_PATH": "false",
+        }
+    )
+
+
+async def bench_count(
+    base_url: str, count: int, repeat: int, actions: int
+) -> Dict[str, Any]:
+    # Imported here so that the environment is configured before the singletons are created
+    from app.api.routers.chat import process_ha_rest_entities
+    from app.api.routers.models import ChatData, Message
+    from app.engine.tools.hass_action import HassAction
+    from app.services.hass.client import (
+        get_hass_client,
+        start_hass_client,
+        stop_hass_client,
+    )
+    from app.services.hass.state import (
+        get_hass_state_mirror,
+        start_hass_state_mirror,
+        stop_hass_state_mirror,
+    )
+
+    await start_hass_client()
+    start = time.perf_counter()
+    await start_hass_state_mirror()
+    mirror = get_hass_state_mirror()
+    await mirror.wait_until_ready(timeout=60)
+    sync_ms = (time.perf_counter() - start) * 1000
+    try:
+        # Previous behaviour: a full REST fetch of the states on every request
+        start = time.perf_counter()
+        states = await get_hass_client().get_states()
+        rest_ms = (time.perf_counter() - start) * 1000
+        states_bytes = len(json.dumps(states).encode())
+
+        timings = []
+        annotation = ""
+        for _ in range(repeat):
+            data = ChatData(
+                messages=[Message(role="user", content="¿Qué luces están encendidas?")]
+            )
+            start = time.perf_counter()
+            annotations = await process_ha_rest_entities(data)
+            timings.append((time.perf_counter() - start) * 1000)
+            annotation = annotations[-1].data.text if annotations else ""
+
+        lights = [
+            state["entity_id"]
+            for state in states
+            if state["entity_id"].startswith("light.")
+        ][:actions]
+        start = time.perf_counter()
+        for entity_id in lights:
+            await HassAction.arun_hass_action(entity_id, "toggle", {})
+        sequential_s = time.perf_counter() - start
+        start = time.perf_counter()
+        await HassAction.arun_hass_actions(
+            [{"entity_id": entity_id, "action": "toggle"} for entity_id in lights]
+        )
+        batched_s = time.perf_counter() - start
+    finally:
+        await stop_hass_state_mirror()
+        await stop_hass_client()
+
+    return {
+        "entities": count,
+        "sync_ms": sync_ms,
+        "rest_fetch_ms": rest_ms,
+        "states_kb": states_bytes / 1024,
+        "context_ms": statistics.median(timings),
+        "context_kb": len(annotation.encode()) / 1024,
+        "context_tokens": len(get_tokenizer()(annotation)),
+        "sequential_ops": len(lights) / sequential_s if lights else 0,
+        "batched_ops": len(lights) / batched_s if lights else 0,
+    }
+
+
+def run(
+    counts: List[int],
+    repeat: int,
+    actions: int,
+    service_latency: float,
+    websocket_latency: float,
+    top_k: int,
+):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        descriptions_file = os.path.join(tmp_dir, "hass-entities.json")
+        for count in counts:
+            states, descriptions = generate_entities(count)
+            with open(descriptions_file, "w") as f:
+                json.dump(descriptions, f, ensure_ascii=False)
+            app = create_hass_stub_app(states, service_latency, websocket_latency)
+            with run_hass_stub(app) as base_url:
+                _configure_env(base_url, descriptions_file, top_k)
+                results.append(
+                    asyncio.run(bench_count(base_url, count, repeat, actions))
+                )
+
+    print(
+        f"{'entities':>8} {'sync ms':>9} {'REST ms':>9} {'states KB':>10} {'context ms':>11} "
+        f"{'context KB':>11} {'tokens':>8} {'seq ops/s':>10} {'batch ops/s':>12}"
+    )
+    for r in results:
+        print(
+            f"{r['entities']:>8} {r['sync_ms']:>9.1f} {r['rest_fetch_ms']:>9.1f} "
+            f"{r['states_kb']:>10.1f} {r['context_ms']:>11.2f} {r['context_kb']:>11.1f} "
+            f"{r['context_tokens']:>8} {r['sequential_ops']:>10.1f} {r['batched_ops']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--counts", type=int, nargs="+", default=[10, 100, 1000, 10000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--actions", type=int, default=20, help="Number of lights toggled per run"
+    )
+    parser.add_argument(
+        "--service-latency",
+        type=float,
+        default=0.02,
+        help="Seconds added by the stub to each service call",
+    )
+    parser.add_argument("--websocket-latency", type=float, default=0.0)
+    parser.add_argument("--top-k", type=int, default=0)
+    args = parser.parse_args()
+    run(
+        args.counts,
+        args.repeat,
+        args.actions,
+        args.service_latency,
+        args.websocket_latency,
+        args.top_k,
+    )
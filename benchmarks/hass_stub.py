@@ -0,0 +1,175 @@
+"""
+In-process stub of the Home Assistant REST and WebSocket APIs for the benchmarks.
+
+It can also be run standalone to load-test the app without a real house, e.g.
+`poetry run python -m benchmarks.hass_stub --entities 1000 --service-latency 0.05`
+and then point HASS_API_URL / HASS_BASE_URL to it (and HASS_ENTITIES_FILE to the file written
+with `--descriptions-file`).
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+
+from benchmarks.fixtures import generate_entities
+
+# New state of the entity after each service call
+SERVICE_STATES = {
+    "turn_on": "on",
+    "turn_off": "off",
+    "open_cover": "open",
+    "close_cover": "closed",
+}
+
+
+def create_hass_stub_app(
+    states: List[Dict[str, Any]],
+    service_latency: float = 0.0,
+    websocket_latency: float = 0.0,
+) -> FastAPI:
+    """
+    Create the stub app serving the given states.
+
+    Args:
+        states: The states returned by `/api/states` and the `get_states` WebSocket command.
+        service_latency: Seconds to wait before answering each service call.
+        websocket_latency: Seconds to wait before sending each WebSocket message.
+    """
+    app = FastAPI()
+    states_by_id = {state["entity_id"]: state for state in states}
+    subscribers: Set[WebSocket] = set()
+    app.state.service_calls = 0
+
+    async def send(websocket: WebSocket, message: Dict[str, Any]):
+        if websocket_latency:
+            await asyncio.sleep(websocket_latency)
+        await websocket.send_text(json.dumps(message))
+
+    async def update_state(entity_id: str, new_state: Optional[str]):
+        old_state = states_by_id.get(entity_id)
+        if old_state is None or new_state is None:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        state = {**old_state, "state": new_state, "last_changed": now, "last_updated": now}
+        states_by_id[entity_id] = state
+        event = {
+            "type": "event",
+            "event": {
+                "event_type": "state_changed",
+                "data": {
+                    "entity_id": entity_id,
+                    "old_state": old_state,
+                    "new_state": state,
+                },
+            },
+        }
+        for websocket in list(subscribers):
+            try:
+                await send(websocket, {"id": websocket.state.subscription_id, **event})
+            except Exception:
+                subscribers.discard(websocket)
+
+    @app.get("/api/states")
+    async def get_states():
+        return list(states_by_id.values())
+
+    @app.post("/api/services/{domain}/{service}")
+    async def call_service(domain: str, service: str, request: Request):
+        data = await request.json()
+        if service_latency:
+            await asyncio.sleep(service_latency)
+        app.state.service_calls += 1
+        entity_ids = data.get("entity_id") or []
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        for entity_id in entity_ids:
+            new_state = SERVICE_STATES.get(service)
+            if service == "toggle" and entity_id in states_by_id:
+                new_state = "off" if states_by_id[entity_id]["state"] == "on" else "on"
+            await update_state(entity_id, new_state)
+        return [states_by_id[entity_id] for entity_id in entity_ids if entity_id in states_by_id]
+
+    @app.websocket("/api/websocket")
+    async def websocket_api(websocket: WebSocket):
+        await websocket.accept()
+        await send(websocket, {"type": "auth_required", "ha_version": "stub"})
+        await websocket.receive_text()
+        await send(websocket, {"type": "auth_ok", "ha_version": "stub"})
+        try:
+            while True:
+                message = json.loads(await websocket.receive_text())
+                match message.get("type"):
+                    case "subscribe_events":
+                        websocket.state.subscription_id = message["id"]
+                        subscribers.add(websocket)
+                        result = None
+                    case "get_states":
+                        result = list(states_by_id.values())
+                    case _:
+                        result = None
+                await send(
+                    websocket,
+                    {
+                        "id": message.get("id"),
+                        "type": "result",
+                        "success": True,
+                        "result": result,
+                    },
+                )
+        except WebSocketDisconnect:
+            subscribers.discard(websocket)
+
+    return app
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def run_hass_stub(app: FastAPI, port: Optional[int] = None) -> Iterator[str]:
+    """
+    Serve the stub app in a background thread and yield its base URL
+    """
+    port = port or _get_free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entities", type=int, default=100)
+    parser.add_argument("--service-latency", type=float, default=0.0)
+    parser.add_argument("--websocket-latency", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--descriptions-file", help="Write the entity descriptions to this file")
+    args = parser.parse_args()
+    states, descriptions = generate_entities(args.entities)
+    if args.descriptions_file:
+        with open(args.descriptions_file, "w") as f:
+            json.dump(descriptions, f, ensure_ascii=False)
+    uvicorn.run(
+        create_hass_stub_app(states, args.service_latency, args.websocket_latency),
+        host="127.0.0.1",
+        port=args.port,
+    )
@@ -0,0 +1,74 @@
+"""
+Per-request cost of getting the document index: `load_index_from_storage` on every request with a
+cached StorageContext (the previous behaviour) compared with the shared index loaded once.
+
+The index is generated with random embeddings in a temporary directory.
+
+Run with: `poetry run python -m benchmarks.index_loading`
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core import MockEmbedding
+from llama_index.core.indices import VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import TextNode
+from llama_index.core.settings import Settings
+from llama_index.core.storage import StorageContext
+
+from app.engine.index import SharedIndex
+
+DIMENSION = 256
+
+
+def create_storage(storage_dir: str, nodes: int):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((nodes, DIMENSION)).astype(np.float32)
+    index = VectorStoreIndex(
+        nodes=[
+            TextNode(text=f"Documento {i}", embedding=embedding.tolist(), metadata={"private": "false"})
+            for i, embedding in enumerate(embeddings)
+        ]
+    )
+    index.storage_context.persist(persist_dir=storage_dir)
+
+
+def run(nodes_list: list[int], requests: int):
+    Settings.embed_model = MockEmbedding(embed_dim=DIMENSION)
+    print(f"{'nodes':>8} {'load ms':>9} {'before ms/request':>18} {'after ms/request':>17} {'query ms':>9}")
+    for nodes in nodes_list:
+        with tempfile.TemporaryDirectory() as storage_dir:
+            create_storage(storage_dir, nodes)
+
+            start = time.perf_counter()
+            storage_context = StorageContext.from_defaults(persist_dir=storage_dir)
+            load_index_from_storage(storage_context)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            for _ in range(requests):
+                load_index_from_storage(storage_context)
+            before_ms = (time.perf_counter() - start) / requests * 1000
+
+            shared_index = SharedIndex(storage_dir)
+            shared_index.get()
+            start = time.perf_counter()
+            for _ in range(requests):
+                index = shared_index.get_view()
+            after_ms = (time.perf_counter() - start) / requests * 1000
+
+            retriever = index.as_retriever(similarity_top_k=3)
+            start = time.perf_counter()
+            asyncio.run(retriever.aretrieve("consulta"))
+            query_ms = (time.perf_counter() - start) * 1000
+            print(f"{nodes:>8} {load_ms:>9.1f} {before_ms:>18.2f} {after_ms:>17.3f} {query_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    run(args.nodes, args.requests)
@@ -0,0 +1,93 @@
+"""
+Queries per second against a local InfluxDB stub: a new synchronous `InfluxDBClient` per query
+(the previous behaviour) compared with the shared async InfluxDBClientPool, sequential and concurrent.
+
+Run with: `poetry run python -m benchmarks.influxdb_client`
+"""
+import argparse
+import asyncio
+import time
+import warnings
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.warnings import MissingPivotFunction
+
+from app.services.influxdb.client import InfluxDBClientPool
+from benchmarks.hass_stub import run_hass_stub
+from benchmarks.influxdb_stub import create_influxdb_stub_app
+
+TOKEN = "benchmark"
+ORG = "home"
+QUERY = 'from(bucket: "home") |> range(start: -1h)'
+
+warnings.simplefilter("ignore", MissingPivotFunction)
+
+
+def bench_new_client(url: str, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        client = InfluxDBClient(url=url, token=TOKEN, org=ORG, verify_ssl=False)
+        client.query_api().query_data_frame(QUERY)
+    return count / (time.perf_counter() - start)
+
+
+async def bench_pool(url: str, count: int, concurrency: int) -> tuple[float, dict]:
+    pool = InfluxDBClientPool(url=url, token=TOKEN)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def query():
+        async with semaphore:
+            await pool.query_stream(ORG, QUERY, lambda values: None)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[query() for _ in range(count)])
+        return count / (time.perf_counter() - start), pool.get_metrics()[ORG]
+    finally:
+        await pool.aclose()
+
+
+async def check_timeout(url: str, timeout: float) -> str:
+    pool = InfluxDBClientPool(url=url, token=TOKEN, query_timeout=timeout)
+    try:
+        await pool.query_stream(ORG, QUERY, lambda values: None)
+        return "no timeout"
+    except TimeoutError as e:
+        return str(e)
+    finally:
+        await pool.aclose()
+
+
+def run(count: int, concurrency: int, points: int, latency: float):
+    app = create_influxdb_stub_app(series=2, points=points, latency=latency)
+    with run_hass_stub(app) as url:
+        results = {
+            "InfluxDBClient per query": (bench_new_client(url, count), None),
+            "InfluxDBClientPool sequential": asyncio.run(bench_pool(url, count, 1)),
+            f"InfluxDBClientPool concurrency={concurrency}": asyncio.run(
+                bench_pool(url, count, concurrency)
+            ),
+        }
+        timeout_result = asyncio.run(check_timeout(url, latency / 2)) if latency else None
+
+    for name, (qps, metrics) in results.items():
+        connections = (
+            f"  new connections: {metrics['new_connections']}, reused: {metrics['reused_connections']}"
+            if metrics
+            else ""
+        )
+        print(f"{name:<40} {qps:>8.1f} queries/s{connections}")
+    if timeout_result:
+        print(f"Query timeout of {latency / 2}s: {timeout_result}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--points", type=int, default=100, help="Points per series")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added by the stub to each query"
+    )
+    args = parser.parse_args()
+    run(args.count, args.concurrency, args.points, args.latency)
@@ -0,0 +1,203 @@
+"""
+Peak memory and latency of summarizing a large InfluxDB result: `query_data_frame` plus a pandas
+summary (the previous path, kept here) compared with the record stream and the incremental summary.
+
+Each measurement runs in a separate process so that the peak RSS of one path doesn't hide the other.
+
+Run with: `poetry run python -m benchmarks.influxdb_streaming`
+"""
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+import warnings
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from app.services.influxdb.summary import (
+    DEFAULT_MAX_SERIES,
+    SeriesStats,
+    _is_key_column,
+    format_summary,
+)
+from benchmarks.hass_stub import run_hass_stub
+from benchmarks.influxdb_stub import create_influxdb_stub_app
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+TOKEN = "benchmark"
+ORG = "home"
+QUERY = 'from(bucket: "home") |> range(start: -30d)'
+
+
+def _get_series_name(values: Dict[str, Any], key_columns: List[str]) -> str:
+    return " ".join(str(values[column]) for column in key_columns if values.get(column) not in (None, ""))
+
+
+def summarize_data_frame(
+    data_frame: "pd.DataFrame",
+    sparkline_points: int = 0,
+    max_series: int = DEFAULT_MAX_SERIES,
+) -> str:
+    """
+    Summarize each series of a Flux result like StreamingSummary, from the whole result loaded
+    as a DataFrame (the previous path)
+    """
+    import numpy as np
+    import pandas as pd
+
+    if data_frame is None or data_frame.empty or "_value" not in data_frame:
+        return "Sin datos."
+    key_columns = [column for column in data_frame.columns if _is_key_column(column)]
+    df = data_frame.copy()
+    if not key_columns:
+        df["serie"] = "serie"
+        key_columns = ["serie"]
+    df["_value"] = pd.to_numeric(df["_value"], errors="coerce")
+    time_range = None
+    if "_time" in df:
+        df = df.sort_values("_time")
+        times = pd.to_datetime(df["_time"], utc=True)
+        time_range = (times.min(), times.max())
+        seconds = times.astype("int64") / 1e9
+        df["_t"] = (seconds - seconds.min()) / 3600
+    else:
+        df["_t"] = np.arange(len(df), dtype=float)
+    # Sums for the least squares slope of each series, computed for all the series at once
+    df["_tt"] = df["_t"] * df["_t"]
+    df["_tv"] = df["_t"] * df["_value"]
+
+    grouped = df.groupby(key_columns, dropna=False)
+    stats = grouped["_value"].agg(["count", "min", "max", "mean", "last"])
+    sums = grouped[["_t", "_tt", "_tv", "_value"]].sum()
+    n = stats["count"]
+    denominator = n * sums["_tt"] - sums["_t"] ** 2
+    stats["trend"] = (n * sums["_tv"] - sums["_t"] * sums["_value"]) / denominator.where(
+        denominator != 0
+    )
+
+    buckets = None
+    if sparkline_points > 0 and time_range is not None:
+        # Mean of each series in equal time buckets
+        t_range = df["_t"].max() or 1
+        df["_bucket"] = np.minimum(
+            (df["_t"] / t_range * sparkline_points).astype(int), sparkline_points - 1
+        )
+        buckets = (
+            df.groupby([*key_columns, "_bucket"], dropna=False)["_value"]
+            .mean()
+            .unstack("_bucket")
+            .reindex(columns=range(sparkline_points))
+        )
+
+    keys = stats.index.to_frame(index=False).to_dict("records")
+    series = [
+        SeriesStats(
+            name=_get_series_name(key_values, key_columns),
+            count=int(row["count"]),
+            min=row["min"],
+            max=row["max"],
+            mean=row["mean"],
+            last=row["last"],
+            trend=row["trend"],
+            buckets=buckets.loc[key].tolist() if buckets is not None else None,
+        )
+        for key_values, (key, row) in zip(keys, stats.iterrows())
+    ]
+    return format_summary(series, len(df), time_range, sparkline_points, max_series)
+
+
+def summarize_data_frames(
+    data_frames: List["pd.DataFrame"],
+    sparkline_points: int = 0,
+    max_series: Optional[int] = DEFAULT_MAX_SERIES,
+) -> str:
+    return "\n".join(
+        summarize_data_frame(data_frame, sparkline_points, max_series or DEFAULT_MAX_SERIES)
+        for data_frame in data_frames
+    )
+
+
+def _get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _run_worker(path: str, url: str, sparkline_points: int) -> dict:
+    from influxdb_client.client.warnings import MissingPivotFunction
+
+    from app.services.influxdb.client import InfluxDBClientPool
+    from app.services.influxdb.summary import StreamingSummary
+
+    warnings.simplefilter("ignore", MissingPivotFunction)
+    pool = InfluxDBClientPool(url=url, token=TOKEN, query_timeout=600)
+    try:
+        # Warm up the client (and load pandas) before taking the baseline
+        import pandas  # noqa: F401
+
+        baseline = _get_peak_rss_mb()
+        start = time.perf_counter()
+        if path == "dataframe":
+            data_frame = await pool.get_client(ORG).query_api().query_data_frame(QUERY, org=ORG)
+            data_frames = data_frame if isinstance(data_frame, list) else [data_frame]
+            text = summarize_data_frames(data_frames, sparkline_points)
+        else:
+            summary = StreamingSummary(sparkline_points)
+            await pool.query_stream(ORG, QUERY, summary.add)
+            text = summary.get_text()
+        seconds = time.perf_counter() - start
+    finally:
+        await pool.aclose()
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": _get_peak_rss_mb() - baseline,
+        "summary_chars": len(text),
+    }
+
+
+def run(series: int, points_list: list[int], sparkline_points: int):
+    print(f"{'points':>10} {'path':<10} {'seconds':>8} {'peak RSS +MB':>13} {'summary chars':>14}")
+    for points in points_list:
+        app = create_influxdb_stub_app(series=series, points=points)
+        with run_hass_stub(app) as url:
+            for path in ("dataframe", "stream"):
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.influxdb_streaming",
+                        "--worker",
+                        path,
+                        "--url",
+                        url,
+                        "--sparkline-points",
+                        str(sparkline_points),
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{series * points:>10} {path:<10} {result['seconds']:>8.2f} "
+                    f"{result['peak_rss_mb']:>13.1f} {result['summary_chars']:>14}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--series", type=int, default=4)
+    parser.add_argument(
+        "--points", type=int, nargs="+", default=[10_000, 50_000, 250_000], help="Points per series"
+    )
+    parser.add_argument("--sparkline-points", type=int, default=12)
+    parser.add_argument("--worker", choices=["dataframe", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(asyncio.run(_run_worker(args.worker, args.url, args.sparkline_points))))
+    else:
+        run(args.series, args.points, args.sparkline_points)
@@ -0,0 +1,78 @@
+"""In-process stub of the InfluxDB query API returning canned annotated CSV for the benchmarks."""
+import asyncio
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+START = datetime(2024, 12, 1, tzinfo=timezone.utc)
+HEADER = (
+    "#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,double,string,string,string\n"
+    "#group,false,false,true,true,false,false,true,true,true\n"
+    "#default,_result,,,,,,,,\n"
+    ",result,table,_start,_stop,_time,_value,_field,_measurement,entity_id\n"
+)
+
+
+def generate_annotated_csv(
+    series: int, points: int, interval: int = 10, chunk_rows: int = 1000
+) -> Iterator[str]:
+    """
+    Generate the annotated CSV of `series` temperature series with `points` points each,
+    `interval` seconds apart, in chunks of `chunk_rows` rows
+    """
+    start = START.isoformat().replace("+00:00", "Z")
+    stop = (START + timedelta(seconds=points * interval)).isoformat().replace("+00:00", "Z")
+    yield HEADER
+    rows = []
+    for table in range(series):
+        entity_id = f"temperatura_{table}"
+        for i in range(points):
+            timestamp = (START + timedelta(seconds=i * interval)).isoformat().replace("+00:00", "Z")
+            # Daily cycle plus a slow drift, different for each series
+            value = 20 + 3 * math.sin(2 * math.pi * i * interval / 86400 + table) + i * 1e-5
+            rows.append(
+                f",,{table},{start},{stop},{timestamp},{value:.2f},value,°C,{entity_id}\n"
+            )
+            if len(rows) >= chunk_rows:
+                yield "".join(rows)
+                rows = []
+    if rows:
+        yield "".join(rows)
+    yield "\n"
+
+
+def create_influxdb_stub_app(
+    series: int = 2, points: int = 100, interval: int = 10, latency: float = 0.0
+) -> FastAPI:
+    """
+    Create the stub app. Every Flux query returns the same generated series.
+
+    Args:
+        series: Number of series (tables) in the result.
+        points: Number of points of each series.
+        interval: Seconds between the points.
+        latency: Seconds to wait before answering each query.
+    """
+    app = FastAPI()
+    app.state.queries = 0
+
+    @app.get("/ping")
+    @app.get("/health")
+    async def health():
+        return {"status": "pass"}
+
+    @app.post("/api/v2/query")
+    async def query(request: Request):
+        await request.body()
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.queries += 1
+        return StreamingResponse(
+            generate_annotated_csv(series, points, interval),
+            media_type="text/csv; charset=utf-8",
+        )
+
+    return app
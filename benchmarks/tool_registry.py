@@ -0,0 +1,35 @@
+"""
+Time spent getting the tools of `config/tools.yaml` for each chat request: `ToolFactory.from_env`
+(the previous behaviour, building every tool on each request) compared with the shared ToolRegistry.
+
+Run with: `poetry run python -m benchmarks.tool_registry`
+"""
+import argparse
+import time
+
+from app.engine.tools import ToolFactory, ToolRegistry
+
+
+def bench(get_tools, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        get_tools()
+    return (time.perf_counter() - start) / requests * 1000
+
+
+def run(requests: int):
+    # Import the tool modules first, so that only the per-request work is measured
+    tools = ToolFactory.from_env()
+    registry = ToolRegistry()
+    registry.reload_if_changed()
+    print(f"{len(tools)} tools, first build of the registry: {registry.get_metrics()['last_build_ms']} ms")
+    print(f"{'path':<24} {'ms/request':>10}")
+    print(f"{'ToolFactory.from_env':<24} {bench(ToolFactory.from_env, requests):>10.3f}")
+    print(f"{'ToolRegistry.get_tools':<24} {bench(registry.get_tools, requests):>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    run(args.requests)
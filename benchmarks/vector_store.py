@@ -0,0 +1,157 @@
+"""
+Recall@k and query latency of the HNSW and NumPy vector stores compared with the default
+SimpleVectorStore, without filters and with the public documents filter of the chat
+(`generate_filters([])`), plus the time to load each store from disk and the latency per query
+of the batched search of the NumPy store.
+
+The embeddings are synthetic (clusters of random unit vectors) and the exact top k is computed
+with NumPy. The SimpleVectorStore keeps the embeddings as Python lists, so it's only measured up
+to `--baseline-max` nodes.
+
+Run with: `poetry run python -m benchmarks.vector_store`
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+
+from app.engine.query_filter import generate_filters
+from app.engine.vector_stores.exact import NumpyVectorStore
+from app.engine.vector_stores.hnsw import HNSWVectorStore
+
+BATCH_SIZE = 10_000
+STORES = {
+    "hnsw": HNSWVectorStore,
+    "numpy": NumpyVectorStore,
+    "simple": SimpleVectorStore,
+}
+
+
+def create_embeddings(nodes: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((max(nodes // 100, 1), dimension)).astype(np.float32)
+    embeddings = centers[rng.integers(0, len(centers), nodes)]
+    embeddings += 0.5 * rng.standard_normal((nodes, dimension)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def iter_nodes(embeddings: np.ndarray, private: np.ndarray) -> Iterator[List[TextNode]]:
+    for start in range(0, len(embeddings), BATCH_SIZE):
+        yield [
+            TextNode(
+                id_=str(i),
+                text=f"Documento {i}",
+                embedding=embeddings[i].tolist(),
+                metadata={"private": "true" if private[i] else "false"},
+            )
+            for i in range(start, min(start + BATCH_SIZE, len(embeddings)))
+        ]
+
+
+def get_exact_ids(embeddings: np.ndarray, queries: np.ndarray, top_k: int, mask: Optional[np.ndarray]):
+    exact_ids = []
+    for query in queries:
+        similarities = embeddings @ query
+        if mask is not None:
+            similarities[~mask] = -np.inf
+        top = np.argpartition(-similarities, top_k)[:top_k]
+        exact_ids.append({str(i) for i in top})
+    return exact_ids
+
+
+def measure(
+    store: BasePydanticVectorStore,
+    queries: np.ndarray,
+    exact_ids: List[set],
+    top_k: int,
+    filters: Optional[MetadataFilters],
+):
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, exact_ids):
+        start = time.perf_counter()
+        result = store.query(
+            VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k, filters=filters)
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(expected & set(result.ids))
+    recall = hits / (len(queries) * top_k)
+    return recall, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def run(
+    nodes_list: List[int],
+    dimension: int,
+    queries_count: int,
+    top_k: int,
+    baseline_max: int,
+    private_ratio: float,
+):
+    rng = np.random.default_rng(0)
+    filters = generate_filters([])
+    print(
+        f"{'nodes':>8} {'store':>7} {'build s':>8} {'load s':>7} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}"
+        f" {'filtered recall@k':>18} {'p50 ms':>8} {'p99 ms':>8} {'batch ms/query':>15}"
+    )
+    for nodes in nodes_list:
+        embeddings = create_embeddings(nodes, dimension, rng)
+        private = rng.random(nodes) < private_ratio
+        # Queries close to the stored chunks, like questions about a document
+        queries = embeddings[rng.integers(0, nodes, queries_count)] + 0.1 * rng.standard_normal(
+            (queries_count, dimension)
+        ).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        exact_ids = get_exact_ids(embeddings, queries, top_k, None)
+        exact_public_ids = get_exact_ids(embeddings, queries, top_k, ~private)
+
+        names = ["hnsw", "numpy"] + (["simple"] if nodes <= baseline_max else [])
+        for name in names:
+            store = HNSWVectorStore.from_env() if name == "hnsw" else STORES[name]()
+            start = time.perf_counter()
+            for batch in iter_nodes(embeddings, private):
+                store.add(batch)
+            build_seconds = time.perf_counter() - start
+            with tempfile.TemporaryDirectory() as persist_dir:
+                # Measure the queries on the store loaded from disk, as the app uses it
+                persist_path = os.path.join(persist_dir, "default__vector_store.json")
+                store.persist(persist_path)
+                del store
+                start = time.perf_counter()
+                store = STORES[name].from_persist_path(persist_path)
+                load_seconds = time.perf_counter() - start
+                recall, p50, p99 = measure(store, queries, exact_ids, top_k, None)
+                filtered_recall, filtered_p50, filtered_p99 = measure(
+                    store, queries, exact_public_ids, top_k, filters
+                )
+                batch_ms = "-"
+                if isinstance(store, NumpyVectorStore):
+                    start = time.perf_counter()
+                    store.batch_query(queries.tolist(), top_k, filters)
+                    batch_ms = f"{(time.perf_counter() - start) / queries_count * 1000:.2f}"
+                del store
+            print(
+                f"{nodes:>8} {name:>7} {build_seconds:>8.1f} {load_seconds:>7.2f} {recall:>9.3f} {p50:>8.2f}"
+                f" {p99:>8.2f} {filtered_recall:>18.3f} {filtered_p50:>8.2f} {filtered_p99:>8.2f} {batch_ms:>15}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--baseline-max", type=int, default=100_000)
+    parser.add_argument("--private-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+    run(args.nodes, args.dimension, args.queries, args.top_k, args.baseline_max, args.private_ratio)
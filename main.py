@@ -6,11 +6,19 @@ load_dotenv()
 
 import logging
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from app.api.routers import api_router
+from app.engine.tools import start_tool_registry
 from app.middlewares.frontend import FrontendProxyMiddleware
 from app.observability import init_observability
+from app.services.hass.client import start_hass_client, stop_hass_client
+from app.services.hass.state import start_hass_state_mirror, stop_hass_state_mirror
+from app.services.influxdb.cache import stop_influxdb_query_cache
+from app.services.influxdb.client import start_influxdb_pool, stop_influxdb_pool
+from app.services.influxdb.history import stop_sensor_history_store
+from app.services.sandbox import start_sandbox_pool, stop_sandbox_pool
 from app.settings import init_settings
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
@@ -20,7 +28,26 @@ servers = []
 app_name = os.getenv("FLY_APP_NAME")
 if app_name:
     servers = [{"url": f"https://{app_name}.fly.dev"}]
-app = FastAPI(servers=servers)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the background services shared by all the requests
+    await start_hass_client()
+    await start_hass_state_mirror()
+    await start_influxdb_pool()
+    await start_sandbox_pool()
+    start_tool_registry()
+    yield
+    await stop_sandbox_pool()
+    await stop_influxdb_query_cache()
+    await stop_sensor_history_store()
+    await stop_influxdb_pool()
+    await stop_hass_state_mirror()
+    await stop_hass_client()
+
+
+app = FastAPI(servers=servers, lifespan=lifespan)
 
 init_settings()
 init_observability()
@@ -0,0 +1,111 @@
+import unittest
+from typing import List, Optional
+
+from llama_index.core.llms import MessageRole
+
+from app.api.routers.models import AgentAnnotation, Annotation, ChatData, Message
+from app.services.budget import TRIMMED_NOTICE, TokenBudget, allocate
+from app.services.hass.deltas import DELTA_HEADER, SNAPSHOT_HEADER
+
+
+def get_annotation(text: str) -> Annotation:
+    return Annotation(type="agent", data=AgentAnnotation(agent="hass", text=text))
+
+
+def get_message(role: MessageRole, content: str, context: Optional[List[str]] = None) -> Message:
+    return Message(
+        role=role,
+        content=content,
+        annotations=[get_annotation(text) for text in context] if context else None,
+    )
+
+
+class AllocateTest(unittest.TestCase):
+    def test_surplus_is_shared_by_the_rest(self):
+        allocation = allocate(
+            {"hass": 100, "history": 5000, "code": 0}, {"hass": 1, "history": 1, "code": 1}, 1000
+        )
+        self.assertEqual(allocation, {"hass": 100, "history": 900, "code": 0})
+
+    def test_by_weight_when_nothing_fits(self):
+        allocation = allocate({"hass": 5000, "history": 5000}, {"hass": 3, "history": 1}, 1000)
+        self.assertEqual(allocation, {"hass": 750, "history": 250})
+
+    def test_everything_fits(self):
+        allocation = allocate({"hass": 10, "history": 20}, {"hass": 1, "history": 1}, 1000)
+        self.assertEqual(allocation, {"hass": 10, "history": 20})
+
+
+class TokenBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.budget = TokenBudget(context_window=4000, reserved_tokens=0)
+
+    def test_trim_text_at_line_boundaries(self):
+        text = "\n".join(f"línea {i} con algunas palabras más" for i in range(100))
+        trimmed = self.budget._trim_text(text, 100)
+
+        self.assertLessEqual(self.budget.count_tokens(trimmed), 100)
+        kept = trimmed.split("\n")[:-1]
+        self.assertEqual(kept, text.split("\n")[: len(kept)])
+        self.assertEqual(trimmed.split("\n")[-1], TRIMMED_NOTICE.format(lines=100 - len(kept)))
+        # Short enough texts are kept as they are, and nothing is left if not even a line fits
+        self.assertEqual(self.budget._trim_text("una línea", 100), "una línea")
+        self.assertEqual(self.budget._trim_text(text, 5), "")
+
+    def test_oldest_history_is_dropped_first(self):
+        messages = []
+        for i in range(40):
+            messages.append(get_message(MessageRole.USER, f"pregunta {i} " + "palabra " * 50))
+            messages.append(get_message(MessageRole.ASSISTANT, f"respuesta {i} " + "palabra " * 50))
+        messages.append(get_message(MessageRole.USER, "¿y ahora?"))
+        budget = TokenBudget(context_window=1000, reserved_tokens=0)
+
+        last_message, history = budget.build_messages(ChatData(messages=messages), "Eres un asistente.")
+
+        self.assertEqual(last_message, "¿y ahora?")
+        self.assertGreater(len(history), 0)
+        self.assertLess(len(history), 80)
+        # The most recent messages, in order
+        self.assertEqual(
+            [message.content for message in history],
+            [message.content for message in messages[80 - len(history) : 80]],
+        )
+
+    def test_snapshot_chain_is_kept_when_previous_context_is_squeezed(self):
+        snapshot = f"{SNAPSHOT_HEADER}\nlight.salon|Luz|on"
+        delta = f"{DELTA_HEADER}\nlight.salon|Luz|off"
+        big_context = "Consumo de la semana " + "dato " * 2000
+        messages = [
+            get_message(MessageRole.USER, "hola", [f"{SNAPSHOT_HEADER}\nantiguo", big_context]),
+            get_message(MessageRole.ASSISTANT, "hola"),
+            get_message(MessageRole.USER, "¿luces?", [snapshot, big_context]),
+            get_message(MessageRole.ASSISTANT, "encendidas"),
+            get_message(MessageRole.USER, "¿y ahora?", [delta]),
+            get_message(MessageRole.ASSISTANT, "apagadas"),
+            get_message(MessageRole.USER, "¿algo más?"),
+        ]
+        budget = TokenBudget(context_window=600, reserved_tokens=0)
+
+        last_message, _ = budget.build_messages(ChatData(messages=messages))
+
+        # The latest snapshot and the changes after it, in order, but not the old snapshot
+        self.assertIn(snapshot, last_message)
+        self.assertLess(last_message.index(snapshot), last_message.index(delta))
+        self.assertNotIn("antiguo", last_message)
+        self.assertNotIn(big_context, last_message)
+
+    def test_window_smaller_than_the_question(self):
+        budget = TokenBudget(context_window=10, reserved_tokens=0)
+        messages = [
+            get_message(MessageRole.USER, "hola"),
+            get_message(MessageRole.ASSISTANT, "hola"),
+            get_message(MessageRole.USER, "una pregunta " * 20, ["Documento " * 20]),
+        ]
+        with self.assertLogs("uvicorn", "WARNING"):
+            last_message, history = budget.build_messages(ChatData(messages=messages), "Eres un asistente.")
+        self.assertEqual(last_message, messages[-1].content)
+        self.assertEqual(history, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import time
+import unittest
+from typing import Any, Dict
+
+from app.services.hass.deltas import (
+    DELTA_HEADER,
+    NO_CHANGES,
+    SNAPSHOT_HEADER,
+    HassEntityDeltaTracker,
+    get_snapshot_chain,
+)
+
+
+def get_entity(entity_id: str, state: str) -> Dict[str, Any]:
+    return {"entity_id": entity_id, "state": state, "attributes": {"friendly_name": entity_id}}
+
+
+class HassEntityDeltaTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = HassEntityDeltaTracker()
+        self.entities = [get_entity("light.salon", "on"), get_entity("sensor.temperatura", "21.5")]
+
+    def test_first_turn_is_a_snapshot(self):
+        text = self.tracker.render(self.entities, [])
+        self.assertTrue(text.startswith(SNAPSHOT_HEADER))
+        self.assertIn("light.salon", text)
+        self.assertIn("sensor.temperatura", text)
+
+    def test_later_turns_only_add_the_changes(self):
+        first = self.tracker.render(self.entities, [])
+        second = self.tracker.render(self.entities, [first])
+        self.assertEqual(second, NO_CHANGES)
+
+        changed = [get_entity("light.salon", "off"), self.entities[1]]
+        third = self.tracker.render(changed, [first, second])
+        self.assertTrue(third.startswith(DELTA_HEADER))
+        self.assertIn("light.salon", third)
+        self.assertNotIn("sensor.temperatura", third)
+        self.assertEqual(self.tracker.get_metrics()["full_snapshots"], 1)
+
+    def test_unknown_chain_is_a_snapshot(self):
+        first = self.tracker.render(self.entities, [])
+        # E.g. the client didn't send back the annotations as they were rendered
+        text = self.tracker.render(self.entities, [first + " editado"])
+        self.assertTrue(text.startswith(SNAPSHOT_HEADER))
+
+    def test_expired_chain_is_a_snapshot(self):
+        tracker = HassEntityDeltaTracker(ttl=0.05)
+        first = tracker.render(self.entities, [])
+        time.sleep(0.1)
+        self.assertTrue(tracker.render(self.entities, [first]).startswith(SNAPSHOT_HEADER))
+
+    def test_full_refresh(self):
+        first = self.tracker.render(self.entities, [])
+        text = self.tracker.render(self.entities, [first], full_refresh=True)
+        self.assertTrue(text.startswith(SNAPSHOT_HEADER))
+
+
+class GetSnapshotChainTest(unittest.TestCase):
+    def test_latest_snapshot_and_the_changes_after_it(self):
+        texts = [
+            f"{SNAPSHOT_HEADER}\nold",
+            f"{DELTA_HEADER}\nold change",
+            "Documento: factura.pdf",
+            f"{SNAPSHOT_HEADER}\nnew",
+            NO_CHANGES,
+            "Consumo de la semana",
+            f"{DELTA_HEADER}\nnew change",
+        ]
+        self.assertEqual(get_snapshot_chain(texts), [3, 4, 6])
+
+    def test_without_snapshot(self):
+        self.assertEqual(get_snapshot_chain([f"{DELTA_HEADER}\nchange", "Documento"]), [])
+        self.assertEqual(get_snapshot_chain([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.services.hass.descriptions import HassEntityDescriptions
+
+
+class HassEntityDescriptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "hass-entities.json")
+        self.descriptions = HassEntityDescriptions(self.file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, content: str, mtime_ns: int):
+        with open(self.file_path, "w") as f:
+            f.write(content)
+        os.utime(self.file_path, ns=(mtime_ns, mtime_ns))
+
+    def test_invalid_file_keeps_the_last_loaded_version(self):
+        entities = [{"entity_id": "light.salon", "entity_metadata": {"area": "Salón"}}]
+        self.write(json.dumps(entities), 1_000_000_000)
+        self.descriptions.refresh()
+        content_hash = self.descriptions.content_hash
+
+        # A half-written file
+        self.write(json.dumps(entities)[:20], 2_000_000_000)
+        self.descriptions.refresh()
+        self.assertEqual(self.descriptions.get_entity_ids(), ["light.salon"])
+        self.assertEqual(self.descriptions.content_hash, content_hash)
+
+        # Loaded once it's complete
+        entities.append({"entity_id": "light.cocina", "entity_metadata": {"area": "Cocina"}})
+        self.write(json.dumps(entities), 3_000_000_000)
+        self.descriptions.refresh()
+        self.assertEqual(self.descriptions.get_entity_ids_by_area("salon"), ["light.salon"])
+        self.assertEqual(self.descriptions.get_entity_ids_by_area("cocina"), ["light.cocina"])
+        self.assertNotEqual(self.descriptions.content_hash, content_hash)
+
+    def test_invalid_file_on_first_load_raises(self):
+        self.write("[{", 1_000_000_000)
+        with self.assertRaises(ValueError):
+            self.descriptions.refresh()
+
+
+if __name__ == "__main__":
+    unittest.main()
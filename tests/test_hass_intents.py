@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, Dict, List
+from unittest import mock
+
+from app.services.hass.descriptions import HassEntityDescriptions
+from app.services.hass.intents import HassIntentRouter
+from app.services.hass.resolver import HassEntityResolver
+
+ENTITIES = [
+    {"entity_id": "light.salon", "entity_metadata": {"area": "Salón", "name": "Lámpara del salón"}},
+    {"entity_id": "light.dormitorio", "entity_metadata": {"area": "Dormitorio", "name": "Luz del dormitorio"}},
+    {"entity_id": "light.dormitorio_invitados", "entity_metadata": {"area": "Dormitorio invitados"}},
+    {"entity_id": "cover.persiana_salon", "entity_metadata": {"area": "Salón", "name": "Persiana"}},
+    {"entity_id": "climate.termostato", "entity_metadata": {"area": "Pasillo", "name": "Termostato"}},
+]
+
+
+def create_resolver(tmp_dir: str, entities: List[Dict[str, Any]]) -> HassEntityResolver:
+    file_path = os.path.join(tmp_dir, "hass-entities.json")
+    with open(file_path, "w") as f:
+        json.dump(entities, f)
+    descriptions = HassEntityDescriptions(file_path)
+    descriptions.refresh()
+    resolver = HassEntityResolver()
+    resolver.update(None, descriptions)
+    return resolver
+
+
+class HassIntentRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        resolver = create_resolver(self.tmp_dir, ENTITIES)
+        patcher = mock.patch("app.services.hass.intents.get_hass_entity_resolver", return_value=resolver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = HassIntentRouter()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def assertIntent(self, message: str, service: str, entity_ids: List[str], **data: Any):
+        intent = self.router.parse(message)
+        self.assertIsNotNone(intent, message)
+        self.assertEqual(intent.service, service)
+        self.assertEqual(intent.entity_ids, entity_ids)
+        self.assertEqual(intent.data, {"entity_id": entity_ids, **data})
+
+    def test_commands(self):
+        self.assertIntent("Apaga la luz del salón", "turn_off", ["light.salon"])
+        self.assertIntent(
+            "enciende la luz del dormitorio de invitados, por favor", "turn_on", ["light.dormitorio_invitados"]
+        )
+        self.assertIntent("Sube la persiana", "open_cover", ["cover.persiana_salon"])
+        self.assertIntent("cierra la persiana del salon", "close_cover", ["cover.persiana_salon"])
+        self.assertIntent("pon la persiana al 40%", "set_cover_position", ["cover.persiana_salon"], position=40)
+        self.assertIntent("Pon la temperatura a 21,5 grados", "set_temperature", ["climate.termostato"], temperature=21.5)
+
+    def test_whole_area(self):
+        # Only the area named exactly, not "Dormitorio invitados"
+        self.assertIntent("apaga todas las luces del dormitorio", "turn_off", ["light.dormitorio"])
+        self.assertIsNone(self.router.parse("apaga todas las luces"))
+
+    def test_commands_left_to_the_agent(self):
+        for message in [
+            # Questions and multiple commands
+            "¿está encendida la luz del salón?",
+            "apaga la luz del salon y sube la persiana",
+            # Ambiguous: several lights match
+            "enciende la luz",
+            "enciende la luz del dormitorio",
+            # No entity named: the verb alone doesn't say which device
+            "sube la temperatura",
+            "baja la temperatura",
+            "sube la posicion",
+            # Services the entity doesn't support
+            "pon la luz del salon al 50%",
+            "abre la luz del salon",
+            # Unknown entities
+            "enciende la tostadora",
+        ]:
+            with self.subTest(message=message):
+                self.assertIsNone(self.router.parse(message))
+
+    def test_cover_position_out_of_range(self):
+        self.assertIsNone(self.router.parse("pon la persiana al 150%"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.hass.descriptions import HassEntityDescriptions
+from app.services.hass.resolver import HassEntityResolver
+
+ENTITIES = [
+    {"entity_id": "light.salon", "entity_metadata": {"area": "Salón", "name": "Lámpara de pie"}},
+    {"entity_id": "light.salon_techo", "entity_metadata": {"area": "Salón", "name": "Luz del techo"}},
+    {"entity_id": "cover.persiana_salon", "entity_metadata": {"area": "Salón", "name": "Persiana"}},
+    {"entity_id": "cover.persiana_dormitorio", "entity_metadata": {"area": "Dormitorio", "name": "Persiana"}},
+    {"entity_id": "sensor.temperatura_cocina", "entity_metadata": {"area": "Cocina", "name": "Temperatura"}},
+]
+
+
+class FakeStateMirror:
+    def __init__(self, states: List[Dict[str, Any]]):
+        self.states = {state["entity_id"]: state for state in states}
+        self.version = 1
+        self.changed: List[str] = []
+        self.removed: List[str] = []
+
+    def get_state(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        return self.states.get(entity_id)
+
+    def get_changes_since(self, version: int) -> Tuple[List[str], List[str]]:
+        return self.changed, self.removed
+
+
+class HassEntityResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        file_path = os.path.join(self.tmp_dir, "hass-entities.json")
+        with open(file_path, "w") as f:
+            json.dump(ENTITIES, f)
+        self.descriptions = HassEntityDescriptions(file_path)
+        self.descriptions.refresh()
+        self.mirror = FakeStateMirror(
+            [
+                {"entity_id": "light.salon", "state": "on", "attributes": {"friendly_name": "Lámpara"}},
+                # Not described: not exposed by the resolver
+                {"entity_id": "light.garaje", "state": "off", "attributes": {"friendly_name": "Garaje"}},
+            ]
+        )
+        self.resolver = HassEntityResolver()
+        self.resolver.update(self.mirror, self.descriptions)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_ids(self, **kwargs) -> List[str]:
+        return [match["entity_id"] for match in self.resolver.find(**kwargs)]
+
+    def test_accent_and_case_insensitive(self):
+        self.assertEqual(self.get_ids(text="LAMPARA de PIE"), ["light.salon"])
+        self.assertEqual(self.get_ids(text="lámpara de pie"), ["light.salon"])
+        self.assertEqual(self.get_ids(area="SALON", domain="cover"), ["cover.persiana_salon"])
+
+    def test_domain_and_area_filters(self):
+        self.assertEqual(
+            self.get_ids(text="persiana", domain="persianas", area="dormitorio"), ["cover.persiana_dormitorio"]
+        )
+        self.assertEqual(self.get_ids(area="salón", domain="luces"), ["light.salon", "light.salon_techo"])
+        self.assertEqual(self.get_ids(text="temperatura", domain="light"), [])
+
+    def test_limit_and_ambiguous_matches(self):
+        # Both covers match the name equally: the caller sees the tie and can ask
+        matches = self.resolver.find(text="persiana", limit=2)
+        self.assertEqual(
+            matches,
+            [
+                {"entity_id": "cover.persiana_dormitorio", "score": 1.0},
+                {"entity_id": "cover.persiana_salon", "score": 1.0},
+            ],
+        )
+        self.assertEqual(len(self.resolver.find(area="salon", limit=1)), 1)
+        # A more specific text breaks the tie
+        matches = self.resolver.find(text="persiana dormitorio", limit=2, min_score=0.3)
+        self.assertEqual(matches[0], {"entity_id": "cover.persiana_dormitorio", "score": 1.0})
+        self.assertEqual(matches[1]["entity_id"], "cover.persiana_salon")
+        self.assertLess(matches[1]["score"], 0.5)
+        self.assertEqual(self.get_ids(text="persiana dormitorio"), ["cover.persiana_dormitorio"])
+
+    def test_exact_area(self):
+        self.assertEqual(
+            self.resolver.get_area_entities("el salón", "luz"), {"light.salon", "light.salon_techo"}
+        )
+        self.assertIsNone(self.resolver.get_area_entities("salo"))
+
+    def test_only_described_entities(self):
+        self.assertEqual(len(self.resolver), len(ENTITIES))
+        self.assertEqual(self.get_ids(text="garaje"), [])
+
+        self.mirror.changed = ["light.garaje", "light.salon"]
+        self.mirror.states["light.salon"]["attributes"]["friendly_name"] = "Flexo"
+        self.mirror.version = 2
+        self.resolver.update(self.mirror, self.descriptions)
+        self.assertEqual(self.get_ids(text="garaje"), [])
+        self.assertEqual(self.get_ids(text="flexo"), ["light.salon"])
+
+
+if __name__ == "__main__":
+    unittest.main()
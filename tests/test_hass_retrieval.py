@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, Dict, List
+
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.settings import Settings
+
+from app.services.hass.retrieval import EMBEDDINGS_CACHE_FILE, HassEntityRetriever
+
+
+def get_entity(entity_id: str, description: str) -> Dict[str, Any]:
+    return {
+        "entity_id": entity_id,
+        "state": "on",
+        "attributes": {"friendly_name": entity_id.split(".", 1)[-1]},
+        "entity_metadata": {"description": description},
+    }
+
+
+class HassEntityRetrieverTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.embed_model = Settings._embed_model
+        Settings.embed_model = MockEmbedding(embed_dim=8)
+
+    def tearDown(self):
+        Settings._embed_model = self.embed_model
+        shutil.rmtree(self.tmp_dir)
+
+    def get_cached_keys(self) -> List[str]:
+        with open(os.path.join(self.tmp_dir, EMBEDDINGS_CACHE_FILE)) as f:
+            return sorted(json.load(f))
+
+    async def test_named_entities_are_selected(self):
+        retriever = HassEntityRetriever(top_k=1)
+        entities = [get_entity(f"light.luz_{i}", f"Luz {i}") for i in range(5)]
+        selected = await retriever.aselect("¿Está encendida la luz 3 o light.luz_4?", entities)
+        self.assertIn(entities[3], selected)
+        self.assertIn(entities[4], selected)
+
+    async def test_cache_only_keeps_the_current_entities(self):
+        retriever = HassEntityRetriever(top_k=1, cache_dir=self.tmp_dir)
+        entities = [get_entity(f"light.luz_{i}", f"Luz {i}") for i in range(3)]
+        await retriever.aselect("luces", entities)
+        self.assertEqual(len(self.get_cached_keys()), 3)
+
+        # One entity removed and another one described differently
+        changed = [entities[0], get_entity("light.luz_1", "Lámpara del salón")]
+        await retriever.aselect("luces", changed)
+        expected = sorted(retriever._get_cache_key(retriever.get_entity_text(entity)) for entity in changed)
+        self.assertEqual(self.get_cached_keys(), expected)
+
+        # A new retriever starts from the saved embeddings
+        reloaded = HassEntityRetriever(top_k=1, cache_dir=self.tmp_dir)
+        self.assertEqual(reloaded.get_metrics()["cached_embeddings"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import unittest
+from typing import Any, Dict, List
+
+from websockets.asyncio.server import serve
+
+from app.services.hass.state import HassStateMirror
+
+
+def get_state(entity_id: str, state: str) -> Dict[str, Any]:
+    return {"entity_id": entity_id, "state": state, "attributes": {}}
+
+
+class FakeHassClient:
+    """
+    REST client returning fixed states, used while the WebSocket is down
+    """
+
+    token = "token"
+
+    def __init__(self, states: List[Dict[str, Any]]):
+        self.states = states
+        self.polls = 0
+
+    async def get_states(self) -> List[Dict[str, Any]]:
+        self.polls += 1
+        return self.states
+
+
+class FakeHassWebSocket:
+    """
+    Home Assistant WebSocket API with the states of each connection. The first connection
+    sends a state change and is closed by the server.
+    """
+
+    def __init__(self, states_by_connection: List[List[Dict[str, Any]]]):
+        self.states_by_connection = states_by_connection
+        self.connections = 0
+        self.tokens: List[str] = []
+        self.closed = asyncio.Event()
+
+    async def handle(self, ws):
+        connection = self.connections
+        self.connections += 1
+        await ws.send(json.dumps({"type": "auth_required"}))
+        self.tokens.append(json.loads(await ws.recv())["access_token"])
+        await ws.send(json.dumps({"type": "auth_ok"}))
+        for _ in range(2):
+            request = json.loads(await ws.recv())
+            result = (
+                self.states_by_connection[connection] if request["type"] == "get_states" else None
+            )
+            await ws.send(
+                json.dumps({"id": request["id"], "type": "result", "success": True, "result": result})
+            )
+        if connection == 0:
+            await ws.send(
+                json.dumps(
+                    {
+                        "type": "event",
+                        "event": {
+                            "event_type": "state_changed",
+                            "data": {
+                                "entity_id": "light.salon",
+                                "new_state": get_state("light.salon", "off"),
+                            },
+                        },
+                    }
+                )
+            )
+            self.closed.set()
+            return
+        await ws.wait_closed()
+
+
+class HassStateMirrorTest(unittest.IsolatedAsyncioTestCase):
+    async def wait_for(self, condition, timeout: float = 5.0):
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+    async def test_reconnect_and_resync(self):
+        fake = FakeHassWebSocket(
+            [
+                [get_state("light.salon", "on"), get_state("switch.cocina", "on")],
+                # While disconnected, switch.cocina was removed and sensor.terraza added
+                [get_state("light.salon", "on"), get_state("sensor.terraza", "21")],
+            ]
+        )
+        client = FakeHassClient([get_state("light.salon", "off"), get_state("switch.cocina", "on")])
+        async with serve(fake.handle, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            mirror = HassStateMirror(
+                client, f"ws://127.0.0.1:{port}", poll_interval=0.01, reconnect_delay=0.05
+            )
+            mirror.start()
+            try:
+                self.assertTrue(await mirror.wait_until_ready(timeout=5))
+                await fake.closed.wait()
+                await self.wait_for(lambda: mirror.get_state("light.salon")["state"] == "off")
+                version = mirror.version
+
+                # The mirror polls the REST API while disconnected and resyncs on reconnection
+                await self.wait_for(lambda: fake.connections == 2 and mirror.is_connected)
+                await self.wait_for(lambda: mirror.get_state("sensor.terraza") is not None)
+            finally:
+                await mirror.stop()
+
+        self.assertGreater(client.polls, 0)
+        self.assertEqual(fake.tokens, ["token", "token"])
+        self.assertEqual(mirror.get_state("light.salon")["state"], "on")
+        self.assertIsNone(mirror.get_state("switch.cocina"))
+        changed, removed = mirror.get_changes_since(version)
+        self.assertEqual(sorted(changed), ["light.salon", "sensor.terraza"])
+        self.assertEqual(removed, ["switch.cocina"])
+
+
+if __name__ == "__main__":
+    unittest.main()
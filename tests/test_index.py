@@ -0,0 +1,66 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from typing import List
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.engine.index import ReadWriteLock, SharedIndex, _ReadLockedRetriever
+
+
+class StaticRetriever(BaseRetriever):
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return [NodeWithScore(node=TextNode(text=query_bundle.query_str), score=1.0)]
+
+
+class SharedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir)
+
+    def test_signature_ignores_temporary_files(self):
+        with open(os.path.join(self.storage_dir, "docstore.json"), "w") as f:
+            f.write("{}")
+        shared_index = SharedIndex(self.storage_dir)
+        signature = shared_index._get_signature()
+
+        # A vector store persisting in the meantime doesn't trigger a reload
+        with open(os.path.join(self.storage_dir, "nodes.json.tmp"), "w") as f:
+            f.write("{")
+        self.assertEqual(shared_index._get_signature(), signature)
+
+
+class ReadLockedRetrieverTest(unittest.IsolatedAsyncioTestCase):
+    async def test_async_retrieval_waits_for_the_writer_off_the_event_loop(self):
+        lock = ReadWriteLock()
+        retriever = _ReadLockedRetriever(StaticRetriever(), lock)
+        release_writer = threading.Event()
+        writer_holds_lock = threading.Event()
+
+        def write():
+            with lock.write():
+                writer_holds_lock.set()
+                release_writer.wait(5)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer_holds_lock.wait(5)
+        retrieval = asyncio.create_task(retriever.aretrieve("salon"))
+        # The event loop keeps running while the retrieval waits for the lock
+        await asyncio.sleep(0.05)
+        self.assertFalse(retrieval.done())
+        release_writer.set()
+
+        nodes = await asyncio.wait_for(retrieval, 5)
+        writer.join()
+        self.assertEqual(nodes[0].node.get_content(), "salon")
+
+
+if __name__ == "__main__":
+    unittest.main()
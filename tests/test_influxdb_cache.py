@@ -0,0 +1,50 @@
+import asyncio
+import gc
+import unittest
+from typing import Any, Dict, List
+
+from app.services.influxdb.cache import InfluxDBQueryCache
+
+
+class InfluxDBQueryCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_rendering_is_part_of_the_key(self):
+        cache = InfluxDBQueryCache(ttl=60)
+        calls: List[str] = []
+
+        def fetch(text: str):
+            async def run() -> str:
+                calls.append(text)
+                return text
+
+            return run
+
+        self.assertEqual(await cache.get("casa", "ha", "q", fetch("summary")), "summary")
+        self.assertEqual(await cache.get("casa", "ha", "q", fetch("rows"), summary=False), "rows")
+        self.assertEqual(
+            await cache.get("casa", "ha", "q", fetch("sparkline"), sparkline_points=12), "sparkline"
+        )
+        # Served from the cache
+        self.assertEqual(await cache.get("casa", "ha", "q", fetch("other"), summary=False), "rows")
+        self.assertEqual(calls, ["summary", "rows", "sparkline"])
+
+    async def test_failed_fetch_after_the_waiters_timed_out(self):
+        cache = InfluxDBQueryCache(ttl=60)
+        errors: List[Dict[str, Any]] = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            raise ConnectionError("InfluxDB is down")
+
+        with self.assertRaises(TimeoutError):
+            await asyncio.wait_for(cache.get("casa", "ha", "q", fetch), 0.01)
+        await asyncio.sleep(0.1)
+        gc.collect()
+
+        self.assertEqual(errors, [])
+        # The failure isn't cached
+        self.assertEqual(cache.get_metrics()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
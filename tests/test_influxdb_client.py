@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+from app.services.influxdb.client import InfluxDBClientPool
+
+ANNOTATED_CSV = (
+    "#datatype,string,long,dateTime:RFC3339,double,string,string\n"
+    "#group,false,false,false,false,true,true\n"
+    "#default,_result,,,,,\n"
+    ",result,table,_time,_value,_field,entity_id\n"
+    ",,0,2024-12-01T00:00:00Z,20.5,value,temperatura_salon\n"
+    ",,0,2024-12-01T00:10:00Z,21,value,temperatura_salon\n"
+    ",,1,2024-12-01T00:00:00Z,18.25,value,temperatura_terraza\n"
+    "\n"
+)
+
+
+class InfluxDBClientPoolTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Flux queries of the pooled async clients against a stub of the query API returning annotated CSV
+    """
+
+    async def asyncSetUp(self):
+        self.requests: List[Dict[str, Any]] = []
+        self.delay = 0.0
+        self.status = 200
+
+        async def query(request: web.Request) -> web.Response:
+            self.requests.append(
+                {
+                    "org": request.query.get("org"),
+                    "authorization": request.headers.get("Authorization"),
+                    "body": await request.json(),
+                }
+            )
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.status != 200:
+                return web.json_response({"code": "invalid", "message": "bad query"}, status=self.status)
+            return web.Response(text=ANNOTATED_CSV, content_type="text/csv")
+
+        app = web.Application()
+        app.router.add_post("/api/v2/query", query)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.pool = InfluxDBClientPool(f"http://127.0.0.1:{port}", "token", query_timeout=5)
+
+    async def asyncTearDown(self):
+        await self.pool.aclose()
+        await self.runner.cleanup()
+
+    async def test_query_stream(self):
+        records: List[Dict[str, Any]] = []
+        count = await self.pool.query_stream("casa", 'from(bucket: "ha")', records.append)
+
+        self.assertEqual(count, 3)
+        self.assertEqual([record["_value"] for record in records], [20.5, 21.0, 18.25])
+        self.assertEqual(records[2]["entity_id"], "temperatura_terraza")
+        self.assertEqual(self.requests[0]["org"], "casa")
+        self.assertEqual(self.requests[0]["authorization"], "Token token")
+        self.assertEqual(self.requests[0]["body"]["query"], 'from(bucket: "ha")')
+
+    async def test_clients_and_connections_are_reused(self):
+        for _ in range(3):
+            await self.pool.query_stream("casa", 'from(bucket: "ha")', lambda values: None)
+        await self.pool.query_stream("oficina", 'from(bucket: "ha")', lambda values: None)
+
+        self.assertIs(self.pool.get_client("casa"), self.pool.get_client("casa"))
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics["casa"]["queries"], 3)
+        self.assertEqual(metrics["casa"]["new_connections"], 1)
+        self.assertEqual(metrics["casa"]["reused_connections"], 2)
+        self.assertEqual(metrics["oficina"]["queries"], 1)
+
+    async def test_query_timeout(self):
+        self.delay = 1.0
+        with self.assertRaises(TimeoutError):
+            await self.pool.query_stream("casa", 'from(bucket: "ha")', lambda values: None, timeout=0.1)
+        self.assertEqual(self.pool.get_metrics()["casa"]["timeouts"], 1)
+
+    async def test_query_error(self):
+        self.status = 400
+        with self.assertRaises(Exception):
+            await self.pool.query_stream("casa", 'from(bucket: "ha")', lambda values: None)
+        metrics = self.pool.get_metrics()["casa"]
+        self.assertEqual(metrics["errors"], 1)
+        self.assertEqual(metrics["queries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from app.services.influxdb.history import SensorHistoryStore
+
+START = datetime(2024, 12, 1, tzinfo=timezone.utc)
+
+
+class FakeInfluxDBPool:
+    """
+    Query API returning a point per hour of the queried range, optionally failing after some queries
+    """
+
+    def __init__(self, fail_after: Optional[int] = None):
+        self.fail_after = fail_after
+        self.ranges: List[Tuple[datetime, datetime]] = []
+
+    async def query_stream(self, org: str, query: str, callback: Callable[[Dict[str, Any]], None]) -> int:
+        if self.fail_after is not None and len(self.ranges) >= self.fail_after:
+            raise TimeoutError("Query timed out")
+        start, stop = (
+            datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+            for value in re.search(r"range\(start: (\S+), stop: (\S+)\)", query).groups()
+        )
+        self.ranges.append((start, stop))
+        count = 0
+        record_time = start
+        while record_time < stop:
+            callback({"_time": record_time, "_value": 20.0 + record_time.hour, "entity_id": "temperatura_salon"})
+            record_time += timedelta(hours=1)
+            count += 1
+        return count
+
+
+class SensorHistoryStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = SensorHistoryStore(f"{self.tmp_dir}/history.sqlite3", lag=0, chunk=86400)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    async def query(self, pool: FakeInfluxDBPool, start: datetime, stop: datetime) -> str:
+        with mock.patch("app.services.influxdb.history.get_influxdb_pool", return_value=pool):
+            return await self.store.query(
+                "casa", "ha", "°C", "value", "temperatura_salon", start, stop, 86400, "count", json.dumps
+            )
+
+    async def test_long_range_is_synced_in_chunks(self):
+        pool = FakeInfluxDBPool()
+        text = await self.query(pool, START, START + timedelta(days=3))
+
+        self.assertEqual(
+            pool.ranges,
+            [(START + timedelta(days=day), START + timedelta(days=day + 1)) for day in range(3)],
+        )
+        self.assertIn("temperatura_salon", text)
+        self.assertEqual(self.store.get_metrics()["points_fetched"], 72)
+
+        # Already synced: served from the local copy
+        await self.query(pool, START, START + timedelta(days=3))
+        self.assertEqual(len(pool.ranges), 3)
+
+    async def test_timeout_keeps_the_synced_chunks(self):
+        with self.assertRaises(TimeoutError):
+            await self.query(FakeInfluxDBPool(fail_after=2), START, START + timedelta(days=3))
+
+        # The next query only fetches the chunk that timed out
+        pool = FakeInfluxDBPool()
+        await self.query(pool, START, START + timedelta(days=3))
+        self.assertEqual(pool.ranges, [(START + timedelta(days=2), START + timedelta(days=3))])
+
+    async def test_earlier_range_is_synced_backwards(self):
+        await self.query(FakeInfluxDBPool(), START, START + timedelta(days=1))
+
+        # A timeout while extending the start keeps the synced interval contiguous
+        with self.assertRaises(TimeoutError):
+            await self.query(FakeInfluxDBPool(fail_after=1), START - timedelta(days=3), START + timedelta(days=1))
+        pool = FakeInfluxDBPool()
+        await self.query(pool, START - timedelta(days=3), START + timedelta(days=1))
+        self.assertEqual(
+            pool.ranges,
+            [
+                (START - timedelta(days=2), START - timedelta(days=1)),
+                (START - timedelta(days=3), START - timedelta(days=2)),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import ast
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import unittest
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.services.sandbox import (
+    CHUNK_SIZE,
+    Sandbox,
+    SandboxClient,
+    SandboxPool,
+    SandboxSession,
+    get_conversation_id,
+)
+
+
+@dataclass
+class LocalLogs:
+    stdout: List[str] = field(default_factory=list)
+    stderr: List[str] = field(default_factory=list)
+
+
+class LocalResult:
+    def __init__(self, value: Any):
+        self.text = repr(value)
+
+    def formats(self) -> List[str]:
+        return ["text"]
+
+    def __getitem__(self, key: str) -> str:
+        return getattr(self, key)
+
+
+@dataclass
+class LocalExecution:
+    results: List[LocalResult] = field(default_factory=list)
+    logs: LocalLogs = field(default_factory=LocalLogs)
+    error: Optional[str] = None
+
+
+class LocalSandbox(Sandbox):
+    """
+    Fake sandbox running the code in this process, with the files in a temporary directory
+    """
+
+    def __init__(self, root: str):
+        super().__init__(str(uuid.uuid4()))
+        self.root = os.path.join(root, self.id)
+        os.makedirs(self.root, exist_ok=True)
+        self.writes = 0
+        self.resets = 0
+        self.killed = False
+        self._namespace: Dict[str, Any] = {}
+
+    def run_code(self, code: str) -> LocalExecution:
+        if self.killed:
+            raise RuntimeError(f"Sandbox {self.id} was killed")
+        stdout, stderr = io.StringIO(), io.StringIO()
+        execution = LocalExecution()
+        try:
+            tree = ast.parse(code)
+            # As in a notebook cell, the value of the last expression is the result
+            last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                exec(compile(tree, "<cell>", "exec"), self._namespace)
+                if last is not None:
+                    value = eval(compile(ast.Expression(last.value), "<cell>", "eval"), self._namespace)
+                    if value is not None:
+                        execution.results.append(LocalResult(value))
+        except Exception as e:
+            execution.error = "".join(traceback.format_exception_only(e)).strip()
+        execution.logs = LocalLogs(stdout=stdout.getvalue().splitlines(True), stderr=stderr.getvalue().splitlines(True))
+        return execution
+
+    def get_local_path(self, path: str) -> str:
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def write_file(self, path: str, file: BinaryIO):
+        local_path = self.get_local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as f:
+            shutil.copyfileobj(file, f, CHUNK_SIZE)
+        self.writes += 1
+
+    def remove_file(self, path: str):
+        os.remove(self.get_local_path(path))
+
+    def reset(self):
+        self._namespace = {}
+        self.resets += 1
+
+    def kill(self):
+        self.killed = True
+
+
+class LocalSandboxClient(SandboxClient):
+    def __init__(self, root: str):
+        self.root = root
+        self.created: List[LocalSandbox] = []
+
+    def create(self) -> Sandbox:
+        sandbox = LocalSandbox(self.root)
+        self.created.append(sandbox)
+        return sandbox
+
+
+class SandboxPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.client = LocalSandboxClient(os.path.join(self.tmp_dir, "sandboxes"))
+        self.pool = SandboxPool(self.client, size=0, ttl=60)
+        self.file_path = os.path.join(self.tmp_dir, "data.csv")
+        with open(self.file_path, "w") as f:
+            f.write("a,b\n1,2\n")
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_release_without_conversation_cleans_the_sandbox(self):
+        sandbox = self.pool.acquire()
+        self.pool.sync_files(sandbox, [("/tmp/data.csv", self.file_path)])
+        sandbox.run_code("x = 1")
+        self.pool.release(sandbox)
+
+        self.assertEqual(sandbox.manifest, {})
+        self.assertFalse(os.path.exists(sandbox.get_local_path("/tmp/data.csv")))
+        self.assertEqual(sandbox.resets, 1)
+        # The next request gets the clean sandbox without its files and variables
+        reused = self.pool.acquire()
+        self.assertIs(reused, sandbox)
+        self.assertIsNotNone(reused.run_code("x").error)
+        self.assertEqual(len(self.client.created), 1)
+
+    def test_conversation_keeps_its_sandbox(self):
+        sandbox = self.pool.acquire("first")
+        self.pool.sync_files(sandbox, [("/tmp/data.csv", self.file_path)])
+        sandbox.run_code("x = 41")
+        self.pool.release(sandbox, "second")
+
+        # Another conversation doesn't get it
+        other = self.pool.acquire("other")
+        self.assertIsNot(other, sandbox)
+        # The next message of the conversation gets its kernel state and files back
+        kept = self.pool.acquire("second")
+        self.assertIs(kept, sandbox)
+        self.assertEqual(kept.run_code("x + 1").results[0].text, "42")
+        self.assertEqual(self.pool.sync_files(kept, [("/tmp/data.csv", self.file_path)]), 0)
+        self.assertEqual(sandbox.resets, 0)
+
+    def test_reset_failure_discards_the_sandbox(self):
+        sandbox = self.pool.acquire()
+
+        def fail():
+            raise RuntimeError("kernel unavailable")
+
+        sandbox.reset = fail
+        self.assertFalse(self.pool.reset(sandbox))
+        self.assertTrue(sandbox.killed)
+        self.assertEqual(self.pool.get_metrics()["discarded"], 1)
+
+    def test_expired_conversations_are_killed(self):
+        self.pool.ttl = 0.01
+        sandbox = self.pool.acquire()
+        self.pool.release(sandbox, "conversation")
+        time.sleep(0.02)
+
+        self.assertIsNot(self.pool.acquire("conversation"), sandbox)
+        self.assertTrue(sandbox.killed)
+
+    def test_warm_sandboxes(self):
+        pool = SandboxPool(self.client, size=2, ttl=60)
+        pool._fill()
+        try:
+            self.assertEqual(pool.get_metrics()["idle"], 2)
+            # Don't refill in the background
+            pool.size = 0
+            pool.acquire()
+            self.assertEqual(pool.get_metrics()["cold_starts"], 0)
+        finally:
+            pool.close()
+
+    def test_session_releases_off_the_event_loop(self):
+        session = SandboxSession(get_conversation_id("chat", [("user", "hola")]), pool=self.pool)
+        sandbox = session.acquire()
+        self.assertIs(session.acquire(), sandbox)
+
+        asyncio.run(session.aclose(get_conversation_id("chat", [("user", "hola"), ("assistant", "¡Hola!")])))
+        self.assertIsNone(session.sandbox)
+        next_session = SandboxSession(
+            get_conversation_id("chat", [("user", "hola"), ("assistant", "¡Hola!")]), pool=self.pool
+        )
+        self.assertIs(next_session.acquire(), sandbox)
+
+    def test_identical_conversations_of_other_chats_dont_share_the_sandbox(self):
+        messages = [("user", "carga data.csv"), ("assistant", "Hecho")]
+        sandbox = self.pool.acquire(get_conversation_id("chat-a", messages[:1]))
+        sandbox.run_code("secret = 42")
+        self.pool.release(sandbox, get_conversation_id("chat-a", messages))
+
+        # Another browser sending the same history gets a different sandbox
+        other = self.pool.acquire(get_conversation_id("chat-b", messages))
+        self.assertIsNot(other, sandbox)
+        self.assertIsNotNone(other.run_code("secret").error)
+        self.assertIs(self.pool.acquire(get_conversation_id("chat-a", messages)), sandbox)
+
+
+if __name__ == "__main__":
+    unittest.main()
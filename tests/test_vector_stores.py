@@ -0,0 +1,150 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+from typing import List, Optional, Set
+from unittest import mock
+
+import numpy as np
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import MetadataFilters, VectorStoreQuery
+
+from app.engine.query_filter import generate_filters
+from app.engine.vector_stores.base import LabeledVectorStore
+from app.engine.vector_stores.exact import NumpyVectorStore
+
+NODES = 300
+DIMENSION = 16
+TOP_K = 5
+
+
+def create_nodes() -> List[TextNode]:
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((NODES, DIMENSION)).astype(np.float32)
+    return [
+        TextNode(
+            id_=f"node-{i}",
+            text=f"Fragmento {i}",
+            embedding=embeddings[i].tolist(),
+            # Every tenth chunk is from a private document, with its own id
+            metadata={"private": "true" if i % 10 == 0 else "false", "doc_id": f"doc-{i // 3}"},
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"doc-{i // 3}")},
+        )
+        for i in range(NODES)
+    ]
+
+
+class VectorStoreTests:
+    """
+    Filter semantics shared by the labeled vector stores, checked against an exact search
+    """
+
+    def create_store(self) -> LabeledVectorStore:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.nodes = create_nodes()
+        self.embeddings = np.array([node.embedding for node in self.nodes], dtype=np.float32)
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        self.store = self.create_store()
+        self.store.add(self.nodes)
+        self.query_embedding = self.embeddings[42] + 0.1
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def query(self, store: LabeledVectorStore, filters: Optional[MetadataFilters] = None, top_k: int = TOP_K):
+        return store.query(
+            VectorStoreQuery(query_embedding=self.query_embedding.tolist(), similarity_top_k=top_k, filters=filters)
+        )
+
+    def get_exact_ids(self, allowed: Set[int], top_k: int = TOP_K) -> List[str]:
+        query = self.query_embedding / np.linalg.norm(self.query_embedding)
+        similarities = self.embeddings @ query
+        ranked = [i for i in np.argsort(-similarities) if i in allowed]
+        return [f"node-{i}" for i in ranked[:top_k]]
+
+    def test_public_documents_filter(self):
+        public = {i for i in range(NODES) if i % 10 != 0}
+        result = self.query(self.store, generate_filters([]))
+        self.assertEqual(result.ids, self.get_exact_ids(public))
+
+    def test_public_and_selected_documents_filter(self):
+        # The private chunks of doc-10 (node-30) are only returned when the document is selected
+        allowed = {i for i in range(NODES) if i % 10 != 0} | {30}
+        self.query_embedding = self.embeddings[30]
+        result = self.query(self.store, generate_filters(["doc-10"]))
+        self.assertEqual(result.ids, self.get_exact_ids(allowed))
+        self.assertEqual(result.ids[0], "node-30")
+        self.assertNotIn("node-30", self.query(self.store, generate_filters(["doc-11"])).ids)
+
+    def test_deleted_nodes_are_never_returned(self):
+        self.query_embedding = self.embeddings[42]
+        self.store.delete("doc-14")
+        self.store.delete_nodes(node_ids=["node-43", "node-44"])
+        deleted = {"node-42", "node-43", "node-44"}
+
+        self.assertFalse(deleted & set(self.query(self.store, top_k=NODES).ids))
+        self.assertFalse(deleted & set(self.query(self.store, generate_filters([]), top_k=NODES).ids))
+        self.assertEqual(len(self.query(self.store, top_k=NODES).ids), NODES - 3)
+
+        persist_path = os.path.join(self.tmp_dir, "default__vector_store.json")
+        self.store.persist(persist_path)
+        reloaded = type(self.store).from_persist_path(persist_path)
+        self.assertFalse(deleted & set(self.query(reloaded, top_k=NODES).ids))
+
+    def test_persist_and_reload(self):
+        persist_path = os.path.join(self.tmp_dir, "default__vector_store.json")
+        self.store.persist(persist_path)
+        reloaded = type(self.store).from_persist_path(persist_path)
+
+        for filters in (None, generate_filters([]), generate_filters(["doc-10"])):
+            expected = self.query(self.store, filters)
+            result = self.query(reloaded, filters)
+            self.assertEqual(result.ids, expected.ids)
+            np.testing.assert_allclose(result.similarities, expected.similarities, rtol=1e-5)
+
+
+class NumpyVectorStoreTest(VectorStoreTests, unittest.TestCase):
+    def create_store(self) -> LabeledVectorStore:
+        return NumpyVectorStore()
+
+    def test_reloaded_matrix_is_memory_mapped(self):
+        persist_path = os.path.join(self.tmp_dir, "default__vector_store.json")
+        self.store.persist(persist_path)
+        reloaded = NumpyVectorStore.from_persist_path(persist_path)
+        self.assertIsInstance(reloaded.client, np.memmap)
+
+    def test_batch_query(self):
+        queries = [self.embeddings[i].tolist() for i in (1, 2, 3)]
+        results = self.store.batch_query(queries, TOP_K, generate_filters([]))
+        self.assertEqual([result.ids[0] for result in results], ["node-1", "node-2", "node-3"])
+
+
+@unittest.skipIf(importlib.util.find_spec("hnswlib") is None, "hnswlib is not installed")
+class HNSWVectorStoreTest(VectorStoreTests, unittest.TestCase):
+    def create_store(self) -> LabeledVectorStore:
+        from app.engine.vector_stores.hnsw import HNSWVectorStore
+
+        return HNSWVectorStore()
+
+    def test_filter_smaller_than_k_uses_the_exact_search(self):
+        from app.engine.vector_stores import hnsw
+
+        # Only the 3 chunks of doc-20 match
+        filters = MetadataFilters.from_dicts([{"key": "doc_id", "value": "doc-20"}])
+        expected = self.get_exact_ids({60, 61, 62})
+        with mock.patch.object(hnsw, "EXACT_SEARCH_MAX_NODES", 0):
+            # The graph search doesn't reach k matching nodes
+            with mock.patch.object(
+                hnsw.HNSWVectorStore, "_graph_search", side_effect=RuntimeError("Cannot return the results")
+            ):
+                self.assertEqual(self.query(self.store, filters, top_k=10).ids, expected)
+            self.assertEqual(self.query(self.store, filters, top_k=10).ids, expected)
+        self.assertEqual(self.query(self.store, filters, top_k=10).ids, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()